@@ -28,14 +28,22 @@
 
 from __future__ import absolute_import, print_function
 
+import hashlib
+import json
+import os
+import stat
 import sys
 import traceback
 try:
     # absolute import
     import isafw.isaplugins as isaplugins
+    from isafw.isaplugins import _walk
+    from isafw.isaplugins import _writers
 except ImportError:
     # relative import when installing as separate modules
     import isaplugins
+    from isaplugins import _walk
+    from isaplugins import _writers
 try:
     from bb import error
 except ImportError:
@@ -46,7 +54,11 @@ __all__ = [
     'ISA_pkg_list',
     'ISA_kernel',
     'ISA_filesystem',
+    'ISA_inventory',
+    'ISA_manifest',
     'ISA_config',
+    'ISA_writer',
+    'ISA_writers',
     'ISA',
 ]
 
@@ -83,6 +95,11 @@ class ISA_kernel:
     img_name = ""
     # path to the kernel config file      (mandatory argument)
     path_to_config = ""
+    # machine the kernel is built for, names its column in the matrix
+    # report of ISA.process_kernels()     (optional, img_name by default)
+    machine = ""
+    # architecture of the kernel          (optional, ISA_config.arch by default)
+    arch = ""
 
 # filesystem
 
@@ -93,6 +110,140 @@ class ISA_filesystem:
     type = ""                     # filesystem type
     # path to the fs location             (mandatory argument)
     path_to_fs = ""
+    manifest = None               # ISA_manifest of the scan, set by ISA.process_filesystem()
+    shard_index = 0               # shard of the files analyzed by this scan, from 0 to shard_count - 1
+    shard_count = 1               # number of shards the scan of the filesystem is split into
+    pseudo_db = ""                # pseudo files.db with the real ownership and modes of the files, if any
+
+# inventory of the files of a filesystem
+# the tree is walked and stat'ed once per image, and the same inventory is
+# given to the manifest and to every plugin with process_inventory().
+# Entries are in the order of os.walk(): each directory below the root is
+# followed by its files, and then by its subdirectories. Symlinks to
+# directories are left out, as os.walk() neither lists nor follows them.
+# paths are the absolute paths the plugins analyze, and the stat data is
+# that of os.lstat().
+
+ISA_inventory_entry = _walk.Entry
+
+
+class ISA_inventory:
+
+    def __init__(self, path_to_fs, entries):
+        self.path_to_fs = path_to_fs
+        self.entries = tuple(entries)
+
+    @classmethod
+    def scan(cls, path_to_fs, workers=0):
+        # workers is the number of threads reading directories
+        return cls(path_to_fs, _walk.walk(path_to_fs, workers))
+
+    def get_files(self):
+        # entries of everything but directories
+        return [entry for entry in self.entries if not stat.S_ISDIR(entry.mode)]
+
+# manifest of an analyzed filesystem
+# it records the files of an image together with the per-plugin results
+# and is the baseline of a later differential scan of a similar image:
+# plugins only analyze files that were added or changed since the
+# baseline and carry forward the previous results of unchanged ones
+
+
+class ISA_manifest:
+    version = 2
+
+    def __init__(self, baseline=None):
+        self.baseline = baseline
+        # relative path -> [mode, uid, gid, size, mtime, content id]
+        self.files = {}
+        # plugin name -> {relative path: result}
+        self.results = {}
+        # plugin name -> settings the results were produced with
+        self.configs = {}
+        # relative paths of files unchanged since the baseline
+        self.unchanged = set()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get("version") != cls.version:
+            raise ValueError("Unsupported manifest version in " + path)
+        manifest = cls()
+        manifest.files = data["files"]
+        manifest.results = data["results"]
+        manifest.configs = data["configs"]
+        return manifest
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({"version": self.version, "files": self.files,
+                       "results": self.results, "configs": self.configs}, f)
+
+    def scan(self, path_to_fs, inventory=None, workers=0):
+        baseline_files = self.baseline.files if self.baseline else {}
+        if inventory is None:
+            inventory = ISA_inventory.scan(path_to_fs, workers)
+        for st in inventory.entries:
+            path = st.path
+            rel = path.replace(path_to_fs, "")
+            entry = [st.mode, st.uid, st.gid, st.size, st.mtime, ""]
+            self.files[rel] = entry
+            previous = baseline_files.get(rel)
+            if not (stat.S_ISREG(st.mode) or stat.S_ISLNK(st.mode)):
+                # only the metadata of directories and special files matters
+                if previous is not None and previous[:3] == entry[:3]:
+                    self.unchanged.add(rel)
+                continue
+            if previous is not None and previous[:5] == entry[:5]:
+                entry[5] = previous[5]
+                self.unchanged.add(rel)
+                continue
+            # the content is only read for added or changed files
+            entry[5] = _content_id(path, st.mode)
+            if (previous is not None and previous[:4] == entry[:4] and
+                    previous[5] and previous[5] == entry[5]):
+                self.unchanged.add(rel)
+
+    def is_unchanged(self, rel):
+        return rel in self.unchanged
+
+    def get_previous_result(self, plugin, rel, default=None):
+        # returns None if there is no previous result to carry forward,
+        # default if the plugin recorded no result for an unchanged file
+        if rel not in self.unchanged or not self.has_previous_results(plugin):
+            return None
+        return self.baseline.results[plugin].get(rel, default)
+
+    def has_previous_results(self, plugin):
+        # results are only carried forward if the baseline was analyzed
+        # with the same settings, see set_config()
+        return (self.baseline is not None and plugin in self.baseline.results and
+                self.baseline.configs.get(plugin) == self.configs.get(plugin))
+
+    def set_config(self, plugin, config):
+        # config is a JSON serializable value of the plugin settings that
+        # change its results, e.g. the checks it runs
+        self.configs[plugin] = config
+
+    def set_result(self, plugin, rel, result):
+        self.results.setdefault(plugin, {})[rel] = result
+
+
+def _content_id(path, mode):
+    try:
+        if stat.S_ISLNK(mode):
+            return "link:" + os.readlink(path)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return "sha256:" + digest.hexdigest()
+    except (IOError, OSError):
+        return ""
 
 # configuration of ISAFW
 # if both whitelist and blacklist is empty, all avaliable plugins will be used
@@ -110,10 +261,36 @@ class ISA_config:
     logdir = ""                   # location of produced logs
     timestamp = ""                # timestamp of the build provided by build system
     full_reports = False          # produce full reports for plugins, False by default
+    manifests = False             # write a manifest of each filesystem for later differential scans
     machine = ""                  # name of machine build is produced for
     la_plugin_image_whitelist = ""# whitelist of images for violating license checks
     la_plugin_image_blacklist = ""# blacklist of images for violating license checks
     arch = ""                     # target architecture
+    writer_buffer_size = 65536    # bytes buffered per log or report file before it is written out
+    writer_flush_interval = 5     # seconds after which buffered log and report data is written out
+    writers = None                # ISA_writers shared by the plugins, created on first use if not set
+    walk_workers = 8              # threads reading directories when walking a filesystem, 0 for a sequential walk
+    kca_rules_cache_dir = ""      # KCA: directory where the compiled rule sets are kept, disabled if empty
+    kca_workers = 0               # KCA: processes parsing the configs in process_kernels(), 0 for one per CPU
+    cfa_use_file_tool = False     # CFA: detect file types with "file --mime-type" instead of ELF headers
+    cfa_external_tools = False    # CFA: use checksec.sh and execstack instead of the built-in ELF parser
+    cfa_cache_dir = ""            # CFA: directory of the persistent per-file result cache, disabled if empty
+    cfa_cache_max_age = 30        # CFA: days after which unused cache entries are evicted, 0 for no limit
+    cfa_cache_max_entries = 1000000 # CFA: maximal number of cache entries, 0 for no limit
+    cfa_workers = 0               # CFA: number of worker processes, 0 for one per CPU
+    cfa_chunksize = 0             # CFA: number of files sent to a worker at once, 0 to choose automatically
+    cfa_maxtasksperchild = 0      # CFA: files analyzed before a worker is restarted, 0 for no restart
+    cfa_tool_timeout = 600        # CFA: seconds an external tool may run per file, 0 for no limit
+    cfa_tool_timeouts = {}        # CFA: per tool overrides of cfa_tool_timeout, e.g. {"objdump": 60}
+    cfa_tool_max_output = 256 * 1024 * 1024 # CFA: bytes of output read from an external tool, 0 for no limit
+    cfa_tool_batch_size = 64      # CFA: files passed to one run of file, execstack or readelf, 0 to run them per file
+    cfa_tool_batch_timeout = 60   # CFA: seconds one batch run may take at most, a batch stopped by a limit is split up, 0 for no limit
+    cfa_tool_batch_max_output = 256 * 1024 * 1024 # CFA: bytes of output read from one batch run at most, 0 for no limit
+    cfa_checks = ["checksec", "execstack", "nodrop_groups", "mpx"] # CFA: checks to run, e.g. without "mpx" for targets without MPX
+
+ISA_writer = _writers.ISA_writer
+ISA_writers = _writers.ISA_writers
+
 
 class ISA:
     def call_plugins(self, methodname, *parameters, **keywords):
@@ -127,20 +304,37 @@ class ISA:
                           "Skipping this plugin." %
                           (methodname, plugin.getPluginName()))
                 continue
-            if self.ISA_config.plugin_whitelist and plugin.getPluginName() not in self.ISA_config.plugin_whitelist:
+            if not self._is_enabled(plugin):
                 continue
-            if self.ISA_config.plugin_blacklist and plugin.getPluginName() in self.ISA_config.plugin_blacklist:
-                continue
-            try:
-                method(*parameters, **keywords)
-            except:
-                error("Exception in plugin %s %s():\n%s" %
-                      (plugin.getPluginName(),
-                       methodname,
-                       traceback.format_exc()))
+            self._call_plugin(plugin, methodname, *parameters, **keywords)
+        # logs and reports are complete on disk after each callback
+        self.ISA_config.writers.flush()
+
+    def _enabled_plugins(self):
+        for name in isaplugins.__all__:
+            plugin = getattr(isaplugins, name)
+            if self._is_enabled(plugin):
+                yield plugin
+
+    def _is_enabled(self, plugin):
+        if self.ISA_config.plugin_whitelist and plugin.getPluginName() not in self.ISA_config.plugin_whitelist:
+            return False
+        if self.ISA_config.plugin_blacklist and plugin.getPluginName() in self.ISA_config.plugin_blacklist:
+            return False
+        return True
+
+    def _call_plugin(self, plugin, methodname, *parameters, **keywords):
+        try:
+            getattr(plugin, methodname)(*parameters, **keywords)
+        except:
+            error("Exception in plugin %s %s():\n%s" %
+                  (plugin.getPluginName(),
+                   methodname,
+                   traceback.format_exc()))
 
     def __init__(self, ISA_config):
         self.ISA_config = ISA_config
+        _writers.get_writers(ISA_config)
         self.call_plugins("init", ISA_config)
 
     def process_package(self, ISA_package):
@@ -152,8 +346,120 @@ class ISA:
     def process_kernel(self, ISA_kernel):
         self.call_plugins("process_kernel", ISA_kernel)
 
-    def process_filesystem(self, ISA_filesystem):
-        self.call_plugins("process_filesystem", ISA_filesystem)
+    def process_kernels(self, ISA_kernels, per_image_reports=False):
+        # several kernels, e.g. the same kernel built for many machines.
+        # Plugins with process_kernels() analyze them together and write
+        # one report comparing them, with the reports of process_kernel()
+        # for each kernel too if per_image_reports is set. The others get
+        # the kernels one after another.
+        ISA_kernels = list(ISA_kernels)
+        for plugin in self._enabled_plugins():
+            if getattr(plugin, "process_kernels", None):
+                self._call_plugin(plugin, "process_kernels", ISA_kernels, per_image_reports)
+            elif getattr(plugin, "process_kernel", None):
+                for ISA_kernel in ISA_kernels:
+                    self._call_plugin(plugin, "process_kernel", ISA_kernel)
+        self.ISA_config.writers.flush()
+
+    def process_filesystem(self, ISA_filesystem, baseline=None, shard=None):
+        # baseline is the ISA_manifest or the manifest file of an earlier
+        # scan, only files changed since then are analyzed again
+        # shard is a (shard index, shard count) pair, a sharded scan only
+        # analyzes its part of the files and writes partial results that
+        # are combined by merge_filesystem_shards()
+        if shard is not None:
+            ISA_filesystem.shard_index, ISA_filesystem.shard_count = shard
+        if not self._check_shard(ISA_filesystem):
+            return
+        inventory = self._prepare_filesystem(ISA_filesystem, baseline)
+        for plugin in self._enabled_plugins():
+            # plugins with process_inventory() get the files of the
+            # filesystem instead of walking it themselves
+            if inventory is not None and getattr(plugin, "process_inventory", None):
+                self._call_plugin(plugin, "process_inventory", ISA_filesystem, inventory)
+            elif getattr(plugin, "process_filesystem", None):
+                self._call_plugin(plugin, "process_filesystem", ISA_filesystem)
+        self.ISA_config.writers.flush()
+        self._save_manifest(ISA_filesystem)
+
+    def process_filesystems(self, ISA_filesystems, baselines=None):
+        # several images are analyzed at the same time, each with the same
+        # reports as from process_filesystem(). baselines has the baseline
+        # of each image, or None. Plugins with process_filesystems() share
+        # their workers between the images, the others get the images one
+        # after another.
+        ISA_filesystems = list(ISA_filesystems)
+        if baselines is None:
+            baselines = [None] * len(ISA_filesystems)
+        images = [(ISA_filesystem, baseline) for ISA_filesystem, baseline in zip(ISA_filesystems, baselines)
+                  if self._check_shard(ISA_filesystem)]
+        if not images:
+            return
+        ISA_filesystems = [ISA_filesystem for ISA_filesystem, baseline in images]
+        # inventories of the images, None for images not read from a directory
+        inventories = [self._prepare_filesystem(ISA_filesystem, baseline)
+                       for ISA_filesystem, baseline in images]
+        for plugin in self._enabled_plugins():
+            if getattr(plugin, "process_filesystems", None):
+                self._call_plugin(plugin, "process_filesystems", ISA_filesystems, inventories)
+                continue
+            for ISA_filesystem, inventory in zip(ISA_filesystems, inventories):
+                if inventory is not None and getattr(plugin, "process_inventory", None):
+                    self._call_plugin(plugin, "process_inventory", ISA_filesystem, inventory)
+                elif getattr(plugin, "process_filesystem", None):
+                    self._call_plugin(plugin, "process_filesystem", ISA_filesystem)
+        self.ISA_config.writers.flush()
+        for ISA_filesystem in ISA_filesystems:
+            self._save_manifest(ISA_filesystem)
+
+    def _check_shard(self, ISA_filesystem):
+        if not 0 <= ISA_filesystem.shard_index < ISA_filesystem.shard_count:
+            error("Invalid shard %d of %d, not performing the call." %
+                  (ISA_filesystem.shard_index, ISA_filesystem.shard_count))
+            return False
+        return True
+
+    def _prepare_filesystem(self, ISA_filesystem, baseline):
+        # returns the inventory of the filesystem if it is a directory and
+        # a plugin or the manifest needs it, None otherwise
+        inventory = None
+        ISA_filesystem.manifest = None
+        if baseline is not None and not isinstance(baseline, ISA_manifest):
+            try:
+                baseline = ISA_manifest.load(baseline)
+            except (IOError, OSError, ValueError, KeyError):
+                error("Not able to load the baseline manifest, analyzing all files:\n%s" %
+                      traceback.format_exc())
+                baseline = None
+        use_manifest = baseline is not None or self.ISA_config.manifests
+        if use_manifest and not os.path.isdir(ISA_filesystem.path_to_fs):
+            # archives are read as a stream by the plugins, there are no
+            # files on disk to compare with the baseline
+            error("Manifests and baselines are only supported for filesystems in a "
+                  "directory, analyzing all files of %s" % ISA_filesystem.path_to_fs)
+            use_manifest = False
+        if os.path.isdir(ISA_filesystem.path_to_fs) and (use_manifest or any(
+                getattr(plugin, "process_inventory", None) for plugin in self._enabled_plugins())):
+            inventory = ISA_inventory.scan(ISA_filesystem.path_to_fs, self.ISA_config.walk_workers)
+        if use_manifest:
+            manifest = ISA_manifest(baseline)
+            manifest.scan(ISA_filesystem.path_to_fs, inventory)
+            ISA_filesystem.manifest = manifest
+        return inventory
+
+    def _save_manifest(self, ISA_filesystem):
+        if ISA_filesystem.manifest and self.ISA_config.manifests:
+            ISA_filesystem.manifest.save(self.ISA_config.reportdir + "/isafw_manifest_" +
+                                         self.ISA_config.machine + "_" +
+                                         self.ISA_config.timestamp + "_" +
+                                         ISA_filesystem.img_name)
+
+    def merge_filesystem_shards(self, ISA_filesystem, partial_reports):
+        # partial_reports are the partial result files written by all
+        # shards of a scan, the plugins write the same reports as an
+        # unsharded scan from them
+        self.call_plugins("merge_filesystem_shards", ISA_filesystem, partial_reports)
 
     def process_report(self):
         self.call_plugins("process_report")
+        self.ISA_config.writers.close()
@@ -28,10 +28,20 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import subprocess
+import collections
+import io
 import os
 import sys
 import re
 import copy
+import signal
+import functools
+import itertools
+import stat
+import tempfile
+import threading
+import time
+import traceback
 try:
     from lxml import etree
 except ImportError:
@@ -39,230 +49,855 @@ except ImportError:
         import xml.etree.cElementTree as etree
     except ImportError:
         import xml.etree.ElementTree as etree
+try:
+    from . import _cache
+    from . import _findings
+    from . import _elf
+    from . import _fssource
+    from . import _walk
+    from . import _writers
+except (ImportError, ValueError):
+    import _cache
+    import _findings
+    import _elf
+    import _fssource
+    import _walk
+    import _writers
 
 
 CFChecker = None
+# version of the per-file results stored in the result cache,
+# to be increased whenever the analysis of a file changes
+CACHE_VERSION = "1"
+# bound for the length of file names passed to one external tool run
+MAX_BATCH_ARGS_LENGTH = 64 * 1024
+# bounds for the archive members sent to a worker at once
+MAX_BATCH_MEMBERS = 64
+MAX_BATCH_DATA = 16 * 1024 * 1024
+
+
+# categories of findings, in the order of the reports
+CATEGORIES = ("no_relro", "partial_relro", "no_canary", "no_pie", "execstack",
+              "execstack_not_defined", "nodrop_groups", "no_mpx", "tool_failures")
+
+# checks that can be selected with ISA_config.cfa_checks, and the
+# categories of findings they report
+CHECKS = ("checksec", "execstack", "nodrop_groups", "mpx")
+CHECK_CATEGORIES = {
+    "checksec": ("no_relro", "partial_relro", "no_canary", "no_pie"),
+    "execstack": ("execstack", "execstack_not_defined"),
+    "nodrop_groups": ("nodrop_groups",),
+    "mpx": ("no_mpx",),
+}
+
+# FileResult.flags
+EXECSTACK = 0x01
+EXECSTACK_NOT_DEFINED = 0x02
+NODROP_GROUPS = 0x04
+NO_MPX = 0x08
+FROM_CACHE = 0x10
+# file of another shard, not analyzed by this scan
+OTHER_SHARD = 0x20
+# ELF executable or shared object that went through the checks
+ANALYZED = 0x40
+
+
+class FileResult(object):
+    # Result of the analysis of a single file. It is sent from the workers
+    # to process_results() and only kept until it has been reported.
+    __slots__ = ("path", "security_flags", "flags", "log", "digest", "failures", "costs")
+
+    def __init__(self, path):
+        self.path = path
+        # checksec fields, or an error message if they could not be fetched
+        self.security_flags = ()
+        self.flags = 0
+        self.log = "File from map " + path
+        # content digest (if caching)
+        self.digest = ""
+        # tools that were stopped because of a time or output limit
+        self.failures = []
+        # seconds spent in each check, if the file was analyzed
+        self.costs = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def copy(self, path):
+        result = FileResult.__new__(FileResult)
+        result.__setstate__(self.__getstate__())
+        result.path = path
+        return result
+
+    def set_flag(self, flag, value=True):
+        if value:
+            self.flags |= flag
+        else:
+            self.flags &= ~flag
+
+    def has_flag(self, flag):
+        return bool(self.flags & flag)
+
+    def get_execstack(self):
+        if self.flags & EXECSTACK:
+            return "execstack"
+        if self.flags & EXECSTACK_NOT_DEFINED:
+            return "not_defined"
+        return ""
+
+    def set_execstack(self, value):
+        self.set_flag(EXECSTACK, value == "execstack")
+        self.set_flag(EXECSTACK_NOT_DEFINED, value == "not_defined")
+
+    def add_cost(self, check, seconds):
+        if self.costs is None:
+            self.costs = {}
+        self.costs[check] = self.costs.get(check, 0) + seconds
+
+    def format_security_flags(self):
+        if isinstance(self.security_flags, tuple):
+            return str(list(self.security_flags))
+        return str(self.security_flags)
+
+    def get_cache_entry(self):
+        security_flags = self.security_flags
+        if isinstance(security_flags, tuple):
+            security_flags = list(security_flags)
+        return [security_flags, self.get_execstack(),
+                self.has_flag(NODROP_GROUPS), self.has_flag(NO_MPX)]
+
+    def set_cache_entry(self, entry):
+        security_flags, execstack, nodrop_groups, no_mpx = entry
+        # entries are decoded from JSON, which gives unicode strings on Python 2
+        if isinstance(security_flags, list):
+            security_flags = tuple(str(flag) for flag in security_flags)
+        else:
+            security_flags = str(security_flags)
+        self.security_flags = security_flags
+        self.set_flag(ANALYZED)
+        self.set_execstack(execstack)
+        self.set_flag(NODROP_GROUPS, nodrop_groups)
+        self.set_flag(NO_MPX, no_mpx)
+
+
+class ImageScan(object):
+    # state of the analysis of one image, so that several images can be
+    # analyzed at the same time by one checker
+
+    def __init__(self, ISA_filesystem, inventory=None):
+        self.ISA_filesystem = ISA_filesystem
+        # ISA_inventory of the files, if given by ISA
+        self.inventory = inventory
+        self.findings = _findings.Findings(CATEGORIES)
+        self.tool_failure_counts = {}
+        # seconds spent in each check, summed over the analyzed files
+        self.check_costs = {}
+        self.cache = None
 
 
 class ISA_CFChecker():
     initialized = False
-    no_relro = []
-    partial_relro = []
-    no_canary = []
-    no_pie = []
-    execstack = []
-    execstack_not_defined = []
-    nodrop_groups = []
-    no_mpx = []
 
     def __init__(self, ISA_config):
         self.proxy = ISA_config.proxy
         self.logfile = ISA_config.logdir + "/isafw_cfalog"
+        self.writers = _writers.get_writers(ISA_config)
         self.full_report_name = ISA_config.reportdir + "/cfa_full_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
         self.problems_report_name = ISA_config.reportdir + \
             "/cfa_problems_report_" + ISA_config.machine + "_" + ISA_config.timestamp
+        self.partial_report_name = ISA_config.reportdir + \
+            "/cfa_partial_report_" + ISA_config.machine + "_" + ISA_config.timestamp
         self.full_reports = ISA_config.full_reports
-        self.ISA_filesystem = ""
+        self.walk_workers = ISA_config.walk_workers
+        self.cache_dir = ISA_config.cfa_cache_dir
+        self.cache_max_age = ISA_config.cfa_cache_max_age
+        self.cache_max_entries = ISA_config.cfa_cache_max_entries
+        # checks are run in the order of CHECKS
+        self.checks = tuple(check for check in CHECKS if check in ISA_config.cfa_checks)
+        unknown_checks = [check for check in ISA_config.cfa_checks if check not in CHECKS]
+        self.base_cache_version = CACHE_VERSION + ("-external" if ISA_config.cfa_external_tools else "")
+        if self.checks != CHECKS:
+            # results of fewer checks must not be taken for complete ones
+            self.base_cache_version += "-" + ",".join(self.checks)
+        self.cache_version = self.base_cache_version
+        self.tools = get_tools(ISA_config.cfa_use_file_tool, ISA_config.cfa_external_tools,
+                               self.checks)
+        self.workers = ISA_config.cfa_workers
+        self.chunksize = ISA_config.cfa_chunksize
+        self.maxtasksperchild = ISA_config.cfa_maxtasksperchild
+        self.tool_batch_size = 0
+        if ISA_config.cfa_use_file_tool or ISA_config.cfa_external_tools:
+            self.tool_batch_size = ISA_config.cfa_tool_batch_size
+        # options passed to process_files() for every batch of files
+        self.process_options = {
+            "use_file_tool": ISA_config.cfa_use_file_tool,
+            "external_tools": ISA_config.cfa_external_tools,
+            "cache_file": "",
+            "cache_version": self.cache_version,
+            "checks": self.checks,
+            "tool_limits": {
+                "timeout": ISA_config.cfa_tool_timeout,
+                "timeouts": ISA_config.cfa_tool_timeouts,
+                "max_output": ISA_config.cfa_tool_max_output,
+                "batch_timeout": ISA_config.cfa_tool_batch_timeout,
+                "batch_max_output": ISA_config.cfa_tool_batch_max_output,
+            },
+        }
+        if self.cache_dir:
+            self.process_options["cache_file"] = os.path.join(self.cache_dir, "cfa_cache.sqlite")
         # check that checksec and other tools are installed
-        tools_errors = _check_tools()
+        tools_errors = _check_tools(self.tools)
         if tools_errors:
-            with open(self.logfile, 'w') as flog:
+            with self.writers.open(self.logfile, 'w') as flog:
                 flog.write(tools_errors)
                 return
         self.initialized = True
-        with open(self.logfile, 'w') as flog:
+        with self.writers.open(self.logfile, 'w') as flog:
             flog.write("\nPlugin ISA_CFChecker initialized!\n")
+            if unknown_checks:
+                flog.write("Ignoring unknown checks: " + ", ".join(unknown_checks) + "\n")
         return
 
-    def process_filesystem(self, ISA_filesystem):
-        self.ISA_filesystem = ISA_filesystem
-        fs_path = self.ISA_filesystem.path_to_fs
-        img_name = self.ISA_filesystem.img_name
+    def process_filesystem(self, ISA_filesystem, pool=None, inventory=None):
+        scan = ImageScan(ISA_filesystem, inventory)
+        fs_path = ISA_filesystem.path_to_fs
+        img_name = ISA_filesystem.img_name
         if (self.initialized):
             if (img_name and fs_path):
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("\n\nFilesystem path is: " + fs_path)
                 if self.full_reports:
-                    with open(self.full_report_name + "_" + img_name, 'w') as ffull_report:
+                    with self.writers.open(self.full_report_name + "_" + img_name, 'w') as ffull_report:
                         ffull_report.write(
                             "Security-relevant flags for executables for image: " + img_name + '\n')
                         ffull_report.write("With rootfs location at " + fs_path + "\n\n")
-                files = self.find_files(fs_path)
-                import multiprocessing
-                pool = multiprocessing.Pool()
-                results = pool.imap(process_file_wrapper, files)
-                pool.close()
-                pool.join()
-                self.process_results(results)
+                own_pool = pool is None
+                if own_pool:
+                    # process_filesystems() has done it for all images
+                    self.update_cache_version()
+                if self.cache_dir:
+                    if not os.path.exists(self.cache_dir):
+                        os.makedirs(self.cache_dir)
+                    scan.cache = _cache.ResultCache(self.process_options["cache_file"],
+                                                    self.cache_version)
+                if own_pool:
+                    pool = self.create_pool()
+                try:
+                    if _fssource.is_archive(fs_path):
+                        self.process_archive(scan, pool, fs_path)
+                    else:
+                        self.process_directory(scan, pool, fs_path)
+                    if own_pool:
+                        pool.close()
+                except:
+                    if own_pool:
+                        pool.terminate()
+                    raise
+                finally:
+                    if own_pool:
+                        pool.join()
             else:
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as image name and path to the filesystem are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Plugin hasn't initialized! Not performing the call.\n")
 
-    def process_results(self, results):
-        fs_path = self.ISA_filesystem.path_to_fs
+    def process_inventory(self, ISA_filesystem, inventory):
+        self.process_filesystem(ISA_filesystem, inventory=inventory)
+
+    def process_filesystems(self, ISA_filesystems, inventories=None):
+        if not self.initialized:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("Plugin hasn't initialized! Not performing the call.\n")
+            return
+        # every image is handled by its own thread, while the files of
+        # all images are analyzed by one pool of workers
+        errors = []
+
+        def process(ISA_filesystem, inventory):
+            try:
+                self.process_filesystem(ISA_filesystem, pool, inventory)
+            except Exception:
+                errors.append(ISA_filesystem.img_name)
+                with self.writers.open(self.logfile, 'a') as flog:
+                    flog.write("\n\nError while analyzing image " + str(ISA_filesystem.img_name) +
+                               ":\n" + traceback.format_exc())
+
+        if inventories is None:
+            inventories = [None] * len(ISA_filesystems)
+        self.update_cache_version()
+        pool = self.create_pool()
+        try:
+            threads = [threading.Thread(target=process, args=(ISA_filesystem, inventory))
+                       for ISA_filesystem, inventory in zip(ISA_filesystems, inventories)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        if errors:
+            raise RuntimeError("Analysis failed for images: " + ", ".join(str(e) for e in errors))
+
+    def update_cache_version(self):
+        # Results depend on the versions of the tools that produced them,
+        # so the versions are probed once per scan and are part of the
+        # version of the cached and carried forward results.
+        self.cache_version = self.base_cache_version
+        versions = get_tool_versions(self.tools, self.process_options["tool_limits"])
+        if versions:
+            self.cache_version += "-tools-" + _cache.data_digest(
+                "\n".join(versions).encode("utf-8"))[:16]
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("\nTool versions: " + "; ".join(versions))
+        self.process_options["cache_version"] = self.cache_version
+
+    def process_directory(self, scan, pool, fs_path):
+        if scan.inventory is not None:
+            entries = scan.inventory.get_files()
+        else:
+            entries = self.find_files(fs_path)
+        groups = self.group_same_files(entries)
+        skipped = self.get_other_shards(scan, groups)
+        previous = self.get_previous_results(scan, groups, skipped)
+        batches = self.make_batches([paths[0] for paths in groups
+                                     if paths[0] not in previous and paths[0] not in skipped])
+        results = pool.imap(functools.partial(process_files_wrapper,
+                                              **self.process_options),
+                            batches, self.get_chunksize(len(batches)))
+        # results are consumed while the workers keep analyzing
+        results = itertools.chain.from_iterable(results)
+        self.process_results(scan, self.fan_out_results(groups, results, previous, skipped))
+
+    def process_archive(self, scan, pool, fs_path):
+        # rootfs archives are read once, without extracting them, and
+        # their ELF members are analyzed from memory
+        source = _fssource.open_source(fs_path)
+        if self.process_options["use_file_tool"] or self.process_options["external_tools"]:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("\n\nMembers of archives are analyzed with the built-in ELF parser")
+        results = self.analyze_members(pool, self.read_members(scan, source))
+        self.process_results(scan, self.add_link_results(scan, source, results))
+
+    def read_members(self, scan, source):
+        batch = []
+        size = 0
+        for entry, f in source.iter_members():
+            # links are reported once the files they point to are analyzed
+            if entry.hardlink or not (stat.S_ISREG(entry.mode) or
+                                      stat.S_ISCHR(entry.mode) or
+                                      stat.S_ISBLK(entry.mode) or
+                                      stat.S_ISFIFO(entry.mode)):
+                continue
+            data = None
+            if f is not None and self.in_shard(scan, entry.path):
+                ident = f.read(_elf.IDENT_SIZE)
+                if _elf.parse_elf_type(ident) in (_elf.ET_EXEC, _elf.ET_DYN):
+                    data = ident + f.read()
+                    size += len(data)
+            batch.append((entry.path, data, self.in_shard(scan, entry.path)))
+            if len(batch) >= MAX_BATCH_MEMBERS or size >= MAX_BATCH_DATA:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def analyze_members(self, pool, batches):
+        # results are yielded in archive order, while only a few batches
+        # of member data are held in memory at the same time
+        import multiprocessing
+        max_pending = 2 * (self.workers or multiprocessing.cpu_count())
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.apply_async(process_members_wrapper, (batch,),
+                                            self.process_options))
+            while len(pending) >= max_pending:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+
+    def add_link_results(self, scan, source, results):
+        analyzed = {}
+        for result in results:
+            if result.has_flag(ANALYZED):
+                analyzed[result.path] = result
+            yield result
+        for entry in source.entries:
+            if not (entry.hardlink or stat.S_ISLNK(entry.mode)):
+                continue
+            if source.is_directory_link(entry):
+                continue
+            target = source.resolve(entry.path)
+            # links are analyzed by the shard of the file they point to
+            target_entry = source.get_entry(target)
+            if target_entry is not None and stat.S_ISREG(target_entry.mode) and not target_entry.hardlink:
+                shard_path = target
+            else:
+                shard_path = entry.path
+            if not self.in_shard(scan, shard_path):
+                result = FileResult(entry.path)
+                result.set_flag(OTHER_SHARD)
+                yield result
+                continue
+            result = analyzed.get(target)
+            if result is None:
+                yield FileResult(entry.path)
+                continue
+            duplicate = result.copy(entry.path)
+            duplicate.log = "Same file as " + target
+            # the cache and the costs only need to be updated once per file
+            duplicate.digest = ""
+            duplicate.costs = None
+            yield duplicate
+
+    def create_pool(self):
+        import multiprocessing
+        if not self.workers:
+            self.workers = multiprocessing.cpu_count()
+        return multiprocessing.Pool(processes=self.workers,
+                                    maxtasksperchild=self.maxtasksperchild or None)
+
+    def get_chunksize(self, num_files):
+        if self.chunksize:
+            return self.chunksize
+        # same heuristic as multiprocessing.Pool.map(), bounded so that
+        # results keep arriving steadily for big images
+        chunksize, extra = divmod(num_files, self.workers * 4)
+        if extra:
+            chunksize += 1
+        return max(1, min(chunksize, 64))
+
+    def make_batches(self, files):
+        # external tools are run once for a batch of files
+        if not self.tool_batch_size:
+            return [[f] for f in files]
+        batches = []
+        batch = []
+        length = 0
+        for f in files:
+            if batch and (len(batch) >= self.tool_batch_size or
+                          length + len(f) + 1 > MAX_BATCH_ARGS_LENGTH):
+                batches.append(batch)
+                batch = []
+                length = 0
+            batch.append(f)
+            length += len(f) + 1
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def group_same_files(self, entries):
+        # hardlinks and symlinks to the same file are analyzed only once,
+        # only links need a stat call as the entries have the lstat data
+        groups = {}
+        ordered_groups = []
+        num_files = 0
+        for entry in entries:
+            num_files += 1
+            f = entry.path
+            if not stat.S_ISLNK(entry.mode):
+                key = (entry.dev, entry.ino) if stat.S_ISREG(entry.mode) else f
+            else:
+                try:
+                    st = os.stat(f)
+                except OSError:
+                    key = f
+                else:
+                    key = (st.st_dev, st.st_ino) if stat.S_ISREG(st.st_mode) else f
+            paths = groups.get(key)
+            if paths is None:
+                paths = groups[key] = []
+                ordered_groups.append(paths)
+            paths.append(f)
+        with self.writers.open(self.logfile, 'a') as flog:
+            flog.write("\n\n" + str(num_files) + " files found, " +
+                       str(len(ordered_groups)) + " unique files to analyze")
+        return ordered_groups
+
+    def in_shard(self, scan, path):
+        return _findings.in_shard(path, scan.ISA_filesystem.shard_index,
+                                  scan.ISA_filesystem.shard_count)
+
+    def get_other_shards(self, scan, groups):
+        # files with the same content are all analyzed by the shard of
+        # the first of them
+        fs_path = scan.ISA_filesystem.path_to_fs
+        return set(paths[0] for paths in groups
+                   if not self.in_shard(scan, paths[0].replace(fs_path, "")))
+
+    def get_previous_results(self, scan, groups, skipped=()):
+        # results of files unchanged since the baseline of a differential
+        # scan are carried forward instead of analyzing the files again
+        manifest = scan.ISA_filesystem.manifest
+        previous = {}
+        if not manifest:
+            return previous
+        manifest.set_config(getPluginName(), {"checks": list(self.checks),
+                                              "cache_version": self.cache_version})
+        if manifest.baseline and not manifest.has_previous_results(getPluginName()):
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("\n\nBaseline has no results of the same checks, analyzing all files")
+            return previous
+        fs_path = scan.ISA_filesystem.path_to_fs
+        for paths in groups:
+            path = paths[0]
+            if path in skipped:
+                continue
+            # results of links depend on the files they point to
+            if os.path.islink(path):
+                continue
+            entry = manifest.get_previous_result(getPluginName(), path.replace(fs_path, ""))
+            if entry is None:
+                continue
+            result = FileResult(path)
+            result.log += "\nResult carried forward from the baseline"
+            if entry:
+                result.set_cache_entry(entry)
+            previous[path] = result
+        with self.writers.open(self.logfile, 'a') as flog:
+            flog.write("\n\n" + str(len(previous)) + " unique files unchanged since the baseline")
+        return previous
+
+    def fan_out_results(self, groups, results, previous={}, skipped=()):
+        results = iter(results)
+        for paths in groups:
+            result = previous.get(paths[0])
+            if paths[0] in skipped:
+                result = FileResult(paths[0])
+                result.set_flag(OTHER_SHARD)
+            elif result is None:
+                result = next(results)
+            yield result
+            if not result:
+                continue
+            for path in paths[1:]:
+                duplicate = result.copy(path)
+                duplicate.log = "Same file as " + paths[0]
+                # the cache and the costs only need to be updated once per file
+                duplicate.digest = ""
+                duplicate.costs = None
+                yield duplicate
+
+    def get_categories(self, result):
+        categories = []
+        if result.security_flags:
+            if "No RELRO" in result.security_flags:
+                categories.append("no_relro")
+            elif "Partial RELRO" in result.security_flags:
+                categories.append("partial_relro")
+            if "No canary found" in result.security_flags:
+                categories.append("no_canary")
+            if "No PIE" in result.security_flags:
+                categories.append("no_pie")
+        if result.has_flag(EXECSTACK):
+            categories.append("execstack")
+        elif result.has_flag(EXECSTACK_NOT_DEFINED):
+            categories.append("execstack_not_defined")
+        if result.has_flag(NODROP_GROUPS):
+            categories.append("nodrop_groups")
+        if result.has_flag(NO_MPX):
+            categories.append("no_mpx")
+        if result.failures:
+            categories.append("tool_failures")
+        return categories
+
+    def process_results(self, scan, results):
+        fs_path = scan.ISA_filesystem.path_to_fs
+        manifest = scan.ISA_filesystem.manifest
+        sharded = scan.ISA_filesystem.shard_count > 1
+        new_cache_entries = []
+        used_cache_entries = []
+        # position of the result in an unsharded scan
+        sequence = -1
         for result in results:
+            sequence += 1
+            if result and result.has_flag(OTHER_SHARD):
+                continue
             if not result:
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("\nError in returned result")
                 continue
-            with open(self.logfile, 'a') as flog:
-                flog.write("\n\nFor file: " + str(result[0]) + "\nlog is: " + str(result[5]))
-            if result[1]:
-                with open(self.logfile, 'a') as flog:
-                    flog.write("\n\nsec_field: " + str(result[1]))
-                if "No RELRO" in result[1]:
-                    self.no_relro.append(result[0].replace(fs_path, ""))
-                elif "Partial RELRO" in result[1]:
-                    self.partial_relro.append(result[0].replace(fs_path, ""))
-                if "No canary found" in result[1]:
-                    self.no_canary.append(result[0].replace(fs_path, ""))
-                if "No PIE" in result[1]:
-                    self.no_pie.append(result[0].replace(fs_path, ""))
-            if result[2]:
-                if result[2] == "execstack":
-                    self.execstack.append(result[0].replace(fs_path, ""))
-                elif result[2] == "not_defined":
-                    self.execstack_not_defined.append(result[0].replace(fs_path, ""))
-            if result[3] and (result[3] == True):
-                self.nodrop_groups.append(result[0].replace(fs_path, ""))
-            if result[4] and (result[4] == True):
-                self.no_mpx.append(result[0].replace(fs_path, ""))
-            self.write_full_report(result)
-        self.write_report()
-        self.write_report_xml()
-
-    def write_full_report(self, result):
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("\n\nFor file: " + str(result.path) + "\nlog is: " + str(result.log))
+                if result.security_flags:
+                    flog.write("\n\nsec_field: " + result.format_security_flags())
+            categories = self.get_categories(result)
+            if categories:
+                # the relative path is stored once for all its findings
+                index = scan.findings.add_path(result.path.replace(fs_path, ""),
+                                               ", ".join(result.failures),
+                                               sequence if sharded else None)
+                for category in categories:
+                    scan.findings.add(category, index)
+            if result.costs:
+                for check, seconds in result.costs.items():
+                    scan.check_costs[check] = scan.check_costs.get(check, 0) + seconds
+            if manifest and not result.failures:
+                # files that are not ELF executables get an empty result
+                manifest.set_result(getPluginName(), result.path.replace(fs_path, ""),
+                                    result.get_cache_entry() if result.has_flag(ANALYZED) else [])
+            if result.failures:
+                # analysis is incomplete, so the result is not cached
+                for failure in result.failures:
+                    scan.tool_failure_counts[failure] = scan.tool_failure_counts.get(failure, 0) + 1
+            elif result.digest:
+                if result.has_flag(FROM_CACHE):
+                    used_cache_entries.append(result.digest)
+                else:
+                    new_cache_entries.append((result.digest, result.get_cache_entry()))
+            self.write_full_report(scan, result)
+        self.update_cache(scan, new_cache_entries, used_cache_entries)
+        if scan.tool_failure_counts:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("\n\nTools stopped because of limits: " +
+                           ", ".join(failure + " " + str(count) + " times" for failure, count in
+                                     sorted(scan.tool_failure_counts.items())))
+        self.log_check_costs(scan)
+        if sharded:
+            self.write_partial_report(scan)
+        else:
+            self.write_report(scan)
+            self.write_report_xml(scan)
+
+    def write_partial_report(self, scan):
+        img_name = scan.ISA_filesystem.img_name
+        scan.findings.save_partial(
+            self.partial_report_name + "_" + img_name + "_shard_" +
+            str(scan.ISA_filesystem.shard_index) + "_of_" + str(scan.ISA_filesystem.shard_count) + ".json",
+            {"plugin": getPluginName(), "img_name": img_name,
+             "shard_index": scan.ISA_filesystem.shard_index,
+             "shard_count": scan.ISA_filesystem.shard_count,
+             "tool_failure_counts": scan.tool_failure_counts,
+             "check_costs": scan.check_costs})
+
+    def log_check_costs(self, scan):
+        # time spent by the workers in each check, cached and carried
+        # forward results cost nothing
+        with self.writers.open(self.logfile, 'a') as flog:
+            flog.write("\n\nCost of the checks for image " + scan.ISA_filesystem.img_name + ": " +
+                       ", ".join("%s %.3fs" % (check, scan.check_costs.get(check, 0))
+                                 for check in self.checks))
+
+    def merge_filesystem_shards(self, ISA_filesystem, partial_reports):
+        if not self.initialized:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("Plugin hasn't initialized! Not performing the call.\n")
+            return
+        scan = ImageScan(ISA_filesystem)
+        try:
+            partials = _findings.load_partials(partial_reports, getPluginName(),
+                                               ISA_filesystem.img_name)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("\n\nNot able to merge the results of the shards: " + str(e))
+            return
+        scan.findings = _findings.Findings.merge(CATEGORIES, partials)
+        scan.tool_failure_counts = {}
+        for partial in partials:
+            for failure, count in partial["tool_failure_counts"].items():
+                failure = str(failure)
+                scan.tool_failure_counts[failure] = scan.tool_failure_counts.get(failure, 0) + count
+            for check, seconds in partial.get("check_costs", {}).items():
+                check = str(check)
+                scan.check_costs[check] = scan.check_costs.get(check, 0) + seconds
+        with self.writers.open(self.logfile, 'a') as flog:
+            flog.write("\n\nMerged the results of " + str(len(partials)) + " shards")
+        self.log_check_costs(scan)
+        self.write_report(scan)
+        self.write_report_xml(scan)
+
+    def update_cache(self, scan, new_entries, used_entries):
+        if not scan.cache:
+            return
+        scan.cache.put(new_entries)
+        scan.cache.touch(used_entries)
+        scan.cache.evict(self.cache_max_age, self.cache_max_entries)
+        scan.cache.close()
+        scan.cache = None
+        with self.writers.open(self.logfile, 'a') as flog:
+            flog.write("\n\nResult cache: " + str(len(used_entries)) + " hits, " +
+                       str(len(new_entries)) + " new entries")
+
+    def write_full_report(self, scan, result):
         if not self.full_reports:
             return
-        fs_path = self.ISA_filesystem.path_to_fs
-        img_name = self.ISA_filesystem.img_name
-        with open(self.full_report_name + "_" + img_name, 'a') as ffull_report:
-            ffull_report.write('\nFile: ' + result[0].replace(fs_path, ""))
-            ffull_report.write('\nsecurity flags: ' + str(result[1]))
-            ffull_report.write('\nexecstack: ' + str(result[2]))
-            ffull_report.write('\nnodrop_groups: ' + str(result[3]))
-            ffull_report.write('\nno mpx: ' + str(result[4]))
+        fs_path = scan.ISA_filesystem.path_to_fs
+        img_name = scan.ISA_filesystem.img_name
+        with self.writers.open(self.full_report_name + "_" + img_name, 'a') as ffull_report:
+            ffull_report.write('\nFile: ' + result.path.replace(fs_path, ""))
+            if "checksec" in self.checks:
+                ffull_report.write('\nsecurity flags: ' + result.format_security_flags())
+            if "execstack" in self.checks:
+                ffull_report.write('\nexecstack: ' + result.get_execstack())
+            if "nodrop_groups" in self.checks:
+                ffull_report.write('\nnodrop_groups: ' + str(result.has_flag(NODROP_GROUPS)))
+            if "mpx" in self.checks:
+                ffull_report.write('\nno mpx: ' + str(result.has_flag(NO_MPX)))
+            if result.failures:
+                ffull_report.write('\ntools stopped: ' + ", ".join(result.failures))
             ffull_report.write('\n')
 
-    def write_report(self):
-        fs_path = self.ISA_filesystem.path_to_fs
-        img_name = self.ISA_filesystem.img_name
+    def write_report(self, scan):
+        fs_path = scan.ISA_filesystem.path_to_fs
+        img_name = scan.ISA_filesystem.img_name
         with open(self.problems_report_name + "_" + img_name, 'w') as fproblems_report:
             fproblems_report.write("Report for image: " + img_name + '\n')
             fproblems_report.write("With rootfs location at " + fs_path + "\n\n")
-            fproblems_report.write("Relocation Read-Only\n")
-            fproblems_report.write("More information about RELRO and how to enable it:")
-            fproblems_report.write(
-                " http://tk-blog.blogspot.de/2009/02/relro-not-so-well-known-memory.html\n")
-            fproblems_report.write("Files with no RELRO:\n")
-            for item in self.no_relro:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("Files with partial RELRO:\n")
-            for item in self.partial_relro:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("\n\nStack protection\n")
-            fproblems_report.write(
-                "More information about canary stack protection and how to enable it:")
-            fproblems_report.write("https://lwn.net/Articles/584225/ \n")
-            fproblems_report.write("Files with no canary:\n")
-            for item in self.no_canary:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("\n\nPosition Independent Executable\n")
-            fproblems_report.write("More information about PIE protection and how to enable it:")
-            fproblems_report.write(
-                "https://securityblog.redhat.com/2012/11/28/position-independent-executables-pie/\n")
-            fproblems_report.write("Files with no PIE:\n")
-            for item in self.no_pie:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("\n\nNon-executable stack\n")
-            fproblems_report.write("Files with executable stack enabled:\n")
-            for item in self.execstack:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("\n\nFiles with no ability to fetch executable stack status:\n")
-            for item in self.execstack_not_defined:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("\n\nGrop initialization:\n")
-            fproblems_report.write(
-                "If using setuid/setgid calls in code, one must call initgroups or setgroups\n")
-            fproblems_report.write(
-                "Files that don't initialize groups while using setuid/setgid:\n")
-            for item in self.nodrop_groups:
-                fproblems_report.write(item + '\n')
-            fproblems_report.write("\n\nMemory Protection Extensions\n")
-            fproblems_report.write("More information about MPX protection and how to enable it:")
-            fproblems_report.write(
-                "https://software.intel.com/sites/default/files/managed/9d/f6/Intel_MPX_EnablingGuide.pdf\n")
-            fproblems_report.write("Files that don't have MPX protection enabled:\n")
-            for item in self.no_mpx:
-                fproblems_report.write(item + '\n')
-
-    def write_report_xml(self):
-        numTests = len(self.no_relro) + len(self.partial_relro) + len(self.no_canary) + len(self.no_pie) + \
-            len(self.execstack) + len(self.execstack_not_defined) + \
-            len(self.nodrop_groups) + len(self.no_mpx)
+            if "checksec" in self.checks:
+                fproblems_report.write("Relocation Read-Only\n")
+                fproblems_report.write("More information about RELRO and how to enable it:")
+                fproblems_report.write(
+                    " http://tk-blog.blogspot.de/2009/02/relro-not-so-well-known-memory.html\n")
+                fproblems_report.write("Files with no RELRO:\n")
+                for item in scan.findings.get("no_relro"):
+                    fproblems_report.write(item + '\n')
+                fproblems_report.write("Files with partial RELRO:\n")
+                for item in scan.findings.get("partial_relro"):
+                    fproblems_report.write(item + '\n')
+                fproblems_report.write("\n\nStack protection\n")
+                fproblems_report.write(
+                    "More information about canary stack protection and how to enable it:")
+                fproblems_report.write("https://lwn.net/Articles/584225/ \n")
+                fproblems_report.write("Files with no canary:\n")
+                for item in scan.findings.get("no_canary"):
+                    fproblems_report.write(item + '\n')
+                fproblems_report.write("\n\nPosition Independent Executable\n")
+                fproblems_report.write("More information about PIE protection and how to enable it:")
+                fproblems_report.write(
+                    "https://securityblog.redhat.com/2012/11/28/position-independent-executables-pie/\n")
+                fproblems_report.write("Files with no PIE:\n")
+                for item in scan.findings.get("no_pie"):
+                    fproblems_report.write(item + '\n')
+            if "execstack" in self.checks:
+                fproblems_report.write("\n\nNon-executable stack\n")
+                fproblems_report.write("Files with executable stack enabled:\n")
+                for item in scan.findings.get("execstack"):
+                    fproblems_report.write(item + '\n')
+                fproblems_report.write("\n\nFiles with no ability to fetch executable stack status:\n")
+                for item in scan.findings.get("execstack_not_defined"):
+                    fproblems_report.write(item + '\n')
+            if "nodrop_groups" in self.checks:
+                fproblems_report.write("\n\nGrop initialization:\n")
+                fproblems_report.write(
+                    "If using setuid/setgid calls in code, one must call initgroups or setgroups\n")
+                fproblems_report.write(
+                    "Files that don't initialize groups while using setuid/setgid:\n")
+                for item in scan.findings.get("nodrop_groups"):
+                    fproblems_report.write(item + '\n')
+            if "mpx" in self.checks:
+                fproblems_report.write("\n\nMemory Protection Extensions\n")
+                fproblems_report.write("More information about MPX protection and how to enable it:")
+                fproblems_report.write(
+                    "https://software.intel.com/sites/default/files/managed/9d/f6/Intel_MPX_EnablingGuide.pdf\n")
+                fproblems_report.write("Files that don't have MPX protection enabled:\n")
+                for item in scan.findings.get("no_mpx"):
+                    fproblems_report.write(item + '\n')
+            if scan.findings.count("tool_failures"):
+                fproblems_report.write("\n\nIncomplete analysis\n")
+                fproblems_report.write("Analysis tools stopped because of time or output limits: ")
+                fproblems_report.write(", ".join(failure + " " + str(count) + " times" for failure, count in
+                                                 sorted(scan.tool_failure_counts.items())) + "\n")
+                fproblems_report.write("Files that were not fully analyzed:\n")
+                for item, failures in scan.findings.get_details("tool_failures"):
+                    fproblems_report.write(item + " (" + failures + ")" + '\n')
+
+    def write_report_xml(self, scan):
+        numTests = len(scan.findings)
         root = etree.Element('testsuite', name='ISA_CFChecker', tests=str(numTests))
-        if self.no_relro:
-            for item in self.no_relro:
+        if scan.findings.count("no_relro"):
+            for item in scan.findings.get("no_relro"):
                 tcase1 = etree.SubElement(
                     root, 'testcase', classname='files_with_no_RELRO', name=item)
                 etree.SubElement(tcase1, 'failure', message=item, type='violation')
-        if self.partial_relro:
-            for item in self.partial_relro:
+        if scan.findings.count("partial_relro"):
+            for item in scan.findings.get("partial_relro"):
                 tcase1 = etree.SubElement(
                     root, 'testcase', classname='files_with_partial_RELRO', name=item)
                 etree.SubElement(tcase1, 'failure', message=item, type='violation')
-        if self.no_canary:
-            for item in self.no_canary:
+        if scan.findings.count("no_canary"):
+            for item in scan.findings.get("no_canary"):
                 tcase2 = etree.SubElement(
                     root, 'testcase', classname='files_with_no_canary', name=item)
                 etree.SubElement(tcase2, 'failure', message=item, type='violation')
-        if self.no_pie:
-            for item in self.no_pie:
+        if scan.findings.count("no_pie"):
+            for item in scan.findings.get("no_pie"):
                 tcase3 = etree.SubElement(
                     root, 'testcase', classname='files_with_no_PIE', name=item)
                 etree.SubElement(tcase3, 'failure', message=item, type='violation')
-        if self.execstack:
-            for item in self.execstack:
+        if scan.findings.count("execstack"):
+            for item in scan.findings.get("execstack"):
                 tcase5 = etree.SubElement(
                     root, 'testcase', classname='files_with_execstack', name=item)
                 etree.SubElement(tcase5, 'failure', message=item, type='violation')
-        if self.execstack_not_defined:
-            for item in self.execstack_not_defined:
+        if scan.findings.count("execstack_not_defined"):
+            for item in scan.findings.get("execstack_not_defined"):
                 tcase6 = etree.SubElement(
                     root, 'testcase', classname='files_with_execstack_not_defined', name=item)
                 etree.SubElement(tcase6, 'failure', message=item, type='violation')
-        if self.nodrop_groups:
-            for item in self.nodrop_groups:
+        if scan.findings.count("nodrop_groups"):
+            for item in scan.findings.get("nodrop_groups"):
                 tcase7 = etree.SubElement(
                     root, 'testcase', classname='files_with_nodrop_groups', name=item)
                 etree.SubElement(tcase7, 'failure', message=item, type='violation')
-        if self.no_mpx:
-            for item in self.no_mpx:
+        if scan.findings.count("no_mpx"):
+            for item in scan.findings.get("no_mpx"):
                 tcase8 = etree.SubElement(
                     root, 'testcase', classname='files_with_no_mpx', name=item)
                 etree.SubElement(tcase8, 'failure', message=item, type='violation')
+        if scan.findings.count("tool_failures"):
+            for item, failures in scan.findings.get_details("tool_failures"):
+                item += " (" + failures + ")"
+                tcase9 = etree.SubElement(
+                    root, 'testcase', classname='files_with_incomplete_analysis', name=item)
+                etree.SubElement(tcase9, 'error', message=item, type='tool_limit')
         tree = etree.ElementTree(root)
-        output = self.problems_report_name + "_" + self.ISA_filesystem.img_name + '.xml'
+        output = self.problems_report_name + "_" + scan.ISA_filesystem.img_name + '.xml'
         try:
             tree.write(output, encoding='UTF-8', pretty_print=True, xml_declaration=True)
         except TypeError:
             tree.write(output, encoding='UTF-8', xml_declaration=True)
 
     def find_files(self, init_path):
-        list_of_files = []
-        for (dirpath, dirnames, filenames) in os.walk(init_path):
-            for f in filenames:
-                list_of_files.append(str(dirpath + "/" + f)[:])
-        return list_of_files
+        # entries of everything but directories, streamed while the
+        # directories are still being read
+        for entry in _walk.walk(init_path, self.walk_workers):
+            if not stat.S_ISDIR(entry.mode):
+                yield entry
+
 
+def get_tools(use_file_tool=False, external_tools=False, checks=CHECKS):
+    # the external tools that are run, with how to install them
+    tools = {}
+    if "mpx" in checks:
+        tools["objdump"] = "Please install binutils\n"
+    if external_tools:
+        if "nodrop_groups" in checks:
+            tools["readelf"] = "Please install binutils\n"
+        if "checksec" in checks:
+            tools["checksec.sh"] = "Please install checksec from http://www.trapkit.de/tools/checksec.html\n"
+        if "execstack" in checks:
+            tools["execstack"] = "Please install execstack from prelink package\n"
+    if use_file_tool:
+        tools["file"] = "Please install file\n"
+    return tools
 
-def _check_tools():
+
+def _check_tools(tools):
 
     def _is_in_path(executable):
         "Check for presence of executable in PATH"
@@ -273,12 +908,6 @@ def _check_tools():
                 return True
         return False
 
-    tools = {
-        "checksec.sh": "Please install checksec from http://www.trapkit.de/tools/checksec.html\n",
-        "execstack": "Please install execstack from prelink package\n",
-        "readelf": "Please install binutils\n",
-        "objdump": "Please install binutils\n",
-    }
     output = ""
     for tool in tools:
         if not _is_in_path(tool):
@@ -286,24 +915,181 @@ def _check_tools():
     return output
 
 
-def get_info(tool, args, file_name):
+def get_tool_versions(tools, tool_limits=None):
+    # first line of the --version output of each tool
+    versions = []
+    for tool in sorted(tools):
+        output = run_tool([tool, "--version"], tool_limits, check=False)
+        lines = (output or b"").decode("utf-8", "replace").strip().splitlines()
+        versions.append(tool + ": " + (lines[0].strip() if lines else "unknown"))
+    return versions
+
+
+def get_tool_limits(tool, tool_limits):
+    if not tool_limits:
+        return 0, 0
+    timeout = tool_limits.get("timeouts", {}).get(tool, tool_limits.get("timeout", 0))
+    return timeout, tool_limits.get("max_output", 0)
+
+
+def run_tool(cmd, tool_limits=None, failures=None, stop_at=None, check=True):
+    # Runs an external tool within its time and output size limits and
+    # returns its output, or None if the tool failed. Tools stopped
+    # because of a limit are recorded in failures. If stop_at is given,
+    # only the first output line matching it is returned and the tool
+    # is stopped there. With check=False the output is returned even if
+    # the tool exits with an error.
+    tool = os.path.basename(cmd[0])
+    timeout, max_output = get_tool_limits(tool, tool_limits)
     env = copy.deepcopy(os.environ)
     env['PSEUDO_UNLOAD'] = "1"
-    cmd = [tool, args, file_name]
     with open(os.devnull, 'wb') as DEVNULL:
         try:
-            result = subprocess.check_output(cmd, stderr=DEVNULL, env=env).decode('utf-8')
+            # own process group, so that tools implemented as scripts are
+            # stopped together with the programs they run
+            popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=DEVNULL, env=env,
+                                     preexec_fn=os.setsid)
         except:
-            return ""
+            return None
+        timed_out = []
+
+        def kill():
+            try:
+                os.killpg(popen.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        def kill_on_timeout():
+            timed_out.append(True)
+            kill()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, kill_on_timeout)
+            timer.daemon = True
+            timer.start()
+        output = []
+        size = 0
+        state = ""
+        stopped = False
+        try:
+            for line in iter(lambda: popen.stdout.readline(65536), b''):
+                size += len(line)
+                if max_output and size > max_output:
+                    state = "output limit"
+                    break
+                if not stop_at:
+                    output.append(line)
+                elif stop_at(line):
+                    output.append(line)
+                    stopped = True
+                    break
+            if state or stopped:
+                kill()
+            popen.stdout.close()
+            returncode = popen.wait()
+        finally:
+            if timer:
+                timer.cancel()
+    if timed_out:
+        state = "timeout"
+    if state:
+        if failures is not None:
+            failures.append(tool + ": " + state)
+        return None
+    if check and returncode != 0 and not stopped:
+        return None
+    return b"".join(output)
+
+
+def scale_tool_limits(tool_limits, num_files):
+    # limits of one run for num_files files: the per file limits add up,
+    # but only to the absolute limits of a batch run
+    if not tool_limits:
+        return tool_limits
+
+    def scale(limit, batch_limit):
+        limit *= num_files
+        if batch_limit and (not limit or limit > batch_limit):
+            return batch_limit
+        return limit
+    batch_timeout = tool_limits.get("batch_timeout", 0)
+    return {
+        "timeout": scale(tool_limits.get("timeout", 0), batch_timeout),
+        "timeouts": dict((tool, scale(timeout, batch_timeout)) for tool, timeout in
+                         tool_limits.get("timeouts", {}).items()),
+        "max_output": scale(tool_limits.get("max_output", 0),
+                            tool_limits.get("batch_max_output", 0)),
+    }
+
+
+def run_tool_batch(cmd, targets, tool_limits, split_output):
+    # Runs cmd once for all (result, file) targets and returns the part of
+    # the output belonging to each target. split_output maps the output
+    # of a batch run to a dictionary of file name to output. A batch run
+    # stopped by a limit is split in halves, until the file that hit the
+    # limit runs alone with the per file limits, so it is not run again
+    # after it timed out. If the batch run fails otherwise, the tool is
+    # run once per file.
+    files = [file for result, file in targets]
+    if len(files) > 1:
+        failures = []
+        output = run_tool(cmd + files, scale_tool_limits(tool_limits, len(files)), failures,
+                          check=False)
+        if output is not None:
+            outputs = split_output(output.decode('utf-8', 'replace'))
+            return [outputs.get(file, "") for file in files]
+        if failures:
+            half = len(targets) // 2
+            return (run_tool_batch(cmd, targets[:half], tool_limits, split_output) +
+                    run_tool_batch(cmd, targets[half:], tool_limits, split_output))
+    outputs = []
+    for result, file in targets:
+        output = run_tool(cmd + [file], tool_limits, result.failures)
+        outputs.append(output.decode('utf-8', 'replace') if output is not None else "")
+    return outputs
+
+
+def split_file_output(output):
+    # "file --mime-type -0" prints "name\0: type" lines
+    outputs = {}
+    for line in output.splitlines():
+        name, sep, file_type = line.partition("\0")
+        if sep:
+            outputs[name] = line
+    return outputs
+
+
+def split_execstack_output(output):
+    # "execstack -q" prints "<status> name" lines
+    outputs = {}
+    for line in output.splitlines():
+        if len(line) > 2:
+            outputs[line[2:]] = line
+    return outputs
+
+
+def split_readelf_output(output):
+    # readelf starts the output for each of several files with "File: name"
+    outputs = {}
+    name = None
+    lines = []
+    for line in output.splitlines(True):
+        if line.startswith("File: "):
+            if name is not None:
+                outputs[name] = "".join(lines)
+            name = line[len("File: "):].rstrip("\n")
+            lines = []
         else:
-            return result
+            lines.append(line)
+    if name is not None:
+        outputs[name] = "".join(lines)
+    return outputs
 
-def get_security_flags(file_name):
-    env = copy.deepcopy(os.environ)
-    env['PSEUDO_UNLOAD'] = "1"
-    cmd = ['checksec.sh', '--file', file_name]
+
+def get_security_flags(file_name, tool_limits=None, failures=None):
+    result = run_tool(['checksec.sh', '--file', file_name], tool_limits, failures)
     try:
-        result = subprocess.check_output(cmd, env=env).decode('utf-8').splitlines()[1]
+        result = result.decode('utf-8', 'replace').splitlines()[1]
     except:
         return "Not able to fetch flags"
     else:
@@ -312,62 +1098,238 @@ def get_security_flags(file_name):
         return re.split(r' {2,}', result)[:-1]
 
 
-def process_file(file):
-    log = "File from map " + file
-    fun_results = [file, [], "", False, False, log]
-    if not os.path.isfile(file):
-        return fun_results
-    env = copy.deepcopy(os.environ)
-    env['PSEUDO_UNLOAD'] = "1"
-    # getting file type
-    cmd = ['file', '--mime-type', file]
-    try:
-        result = subprocess.check_output(cmd, env=env).decode('utf-8')
-    except:
-        fun_results[-1] += "\nNot able to decode mime type"
-        return fun_results
-    file_type = result.split()[-1]
-    # looking for links
-    if "symlink" in file_type:
-        file = os.path.realpath(file)
-        cmd = ['file', '--mime-type', file]
-        try:
-            result = subprocess.check_output(cmd, env=env).decode('utf-8')
-        except:
-            fun_results[-1] += "\nNot able to decode mime type"
-            return fun_results
-        file_type = result.split()[-1]
-    # checking security flags if applies
+def parse_file_type(output):
+    if not output:
+        return ""
+    return output.split()[-1]
+
+
+def is_analyzable_mime_type(file_type):
     if "application" not in file_type:
-        return fun_results
-    fun_results[-1] += "\nFile type: " + file_type
+        return False
     if (("octet-stream" in file_type) or ("dosexec" in file_type) or
             ("archive" in file_type) or ("xml" in file_type) or
             ("gzip" in file_type) or ("postscript" in file_type) or
             ("pdf" in file_type)):
-        return fun_results
-    fun_results[1] = get_security_flags(file)
-    tmp = get_info("execstack", '-q', file)
-    if tmp.startswith("X "):
-        fun_results[2] = "execstack"
-    elif tmp.startswith("? "):
-        fun_results[2] = "not_defined"
-    tmp = get_info("readelf", '-s', file)
-    if ("setgid@GLIBC" in tmp) or ("setegid@GLIBC" in tmp) or ("setresgid@GLIBC" in tmp):
-        if ("setuid@GLIBC" in tmp) or ("seteuid@GLIBC" in tmp) or ("setresuid@GLIBC" in tmp):
-            if ("setgroups@GLIBC" not in tmp) and ("initgroups@GLIBC" not in tmp):
-                fun_results[3] = True
-    tmp = get_info("objdump", '-d', file)
-    if ("bndcu" not in tmp) and ("bndcl" not in tmp) and ("bndmov" not in tmp):
-        fun_results[4] = True
-    return fun_results
-
-def process_file_wrapper(file):
+        return False
+    return True
+
+
+def is_mpx_line(line):
+    return (b"bndcu" in line) or (b"bndcl" in line) or (b"bndmov" in line)
+
+
+def has_mpx_instructions(file_name, tool_limits=None, failures=None, data=None):
+    # objdump output is streamed and the tool is stopped at the first
+    # MPX instruction instead of keeping the whole disassembly in memory
+    if data is not None:
+        # objdump needs a file for content read from an archive
+        with tempfile.NamedTemporaryFile(prefix="isafw_cfa_") as f:
+            f.write(data)
+            f.flush()
+            return has_mpx_instructions(f.name, tool_limits, failures)
+    result = run_tool(['objdump', '-d', file_name], tool_limits, failures, stop_at=is_mpx_line)
+    return bool(result)
+
+
+def imports_from_glibc(imports, names):
+    for name in names:
+        version = imports.get(name)
+        if version and version.startswith("GLIBC"):
+            return True
+    return False
+
+
+def is_nodrop_groups(imports):
+    # setuid/setgid calls without initializing the supplementary groups
+    return (imports_from_glibc(imports, ("setgid", "setegid", "setresgid")) and
+            imports_from_glibc(imports, ("setuid", "seteuid", "setresuid")) and
+            not imports_from_glibc(imports, ("setgroups", "initgroups")))
+
+
+def get_native_security_flags(file, result, tool_limits=None, data=None, checks=CHECKS):
+    result.set_flag(ANALYZED)
+    try:
+        with (open(file, 'rb') if data is None else io.BytesIO(data)) as f:
+            elf = _elf.ELFFile(f)
+            if "checksec" in checks:
+                start = time.time()
+                result.security_flags = tuple(_elf.checksec(elf))
+                result.add_cost("checksec", time.time() - start)
+            if "execstack" in checks:
+                start = time.time()
+                result.set_execstack(_elf.execstack(elf))
+                result.add_cost("execstack", time.time() - start)
+            if "nodrop_groups" in checks:
+                start = time.time()
+                result.set_flag(NODROP_GROUPS, is_nodrop_groups(elf.imports))
+                result.add_cost("nodrop_groups", time.time() - start)
+            if "mpx" in checks:
+                start = time.time()
+                # objdump is only needed to rule out false positives of the scan
+                result.set_flag(NO_MPX, not (_elf.may_have_mpx_instructions(elf) and
+                                             has_mpx_instructions(file, tool_limits, result.failures, data)))
+                result.add_cost("mpx", time.time() - start)
+    except (IOError, OSError, _elf.ELFError) as e:
+        result.security_flags = "Not able to fetch flags"
+        result.set_flag(NO_MPX, "mpx" in checks)
+        result.log += "\nNot able to parse ELF file: " + str(e)
+
+
+_worker_cache = None
+
+
+def get_worker_cache(cache_file, cache_version):
+    # each worker process opens its own connection on first use
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = _cache.ResultCache(cache_file, cache_version, readonly=True)
+    return _worker_cache
+
+
+def process_files(files, use_file_tool=False, external_tools=False,
+                  cache_file="", cache_version=CACHE_VERSION, tool_limits=None, checks=CHECKS):
+    results = [FileResult(file) for file in files]
+    # (result, file to analyze) for every candidate, links are resolved
+    targets = []
+    for result in results:
+        file = result.path
+        if not os.path.isfile(file):
+            continue
+        if os.path.islink(file):
+            file = os.path.realpath(file)
+        targets.append((result, file))
+    if use_file_tool:
+        # getting file types
+        file_types = run_tool_batch(['file', '--mime-type', '-0'], targets, tool_limits,
+                                    split_file_output)
+        candidates = []
+        for (result, file), output in zip(targets, file_types):
+            file_type = parse_file_type(output)
+            if not file_type:
+                result.log += "\nNot able to decode mime type"
+                continue
+            # checking security flags if applies
+            if not is_analyzable_mime_type(file_type):
+                continue
+            result.log += "\nFile type: " + file_type
+            candidates.append((result, file))
+        targets = candidates
+    else:
+        # only ELF executables and shared objects are analyzed, so the
+        # header is enough to tell whether the file is of interest
+        candidates = []
+        for result, file in targets:
+            elf_type = _elf.read_elf_type(file)
+            if elf_type not in (_elf.ET_EXEC, _elf.ET_DYN):
+                continue
+            result.log += "\nFile type: ELF " + _elf.ET_NAMES[elf_type]
+            candidates.append((result, file))
+        targets = candidates
+    if cache_file:
+        candidates = []
+        for result, file in targets:
+            result.digest = _cache.file_digest(file)
+            cached = get_worker_cache(cache_file, cache_version).get(result.digest)
+            if cached is not None:
+                result.set_cache_entry(cached)
+                result.set_flag(FROM_CACHE)
+                result.log += "\nResult taken from cache"
+            else:
+                candidates.append((result, file))
+        targets = candidates
+    if not targets:
+        return results
+    if external_tools:
+        # the time of a batch run is shared by the files of the batch
+        execstack_outputs = readelf_outputs = [""] * len(targets)
+        if "execstack" in checks:
+            start = time.time()
+            execstack_outputs = run_tool_batch(['execstack', '-q'], targets, tool_limits,
+                                               split_execstack_output)
+            execstack_cost = (time.time() - start) / len(targets)
+        if "nodrop_groups" in checks:
+            start = time.time()
+            readelf_outputs = run_tool_batch(['readelf', '-s'], targets, tool_limits,
+                                             split_readelf_output)
+            readelf_cost = (time.time() - start) / len(targets)
+        for (result, file), tmp, symbols in zip(targets, execstack_outputs, readelf_outputs):
+            result.set_flag(ANALYZED)
+            if "checksec" in checks:
+                start = time.time()
+                security_flags = get_security_flags(file, tool_limits, result.failures)
+                if isinstance(security_flags, list):
+                    security_flags = tuple(security_flags)
+                result.security_flags = security_flags
+                result.add_cost("checksec", time.time() - start)
+            if "execstack" in checks:
+                if tmp.startswith("X "):
+                    result.set_flag(EXECSTACK)
+                elif tmp.startswith("? "):
+                    result.set_flag(EXECSTACK_NOT_DEFINED)
+                result.add_cost("execstack", execstack_cost)
+            if "nodrop_groups" in checks:
+                tmp = symbols
+                if ("setgid@GLIBC" in tmp) or ("setegid@GLIBC" in tmp) or ("setresgid@GLIBC" in tmp):
+                    if ("setuid@GLIBC" in tmp) or ("seteuid@GLIBC" in tmp) or ("setresuid@GLIBC" in tmp):
+                        if ("setgroups@GLIBC" not in tmp) and ("initgroups@GLIBC" not in tmp):
+                            result.set_flag(NODROP_GROUPS)
+                result.add_cost("nodrop_groups", readelf_cost)
+            if "mpx" in checks:
+                start = time.time()
+                result.set_flag(NO_MPX, not has_mpx_instructions(file, tool_limits, result.failures))
+                result.add_cost("mpx", time.time() - start)
+    else:
+        for result, file in targets:
+            get_native_security_flags(file, result, tool_limits, checks=checks)
+    return results
+
+
+def process_members(members, use_file_tool=False, external_tools=False,
+                    cache_file="", cache_version=CACHE_VERSION, tool_limits=None, checks=CHECKS):
+    # Members of archives come as (path, data, in shard) tuples, where
+    # data is None unless the member is an ELF executable or shared object
+    # of the shard. They are always analyzed with the built-in parser.
+    results = []
+    for path, data, in_shard in members:
+        result = FileResult(path)
+        results.append(result)
+        if not in_shard:
+            result.set_flag(OTHER_SHARD)
+            continue
+        if data is None:
+            continue
+        result.log += "\nFile type: ELF " + _elf.ET_NAMES[_elf.parse_elf_type(data)]
+        if cache_file:
+            result.digest = _cache.data_digest(data)
+            cached = get_worker_cache(cache_file, cache_version).get(result.digest)
+            if cached is not None:
+                result.set_cache_entry(cached)
+                result.set_flag(FROM_CACHE)
+                result.log += "\nResult taken from cache"
+                continue
+        get_native_security_flags(path, result, tool_limits, data, checks)
+    return results
+
+
+def process_file(file, **keywords):
+    return process_files([file], **keywords)[0]
+
+
+def process_files_wrapper(files, **keywords):
+    return call_worker(process_files, files, **keywords)
+
+
+def process_members_wrapper(members, **keywords):
+    return call_worker(process_members, members, **keywords)
+
+
+def call_worker(function, *args, **keywords):
     # Ensures that exceptions get logged with the original backtrace.
     # Without this, they appear with a backtrace rooted in
     # the code which transfers back the result to process_results().
     try:
-        return process_file(file)
+        return function(*args, **keywords)
     except:
         from isafw import isafw
         import traceback
@@ -390,4 +1352,19 @@ def process_filesystem(ISA_filesystem):
     global CFChecker
     return CFChecker.process_filesystem(ISA_filesystem)
 
+
+def process_inventory(ISA_filesystem, inventory):
+    global CFChecker
+    return CFChecker.process_inventory(ISA_filesystem, inventory)
+
+
+def process_filesystems(ISA_filesystems, inventories=None):
+    global CFChecker
+    return CFChecker.process_filesystems(ISA_filesystems, inventories)
+
+
+def merge_filesystem_shards(ISA_filesystem, partial_reports):
+    global CFChecker
+    return CFChecker.merge_filesystem_shards(ISA_filesystem, partial_reports)
+
 # =================================================== #
@@ -29,6 +29,10 @@
 import subprocess
 import os, sys
 import re
+try:
+    from . import _writers
+except (ImportError, ValueError):
+    import _writers
 
 CVEChecker = None
 pkglist = "/cve_check_tool_pkglist"
@@ -43,6 +47,7 @@ class ISA_CVEChecker:
         self.reportdir = ISA_config.reportdir
         self.timestamp = ISA_config.timestamp
         self.logfile = ISA_config.logdir + "/isafw_cvelog"
+        self.writers = _writers.get_writers(ISA_config)
         self.report_name = ISA_config.reportdir + "/cve_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
         output = ""
@@ -53,15 +58,15 @@ class ISA_CVEChecker:
             popen.wait()
             output = popen.stdout.read()
         except:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("error executing which cve-check-tool\n")
         else:
             if output:
                 self.initialized = True
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("\nPlugin ISA_CVEChecker initialized!\n")
             else:
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("cve-check-tool is missing!\n")
                     flog.write(
                         "Please install it from https://github.com/ikeydoherty/cve-check-tool.\n")
@@ -78,40 +83,42 @@ class ISA_CVEChecker:
                         alias_pkgs_faux.append(
                             a + "," + ISA_pkg.version + "," + cve_patch_info + ",\n")
                 pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
-                with open(self.reportdir + pkglist_faux, 'a') as fauxfile:
+                with self.writers.open(self.reportdir + pkglist_faux, 'a') as fauxfile:
                     fauxfile.write(pkgline_faux)
                     for a in alias_pkgs_faux:
                         fauxfile.write(a)
 
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("\npkg info: " + pkgline_faux)
             else:
                 self.initialized = False
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as pkg name, version and list of patches are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call.\n")
 
     def process_report(self):
+        # the faux file is read by cve-check-tool
+        self.writers.close(self.reportdir + pkglist + "_" + self.timestamp + ".faux")
         if not os.path.isfile(self.reportdir + pkglist + "_" + self.timestamp + ".faux"):
             return
         if (self.initialized):
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Creating report in HTML format.\n")
             result = self.process_report_type("html")
 
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Creating report in CSV format.\n")
             result = self.process_report_type("csv")
 
             pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
             os.remove(self.reportdir + pkglist_faux)
 
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Creating report in XML format.\n")
             self.write_report_xml(result)
 
@@ -170,7 +177,7 @@ class ISA_CVEChecker:
             rtype = "csv"
         pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
         args += "-a -t faux '" + self.reportdir + pkglist_faux + "'"
-        with open(self.logfile, 'a') as flog:
+        with self.writers.open(self.logfile, 'a') as flog:
             flog.write("Args: " + args)
         try:
             popen = subprocess.Popen(
@@ -178,7 +185,7 @@ class ISA_CVEChecker:
             result = popen.communicate()
         except:
             tool_stderr_value = "Error in executing cve-check-tool" + str(sys.exc_info())
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Error in executing cve-check-tool: " +
                            str(sys.exc_info()))
         else:
@@ -26,7 +26,13 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import os
+import sqlite3
+from array import array
 from stat import *
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     from lxml import etree
 except ImportError:
@@ -34,10 +40,84 @@ except ImportError:
         import xml.etree.cElementTree as etree
     except ImportError:
         import xml.etree.ElementTree as etree
+try:
+    from . import _findings
+    from . import _fssource
+    from . import _walk
+    from . import _pseudo
+    from . import _writers
+except (ImportError, ValueError):
+    import _findings
+    import _fssource
+    import _walk
+    import _pseudo
+    import _writers
 
 
 FSAnalyzer = None
 
+# categories of findings, in the order of the reports
+CATEGORIES = ("setuid_files", "setgid_files", "ww_files", "no_sticky_bit_ww_dirs")
+
+# rules on the mode of a file: a category applies if all of its
+# (mask, value, equal) conditions hold, that is if
+# ((mode & mask) == value) == equal
+MODE_RULES = (
+    ("setuid_files", ((S_ISUID, S_ISUID, True),)),
+    ("setgid_files", ((S_ISGID, S_ISGID, True),)),
+    ("no_sticky_bit_ww_dirs", ((S_IWOTH, S_IWOTH, True),
+                               (S_IFDIR, S_IFDIR, True),
+                               (S_ISVTX, S_ISVTX, False))),
+    ("ww_files", ((S_IWOTH, S_IWOTH, True),
+                  (S_IFREG, S_IFREG, True),
+                  (S_IFLNK, S_IFLNK, False))),
+)
+
+
+def match_mode_rule(conditions, mode):
+    for mask, value, equal in conditions:
+        if ((mode & mask) == value) != equal:
+            return False
+    return True
+
+
+def classify_modes(modes):
+    """Returns the indexes of the modes matching each of MODE_RULES, as a
+    dict of category -> ascending list of indexes.
+
+    With NumPy the rules are evaluated as masks over the whole column.
+    Without it, the modes are gone through once and the rules are only
+    evaluated for each distinct mode, which are few in a rootfs."""
+    if numpy is not None:
+        return _classify_modes_numpy(modes)
+    return _classify_modes_python(modes)
+
+
+def _classify_modes_numpy(modes):
+    matches = {}
+    column = numpy.fromiter(modes, dtype=numpy.uint32, count=len(modes))
+    for category, conditions in MODE_RULES:
+        selected = numpy.ones(len(column), dtype=bool)
+        for mask, value, equal in conditions:
+            condition = (column & mask) == value
+            selected &= condition if equal else ~condition
+        matches[category] = numpy.flatnonzero(selected).tolist()
+    return matches
+
+
+def _classify_modes_python(modes):
+    matches = dict((category, []) for category, conditions in MODE_RULES)
+    # index lists of the categories matched by each distinct mode
+    matched_by = {}
+    for index, mode in enumerate(modes):
+        lists = matched_by.get(mode)
+        if lists is None:
+            lists = matched_by[mode] = [matches[category] for category, conditions in MODE_RULES
+                                        if match_mode_rule(conditions, mode)]
+        for indexes in lists:
+            indexes.append(index)
+    return matches
+
 
 class ISA_FSChecker():
     initialized = False
@@ -45,107 +125,221 @@ class ISA_FSChecker():
     def __init__(self, ISA_config):
         self.proxy = ISA_config.proxy
         self.logfile = ISA_config.logdir + "/isafw_fsalog"
+        self.writers = _writers.get_writers(ISA_config)
         self.full_report_name = ISA_config.reportdir + "/fsa_full_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
         self.problems_report_name = ISA_config.reportdir + \
             "/fsa_problems_report_" + ISA_config.machine + "_" + ISA_config.timestamp
+        self.partial_report_name = ISA_config.reportdir + \
+            "/fsa_partial_report_" + ISA_config.machine + "_" + ISA_config.timestamp
         self.full_reports = ISA_config.full_reports
+        self.walk_workers = ISA_config.walk_workers
         self.initialized = True
-        self.setuid_files = []
-        self.setgid_files = []
-        self.ww_files = []
-        self.no_sticky_bit_ww_dirs = []
-        with open(self.logfile, 'w') as flog:
+        with self.writers.open(self.logfile, 'w') as flog:
             flog.write("\nPlugin ISA_FSChecker initialized!\n")
 
-    def process_filesystem(self, ISA_filesystem):
+    def process_inventory(self, ISA_filesystem, inventory):
+        self.process_filesystem(ISA_filesystem, inventory)
+
+    def process_filesystem(self, ISA_filesystem, inventory=None):
         if (self.initialized):
             if (ISA_filesystem.img_name and ISA_filesystem.path_to_fs):
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("Analyzing filesystem at: " + ISA_filesystem.path_to_fs +
                                " for the image: " + ISA_filesystem.img_name + "\n")
-                self.files = self.find_fsobjects(ISA_filesystem.path_to_fs)
-                with open(self.logfile, 'a') as flog:
-                    flog.write("\nFilelist is: " + str(self.files))
+                pseudo = None
+                if _fssource.is_archive(ISA_filesystem.path_to_fs):
+                    # rootfs archives are not extracted, the metadata is
+                    # taken from the headers of the members
+                    source = _fssource.open_source(ISA_filesystem.path_to_fs)
+                    entries = [entry for entry in source.get_entries()
+                               if not source.is_directory_link(entry)]
+                    files = [entry.path for entry in entries]
+                    metadata = ((sequence, entry.path, entry.mode, entry.uid, entry.gid)
+                                for sequence, entry in enumerate(entries)
+                                if self.in_shard(ISA_filesystem, entry.path))
+                else:
+                    if inventory is not None:
+                        # the tree was already walked and stat'ed by ISA
+                        entries = inventory.entries
+                    else:
+                        entries = list(self.find_fsobjects(ISA_filesystem.path_to_fs))
+                    files = [entry.path for entry in entries]
+                    pseudo = self.open_pseudo_db(ISA_filesystem)
+                    metadata = self.get_metadata(ISA_filesystem, entries, pseudo)
+                with self.writers.open(self.logfile, 'a') as flog:
+                    flog.write("\nFilelist is: " + str(files))
                 if self.full_reports:
-                    with open(self.full_report_name + "_" + ISA_filesystem.img_name, 'w') as ffull_report:
+                    with self.writers.open(self.full_report_name + "_" + ISA_filesystem.img_name, 'w') as ffull_report:
                         ffull_report.write(
                             "Report for image: " + ISA_filesystem.img_name + '\n')
                         ffull_report.write(
                             "With rootfs location at " + ISA_filesystem.path_to_fs + "\n\n")
-                for f in self.files:
-                    st = os.lstat(f)
-                    i = f.replace(ISA_filesystem.path_to_fs, "")
-                    if self.full_reports:
-                        with open(self.full_report_name + "_" + ISA_filesystem.img_name, 'a') as ffull_report:
-                            ffull_report.write("File: " + i + ' mode: ' + str(oct(st.st_mode)) +
-                                               " uid: " + str(st.st_uid) + " gid: " + str(st.st_gid) + '\n')
-                    if ((st.st_mode & S_ISUID) == S_ISUID):
-                        self.setuid_files.append(i)
-                    if ((st.st_mode & S_ISGID) == S_ISGID):
-                        self.setgid_files.append(i)
-                    if ((st.st_mode & S_IWOTH) == S_IWOTH):
-                        if (((st.st_mode & S_IFDIR) == S_IFDIR) and ((st.st_mode & S_ISVTX) != S_ISVTX)):
-                            self.no_sticky_bit_ww_dirs.append(i)
-                        if (((st.st_mode & S_IFREG) == S_IFREG) and ((st.st_mode & S_IFLNK) != S_IFLNK)):
-                            self.ww_files.append(i)
-                self.write_problems_report(ISA_filesystem)
-                self.write_problems_report_xml(ISA_filesystem)
+                # findings are kept per image, so that images can be
+                # analyzed one after another by the same analyzer
+                findings = _findings.Findings(CATEGORIES)
+                manifest = ISA_filesystem.manifest
+                sharded = ISA_filesystem.shard_count > 1
+                records = list(metadata)
+                if self.full_reports:
+                    with self.writers.open(self.full_report_name + "_" + ISA_filesystem.img_name, 'a') as ffull_report:
+                        for sequence, i, st_mode, st_uid, st_gid in records:
+                            ffull_report.write("File: " + i + ' mode: ' + str(oct(st_mode)) +
+                                               " uid: " + str(st_uid) + " gid: " + str(st_gid) + '\n')
+                # the modes are classified in bulk, only the files with
+                # findings are looked at one by one
+                if manifest and not pseudo:
+                    # results of files unchanged since the baseline are
+                    # carried forward and only the others are classified.
+                    # Files without findings have no recorded result,
+                    # changes only recorded by pseudo are not in the manifest
+                    categories_of = {}
+                    changed = []
+                    for index, record in enumerate(records):
+                        categories = manifest.get_previous_result(getPluginName(), record[1], [])
+                        if categories is None:
+                            changed.append(index)
+                        elif categories:
+                            categories_of[index] = categories
+                    for index, categories in self.classify([records[index] for index in changed]).items():
+                        categories_of[changed[index]] = categories
+                    with self.writers.open(self.logfile, 'a') as flog:
+                        flog.write("\nClassified the modes of " + str(len(changed)) + " files, results of " +
+                                   str(len(records) - len(changed)) + " files taken from the baseline\n")
+                else:
+                    categories_of = self.classify(records)
+                for index in sorted(categories_of):
+                    sequence, i = records[index][:2]
+                    categories = categories_of[index]
+                    if manifest:
+                        manifest.set_result(getPluginName(), i, categories)
+                    # the relative path is stored once for all its findings
+                    path_index = findings.add_path(i, sequence=sequence if sharded else None)
+                    for category in categories:
+                        findings.add(category, path_index)
+                if pseudo:
+                    with self.writers.open(self.logfile, 'a') as flog:
+                        flog.write("\nMetadata of " + str(pseudo.found) + " files taken from pseudo, " +
+                                   str(pseudo.missing) + " files not known to pseudo\n")
+                if sharded:
+                    self.write_partial_report(ISA_filesystem, findings)
+                else:
+                    self.write_problems_report(ISA_filesystem, findings)
+                    self.write_problems_report_xml(ISA_filesystem, findings)
             else:
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as image name and path to the filesystem are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call.\n")
 
-    def write_problems_report(self, ISA_filesystem):
+    def merge_filesystem_shards(self, ISA_filesystem, partial_reports):
+        if not self.initialized:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("Plugin hasn't initialized! Not performing the call.\n")
+            return
+        try:
+            partials = _findings.load_partials(partial_reports, getPluginName(),
+                                               ISA_filesystem.img_name)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("Not able to merge the results of the shards: " + str(e) + "\n")
+            return
+        findings = _findings.Findings.merge(CATEGORIES, partials)
+        with self.writers.open(self.logfile, 'a') as flog:
+            flog.write("Merged the results of " + str(len(partials)) + " shards\n")
+        self.write_problems_report(ISA_filesystem, findings)
+        self.write_problems_report_xml(ISA_filesystem, findings)
+
+    def in_shard(self, ISA_filesystem, i):
+        return _findings.in_shard(i, ISA_filesystem.shard_index, ISA_filesystem.shard_count)
+
+    def open_pseudo_db(self, ISA_filesystem):
+        if not ISA_filesystem.pseudo_db:
+            return None
+        try:
+            return _pseudo.PseudoDB(ISA_filesystem.pseudo_db, ISA_filesystem.path_to_fs)
+        except (sqlite3.Error, IOError, OSError) as e:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("Not able to read the pseudo database " + ISA_filesystem.pseudo_db +
+                           ", using the metadata of the files instead: " + str(e) + "\n")
+            return None
+
+    def get_metadata(self, ISA_filesystem, entries, pseudo=None):
+        for sequence, entry in enumerate(entries):
+            i = entry.path.replace(ISA_filesystem.path_to_fs, "")
+            if not self.in_shard(ISA_filesystem, i):
+                continue
+            if pseudo:
+                st_mode, st_uid, st_gid = pseudo.get_metadata(entry)
+                yield sequence, i, st_mode, st_uid, st_gid
+            else:
+                yield sequence, i, entry.mode, entry.uid, entry.gid
+
+    def classify(self, records):
+        # index of record -> categories, for the records with findings
+        matches = classify_modes(array('L', [record[2] for record in records]))
+        categories_of = {}
+        for category, conditions in MODE_RULES:
+            for index in matches[category]:
+                categories_of.setdefault(index, []).append(category)
+        return categories_of
+
+    def write_partial_report(self, ISA_filesystem, findings):
+        findings.save_partial(
+            self.partial_report_name + "_" + ISA_filesystem.img_name + "_shard_" +
+            str(ISA_filesystem.shard_index) + "_of_" + str(ISA_filesystem.shard_count) + ".json",
+            {"plugin": getPluginName(), "img_name": ISA_filesystem.img_name,
+             "shard_index": ISA_filesystem.shard_index,
+             "shard_count": ISA_filesystem.shard_count})
+
+    def write_problems_report(self, ISA_filesystem, findings):
         with open(self.problems_report_name + "_" + ISA_filesystem.img_name, 'w') as fproblems_report:
             fproblems_report.write(
                 "Report for image: " + ISA_filesystem.img_name + '\n')
             fproblems_report.write(
                 "With rootfs location at " + ISA_filesystem.path_to_fs + "\n\n")
             fproblems_report.write("Files with SETUID bit set:\n")
-            for item in self.setuid_files:
+            for item in findings.get("setuid_files"):
                 fproblems_report.write(item + '\n')
             fproblems_report.write("\n\nFiles with SETGID bit set:\n")
-            for item in self.setgid_files:
+            for item in findings.get("setgid_files"):
                 fproblems_report.write(item + '\n')
             fproblems_report.write("\n\nWorld-writable files:\n")
-            for item in self.ww_files:
+            for item in findings.get("ww_files"):
                 fproblems_report.write(item + '\n')
             fproblems_report.write(
                 "\n\nWorld-writable dirs with no sticky bit:\n")
-            for item in self.no_sticky_bit_ww_dirs:
+            for item in findings.get("no_sticky_bit_ww_dirs"):
                 fproblems_report.write(item + '\n')
 
-    def write_problems_report_xml(self, ISA_filesystem):
-        num_tests = len(self.setuid_files) + len(self.setgid_files) + \
-            len(self.ww_files) + len(self.no_sticky_bit_ww_dirs)
+    def write_problems_report_xml(self, ISA_filesystem, findings):
+        num_tests = len(findings)
         root = etree.Element(
             'testsuite', name='FSA_Plugin', tests=str(num_tests))
-        if self.setuid_files:
-            for item in self.setuid_files:
+        if findings.count("setuid_files"):
+            for item in findings.get("setuid_files"):
                 tcase1 = etree.SubElement(
                     root, 'testcase', classname='Files_with_SETUID_bit_set', name=item)
                 etree.SubElement(
                     tcase1, 'failure', message=item, type='violation')
-        if self.setgid_files:
-            for item in self.setgid_files:
+        if findings.count("setgid_files"):
+            for item in findings.get("setgid_files"):
                 tcase2 = etree.SubElement(
                     root, 'testacase', classname='Files_with_SETGID_bit_set', name=item)
                 etree.SubElement(
                     tcase2, 'failure', message=item, type='violation')
-        if self.ww_files:
-            for item in self.ww_files:
+        if findings.count("ww_files"):
+            for item in findings.get("ww_files"):
                 tcase3 = etree.SubElement(
                     root, 'testase', classname='World-writable_files', name=item)
                 etree.SubElement(
                     tcase3, 'failure', message=item, type='violation')
-        if self.no_sticky_bit_ww_dirs:
-            for item in self.no_sticky_bit_ww_dirs:
+        if findings.count("no_sticky_bit_ww_dirs"):
+            for item in findings.get("no_sticky_bit_ww_dirs"):
                 tcase4 = etree.SubElement(
                     root, 'testcase', classname='World-writable_dirs_with_no_sticky_bit', name=item)
                 etree.SubElement(
@@ -159,13 +353,9 @@ class ISA_FSChecker():
             tree.write(output, encoding='UTF-8', xml_declaration=True)
 
     def find_fsobjects(self, init_path):
-        list_of_files = []
-        for (dirpath, dirnames, filenames) in os.walk(init_path):
-            if (dirpath != init_path):
-                list_of_files.append(str(dirpath)[:])
-            for f in filenames:
-                list_of_files.append(str(dirpath + "/" + f)[:])
-        return list_of_files
+        # entries of the directories and files below init_path with their
+        # lstat data, in the order of os.walk()
+        return _walk.walk(init_path, self.walk_workers)
 
 # ======== supported callbacks from ISA ============= #
 
@@ -183,4 +373,14 @@ def process_filesystem(ISA_filesystem):
     global FSAnalyzer
     return FSAnalyzer.process_filesystem(ISA_filesystem)
 
+
+def process_inventory(ISA_filesystem, inventory):
+    global FSAnalyzer
+    return FSAnalyzer.process_inventory(ISA_filesystem, inventory)
+
+
+def merge_filesystem_shards(ISA_filesystem, partial_reports):
+    global FSAnalyzer
+    return FSAnalyzer.merge_filesystem_shards(ISA_filesystem, partial_reports)
+
 # ==================================================== #
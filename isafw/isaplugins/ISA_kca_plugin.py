@@ -33,10 +33,293 @@ except ImportError:
         import xml.etree.cElementTree as etree
     except ImportError:
         import xml.etree.ElementTree as etree
-import importlib
+import collections
+import csv
+import json
+import os
+import threading
+import types
+try:
+    from . import _cache
+    from . import _kconfig
+    from . import _writers
+except (ImportError, ValueError):
+    import _cache
+    import _kconfig
+    import _writers
 
 KCAnalyzer = None
 
+# groups of options, in the order of the reports
+GROUPS = ("hardening", "keys", "security", "integrity")
+GROUP_TITLES = {"hardening": "Hardening options",
+                "keys": "Key-related options",
+                "security": "Security options",
+                "integrity": "Integrity options"}
+
+# format of the rule sets kept on disk
+RULES_FORMAT = "2"
+# directory of the config modules with the rules
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "kca")
+
+# verdict of a rule on the value of an option in a kernel config
+Verdict = collections.namedtuple("Verdict", ("option", "value", "recommended", "valid"))
+
+
+class FrozenDict(dict):
+    """Dictionary that cannot be changed after it is created."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict cannot be changed")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.items())
+    return value
+
+
+# compilers of the checks of the rules in the config modules, each returns
+# a function of (value, KernelResult) telling if the value is valid. The
+# references are written like in a config and compared unquoted, as the
+# values are parsed
+def _check_exact(reference, rule):
+    reference = _kconfig.unquote(reference)
+    return lambda value, result: value == reference
+
+
+def _check_one_of(reference, rule):
+    valid_values = frozenset(_kconfig.unquote(item) for item in reference.split(',') + [reference])
+    return lambda value, result: value in valid_values
+
+
+def _check_non_empty(reference, rule):
+    reference = _kconfig.unquote(reference)
+    return lambda value, result: value == reference or len(value) > 0
+
+
+def _unquoted_items(options):
+    return tuple((option, _kconfig.unquote(value)) for option, value in options.items())
+
+
+def _check_any_of(reference, rule):
+    reference = _kconfig.unquote(reference)
+    options = _unquoted_items(rule["options"])
+    return lambda value, result: value == reference or \
+        any(result.get(option) == option_value for option, option_value in options)
+
+
+CHECKS = {"exact": _check_exact,
+          "one_of": _check_one_of,
+          "non_empty": _check_non_empty,
+          "any_of": _check_any_of}
+
+
+def compile_rule(reference, rule):
+    check = CHECKS[rule.get("check", "exact")](reference, rule)
+    if not rule.get("unless"):
+        return check
+    conditions = _unquoted_items(rule["unless"])
+
+    def check_unless(value, result):
+        if all(result.get(option) == option_value for option, option_value in conditions):
+            return True
+        return check(value, result)
+    return check_unless
+
+
+class RuleSet(object):
+    """Immutable KCA rules of an architecture: the default and reference
+    value of the options of each group, the rules on their values and the
+    comments on them, merged from the common and the architecture specific
+    config modules.
+
+    The rules are compiled into one check per option, so that evaluating
+    a kernel takes a single pass over the options without regard to the
+    kind of their rules."""
+
+    __slots__ = ("arch", "version", "defaults", "references", "rules", "comments", "table", "names")
+
+    def __init__(self, arch, version, defaults, references, rules, comments):
+        for option, rule in rules.items():
+            if rule.get("check", "exact") not in CHECKS:
+                raise ValueError("Unknown check of the rule for " + option + ": " + str(rule.get("check")))
+        table = {}
+        for group in GROUPS:
+            # (option, recommended value, check) in the order of the reports
+            table[group] = tuple((option, references[group][option],
+                                  compile_rule(references[group][option], rules.get(option, {})))
+                                 for option in sorted(defaults[group]))
+        # all options the rules look at
+        names = set(option for group in GROUPS for option in defaults[group])
+        for rule in rules.values():
+            names.update(rule.get("options", {}))
+            names.update(rule.get("unless", {}))
+        for name, value in (("arch", arch), ("version", version),
+                            ("defaults", _freeze(dict((group, defaults[group]) for group in GROUPS))),
+                            ("references", _freeze(dict((group, references[group]) for group in GROUPS))),
+                            ("rules", _freeze(rules)),
+                            ("comments", _freeze(comments)),
+                            ("table", FrozenDict(table)),
+                            ("names", frozenset(names))):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RuleSet cannot be changed")
+
+    @classmethod
+    def compile(cls, arch, version, sources):
+        # sources are the ones the version was computed from, see
+        # read_rule_sources()
+        common_config_module = _load_config_module("common", sources[0])
+        arch_config_module = _load_config_module(arch, sources[1])
+        defaults = {}
+        references = {}
+        for group in GROUPS:
+            defaults[group] = merge_config(getattr(arch_config_module, group + "_kco"),
+                                           getattr(common_config_module, group + "_kco"))
+            references[group] = merge_config(getattr(arch_config_module, group + "_kco_ref"),
+                                             getattr(common_config_module, group + "_kco_ref"))
+        rules = merge_config(arch_config_module.rules, common_config_module.rules)
+        comments = merge_config(arch_config_module.comments, common_config_module.comments)
+        return cls(arch, version, defaults, references, rules, comments)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = _native(json.load(f))
+        return cls(data["arch"], data["version"], data["defaults"], data["references"],
+                   data["rules"], data["comments"])
+
+    def save(self, path):
+        # written under a temporary name, so that concurrent readers never
+        # see a partial file
+        tmp_path = path + ".tmp." + str(os.getpid()) + "." + str(threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            json.dump({"arch": self.arch, "version": self.version, "defaults": self.defaults,
+                       "references": self.references, "rules": self.rules,
+                       "comments": self.comments}, f)
+        os.rename(tmp_path, path)
+
+
+class KernelResult(object):
+    """Values of the options of a RuleSet found in the config of a kernel,
+    and the verdicts of the rules on them. The verdicts are evaluated once
+    and shared by all reports."""
+
+    def __init__(self, rules, options):
+        self.rules = rules
+        self.options = options
+        self.values = {}
+        for group in GROUPS:
+            values = dict(rules.defaults[group])
+            for key in values:
+                if key in options:
+                    values[key] = options[key]
+            self.values[group] = values
+        self.verdicts = {}
+        for group in GROUPS:
+            values = self.values[group]
+            self.verdicts[group] = [Verdict(option, values[option], recommended, check(values[option], self))
+                                    for option, recommended, check in rules.table[group]]
+
+    def get(self, option):
+        # value of any option, also of the ones without rules
+        for group in GROUPS:
+            if option in self.values[group]:
+                return self.values[group][option]
+        return self.options.get(option, _kconfig.NOT_SET)
+
+    def get_problems(self, group):
+        return [verdict for verdict in self.verdicts[group] if not verdict.valid]
+
+
+def _native(value):
+    # JSON gives unicode strings on Python 2
+    if isinstance(value, dict):
+        return dict((_native(key), _native(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_native(item) for item in value]
+    if str is bytes and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+# compiled rule sets by (arch, version)
+_rules = {}
+_rules_lock = threading.Lock()
+
+
+# sources of the config modules and their digests by path, read again
+# only when the size or the modification time of the file changes
+_rule_sources = {}
+_rule_sources_lock = threading.Lock()
+
+
+def _read_rule_source(name):
+    path = os.path.join(CONFIG_DIR, name + ".py")
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime)
+    with _rule_sources_lock:
+        source = _rule_sources.get(path)
+        if source is None or source[0] != key:
+            with open(path, 'rb') as f:
+                data = f.read()
+            source = _rule_sources[path] = (key, data, _cache.data_digest(data))
+    return source[1:]
+
+
+def read_rule_sources(arch):
+    """Returns the sources of the common and the arch config modules and
+    the digests of the sources."""
+    sources, digests = zip(*[_read_rule_source(name) for name in ("common", arch)])
+    return list(sources), list(digests)
+
+
+def rules_version(digests):
+    """Version of the rules of an architecture, the digest of the sources
+    of its config modules."""
+    return _cache.data_digest(":".join([RULES_FORMAT] + digests).encode("utf-8"))
+
+
+def _load_config_module(name, source):
+    # the module is run from the source its version was computed from,
+    # as the copy in sys.modules is outdated if the file has changed
+    module = types.ModuleType("isafw.isaplugins.configs.kca." + name)
+    exec(compile(source, os.path.join(CONFIG_DIR, name + ".py"), "exec"), module.__dict__)
+    return module
+
+
+def get_rules(arch, cache_dir=""):
+    """Returns the RuleSet of an architecture. Rule sets are compiled once
+    per version of the config modules and kept in memory, and in cache_dir
+    if it is set. The config modules are only read and hashed again when
+    they change."""
+    sources, digests = read_rule_sources(arch)
+    version = rules_version(digests)
+    with _rules_lock:
+        rules = _rules.get((arch, version))
+        if rules is not None:
+            return rules
+        path = None
+        if cache_dir:
+            path = os.path.join(cache_dir, "kca_rules_" + arch + "_" + version + ".json")
+            try:
+                rules = RuleSet.load(path)
+            except (IOError, OSError, ValueError, KeyError):
+                rules = None
+        if rules is None:
+            rules = RuleSet.compile(arch, version, sources)
+            if path:
+                try:
+                    rules.save(path)
+                except (IOError, OSError):
+                    pass
+        _rules[(arch, version)] = rules
+        return rules
+
 
 class ISA_KernelChecker():
     initialized = False
@@ -44,20 +327,25 @@ class ISA_KernelChecker():
     def __init__(self, ISA_config):
         self.proxy = ISA_config.proxy
         self.logfile = ISA_config.logdir + "/isafw_kcalog"
+        self.writers = _writers.get_writers(ISA_config)
         self.full_report_name = ISA_config.reportdir + "/kca_full_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
         self.problems_report_name = ISA_config.reportdir + \
             "/kca_problems_report_" + ISA_config.machine + "_" + ISA_config.timestamp
+        self.matrix_report_name = ISA_config.reportdir + \
+            "/kca_matrix_report_" + ISA_config.machine + "_" + ISA_config.timestamp
         self.full_reports = ISA_config.full_reports
         self.initialized = True
         self.arch = ISA_config.arch
-        with open(self.logfile, 'w') as flog:
+        self.rules_cache_dir = ISA_config.kca_rules_cache_dir
+        self.workers = ISA_config.kca_workers
+        with self.writers.open(self.logfile, 'w') as flog:
             flog.write("\nPlugin ISA_KernelChecker initialized!\n")
 
-    def append_recommendation(self, report, key, value):
+    def append_recommendation(self, report, comments, key, value):
         report.write("Recommended value:\n")
         report.write(key + ' : ' + str(value) + '\n')
-        comment = self.comments.get(key, '')
+        comment = comments.get(key, '')
         if comment != '':
             report.write("Comment:\n")
             report.write(comment + '\n')
@@ -65,235 +353,177 @@ class ISA_KernelChecker():
     def process_kernel(self, ISA_kernel):
         if (self.initialized):
             if (ISA_kernel.img_name and ISA_kernel.path_to_config):
-                # Merging common and arch configs
-                common_config_module = importlib.import_module('isafw.isaplugins.configs.kca.{}'.format('common'))
-                arch_config_module = importlib.import_module('isafw.isaplugins.configs.kca.{}'.format(self.arch))
-
-                for c in ["hardening_kco", "keys_kco", "security_kco", "integrity_kco",
-                          "hardening_kco_ref", "keys_kco_ref", "security_kco_ref", "integrity_kco_ref",
-                          "comments"]:
-                    setattr(self, c, merge_config(getattr(arch_config_module, c), getattr(common_config_module, c)))
-                with open(self.logfile, 'a') as flog:
+                # the rules are shared and never changed, the values found
+                # in the config are kept apart in a result per kernel
+                rules = get_rules(self.get_arch(ISA_kernel), self.rules_cache_dir)
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("Analyzing kernel config file at: " + ISA_kernel.path_to_config +
                                " for the image: " + ISA_kernel.img_name + "\n")
-                with open(ISA_kernel.path_to_config, 'r') as fkernel_conf:
-                    for line in fkernel_conf:
-                        line = line.strip('\n')
-                        for key in self.hardening_kco:
-                            if key + '=' in line:
-                                self.hardening_kco[key] = line.split('=')[1]
-                        for key in self.keys_kco:
-                            if key + '=' in line:
-                                self.keys_kco[key] = line.split('=')[1]
-                        for key in self.security_kco:
-                            if key + '=' in line:
-                                self.security_kco[key] = line.split('=')[1]
-                        for key in self.integrity_kco:
-                            if key + '=' in line:
-                                self.integrity_kco[key] = line.split('=')[1]
-                with open(self.logfile, 'a') as flog:
+                # the config is parsed once, the tracked options are then
+                # looked up by their exact name
+                result = KernelResult(rules, _kconfig.read_config(ISA_kernel.path_to_config))
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write("\n\nhardening_kco values: " +
-                               str(self.hardening_kco))
-                    flog.write("\n\nkeys_kco values: " + str(self.keys_kco))
+                               str(result.values["hardening"]))
+                    flog.write("\n\nkeys_kco values: " + str(result.values["keys"]))
                     flog.write("\n\nsecurity_kco values: " +
-                               str(self.security_kco))
+                               str(result.values["security"]))
                     flog.write("\n\nintegrity_kco values: " +
-                               str(self.integrity_kco))
-                self.write_full_report(ISA_kernel)
-                self.write_problems_report(ISA_kernel)
+                               str(result.values["integrity"]))
+                self.write_full_report(ISA_kernel, result)
+                self.write_problems_report(ISA_kernel, result)
 
             else:
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as image name and path to config are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call!\n")
 
-    def write_full_report(self, ISA_kernel):
+    def process_kernels(self, ISA_kernels, per_image_reports=False):
+        if not self.initialized:
+            with self.writers.open(self.logfile, 'a') as flog:
+                flog.write("Plugin hasn't initialized! Not performing the call!\n")
+            return
+        kernels = []
+        for ISA_kernel in ISA_kernels:
+            if ISA_kernel.img_name and ISA_kernel.path_to_config:
+                kernels.append(ISA_kernel)
+            else:
+                with self.writers.open(self.logfile, 'a') as flog:
+                    flog.write("Mandatory arguments such as image name and path to config are not provided!\n")
+                    flog.write("Skipping the kernel.\n")
+        if not kernels:
+            return
+        # the configs are parsed by a pool of processes, which only send
+        # back the options the rules look at. The rules are compiled once
+        # per architecture and shared by all kernels.
+        rule_sets = [get_rules(self.get_arch(ISA_kernel), self.rules_cache_dir) for ISA_kernel in kernels]
+        names = frozenset().union(*[rules.names for rules in rule_sets])
+        tasks = [(ISA_kernel.path_to_config, names) for ISA_kernel in kernels]
+        pool = self.create_pool(len(tasks))
+        if pool is None:
+            parsed = [parse_kernel_config(task) for task in tasks]
+        else:
+            try:
+                parsed = pool.map(parse_kernel_config, tasks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        columns = []
+        for ISA_kernel, rules, (options, error) in zip(kernels, rule_sets, parsed):
+            with self.writers.open(self.logfile, 'a') as flog:
+                if error:
+                    flog.write("Not able to read the kernel config file at: " + ISA_kernel.path_to_config +
+                               " for the image: " + ISA_kernel.img_name + ": " + error + "\n")
+                    continue
+                flog.write("Analyzing kernel config file at: " + ISA_kernel.path_to_config +
+                           " for the image: " + ISA_kernel.img_name + "\n")
+            result = KernelResult(rules, options)
+            if per_image_reports:
+                self.write_full_report(ISA_kernel, result)
+                self.write_problems_report(ISA_kernel, result)
+            columns.append((ISA_kernel, result))
+        if columns:
+            self.write_matrix_report(columns)
+
+    def get_arch(self, ISA_kernel):
+        return getattr(ISA_kernel, "arch", "") or self.arch
+
+    def create_pool(self, num_configs):
+        # returns None if the configs are better parsed in this process
+        import multiprocessing
+        workers = min(self.workers or multiprocessing.cpu_count(), num_configs)
+        if workers < 2:
+            return None
+        return multiprocessing.Pool(processes=workers)
+
+    def write_matrix_report(self, columns):
+        # option x machine matrix of the values of the kernels, values that
+        # need improvement are marked with "!", options that are not
+        # checked for the arch of a kernel are left empty
+        labels = [ISA_kernel.machine or ISA_kernel.img_name for ISA_kernel, result in columns]
+        verdicts = [dict((verdict.option, verdict) for group in GROUPS for verdict in result.verdicts[group])
+                    for ISA_kernel, result in columns]
+        rule_sets = []
+        for ISA_kernel, result in columns:
+            if result.rules not in rule_sets:
+                rule_sets.append(result.rules)
+        with open_csv(self.matrix_report_name + ".csv") as freport:
+            writer = csv.writer(freport)
+            writer.writerow(["Group", "Option", "Recommended"] + labels + ["Needs improvement"])
+            for group in GROUPS:
+                for option in sorted(set(option for rules in rule_sets for option in rules.references[group])):
+                    recommended = [(rules.arch, rules.references[group][option])
+                                   for rules in rule_sets if option in rules.references[group]]
+                    if len(set(value for arch, value in recommended)) == 1:
+                        recommended = recommended[0][1]
+                    else:
+                        recommended = "; ".join(arch + ": " + value for arch, value in recommended)
+                    row = [GROUP_TITLES[group], option, recommended]
+                    problems = 0
+                    for column in verdicts:
+                        verdict = column.get(option)
+                        if verdict is None:
+                            row.append("")
+                        elif verdict.valid:
+                            row.append(_kconfig.format_value(verdict.value))
+                        else:
+                            row.append("! " + _kconfig.format_value(verdict.value))
+                            problems += 1
+                    writer.writerow(row + [str(problems)])
+
+    def write_full_report(self, ISA_kernel, result):
         if self.full_reports:
             with open(self.full_report_name + "_" + ISA_kernel.img_name, 'w') as freport:
                 freport.write("Report for image: " +
                               ISA_kernel.img_name + '\n')
                 freport.write("With the kernel conf at: " +
                               ISA_kernel.path_to_config + '\n\n')
-                freport.write("Hardening options:\n")
-                for key in sorted(self.hardening_kco):
-                    freport.write(
-                        key + ' : ' + str(self.hardening_kco[key]) + '\n')
-                freport.write("\nKey-related options:\n")
-                for key in sorted(self.keys_kco):
-                    freport.write(key + ' : ' + str(self.keys_kco[key]) + '\n')
-                freport.write("\nSecurity options:\n")
-                for key in sorted(self.security_kco):
-                    freport.write(
-                        key + ' : ' + str(self.security_kco[key]) + '\n')
-                freport.write("\nIntegrity options:\n")
-                for key in sorted(self.integrity_kco):
-                    freport.write(
-                        key + ' : ' + str(self.integrity_kco[key]) + '\n')
+                for index, group in enumerate(GROUPS):
+                    freport.write(("\n" if index else "") + GROUP_TITLES[group] + ":\n")
+                    for verdict in result.verdicts[group]:
+                        freport.write(
+                            verdict.option + ' : ' + _kconfig.format_value(verdict.value) + '\n')
 
-    def write_problems_report(self, ISA_kernel):
-        self.write_text_problems_report(ISA_kernel)
-        self.write_xml_problems_report(ISA_kernel)
+    def write_problems_report(self, ISA_kernel, result):
+        self.write_text_problems_report(ISA_kernel, result)
+        self.write_xml_problems_report(ISA_kernel, result)
 
-    def write_text_problems_report(self, ISA_kernel):
+    def write_text_problems_report(self, ISA_kernel, result):
         with open(self.problems_report_name + "_" + ISA_kernel.img_name, 'w') as freport:
             freport.write("Report for image: " + ISA_kernel.img_name + '\n')
             freport.write("With the kernel conf at: " +
                           ISA_kernel.path_to_config + '\n\n')
-            freport.write("Hardening options that need improvement:\n")
-            for key in sorted(self.hardening_kco):
-                if (self.hardening_kco[key] != self.hardening_kco_ref[key]):
-                    valid = False
-                    if (key == "CONFIG_CMDLINE"):
-                        if (len(self.hardening_kco['CONFIG_CMDLINE']) > 0):
-                            valid = True
-                    if (key == "CONFIG_DEBUG_STRICT_USER_COPY_CHECKS"):
-                        if (self.hardening_kco['CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS'] == 'y'):
-                            valid = True
-                    if (key == "CONFIG_RANDOMIZE_BASE_MAX_OFFSET"):
-                        options = self.hardening_kco_ref[key].split(',')
-                        for option in options:
-                            if (option == self.hardening_kco[key]):
-                                valid = True
-                                break
-                    if not valid:
-                        freport.write("\nActual value:\n")
-                        freport.write(
-                            key + ' : ' + str(self.hardening_kco[key]) + '\n')
-                        self.append_recommendation(freport, key, self.hardening_kco_ref[key])
-            freport.write("\nKey-related options that need improvement:\n")
-            for key in sorted(self.keys_kco):
-                if (self.keys_kco[key] != self.keys_kco_ref[key]):
+            for index, group in enumerate(GROUPS):
+                freport.write(("\n" if index else "") + GROUP_TITLES[group] + " that need improvement:\n")
+                for verdict in result.get_problems(group):
                     freport.write("\nActual value:\n")
-                    freport.write(key + ' : ' + str(self.keys_kco[key]) + '\n')
-                    self.append_recommendation(freport, key, self.keys_kco_ref[key])
-            freport.write("\nSecurity options that need improvement:\n")
-            for key in sorted(self.security_kco):
-                if (self.security_kco[key] != self.security_kco_ref[key]):
-                    valid = False
-                    if (key == "CONFIG_DEFAULT_SECURITY"):
-                        options = self.security_kco_ref[key].split(',')
-                        for option in options:
-                            if (option == self.security_kco[key]):
-                                valid = True
-                                break
-                    if ((key == "CONFIG_SECURITY_SELINUX") or
-                            (key == "CONFIG_SECURITY_SMACK") or
-                            (key == "CONFIG_SECURITY_APPARMOR") or
-                            (key == "CONFIG_SECURITY_TOMOYO")):
-                        if ((self.security_kco['CONFIG_SECURITY_SELINUX'] == 'y') or
-                                (self.security_kco['CONFIG_SECURITY_SMACK'] == 'y') or
-                                (self.security_kco['CONFIG_SECURITY_APPARMOR'] == 'y') or
-                                (self.security_kco['CONFIG_SECURITY_TOMOYO'] == 'y')):
-                            valid = True
-                    if not valid:
-                        freport.write("\nActual value:\n")
-                        freport.write(
-                            key + ' : ' + str(self.security_kco[key]) + '\n')
-                        self.append_recommendation(freport, key, self.security_kco_ref[key])
-            freport.write("\nIntegrity options that need improvement:\n")
-            for key in sorted(self.integrity_kco):
-                if (self.integrity_kco[key] != self.integrity_kco_ref[key]):
-                    valid = False
-                    if ((key == "CONFIG_IMA_DEFAULT_HASH_SHA1") or
-                            (key == "CONFIG_IMA_DEFAULT_HASH_SHA256") or
-                            (key == "CONFIG_IMA_DEFAULT_HASH_SHA512") or
-                            (key == "CONFIG_IMA_DEFAULT_HASH_WP512")):
-                        if ((self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA256'] == 'y') or
-                                (self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA512'] == 'y')):
-                            valid = True
-                    if not valid:
-                        freport.write("\nActual value:\n")
-                        freport.write(
-                            key + ' : ' + str(self.integrity_kco[key]) + '\n')
-                        self.append_recommendation(freport, key, self.integrity_kco_ref[key])
+                    freport.write(
+                        verdict.option + ' : ' + _kconfig.format_value(verdict.value) + '\n')
+                    self.append_recommendation(freport, result.rules.comments,
+                                               verdict.option, verdict.recommended)
 
-    def write_xml_problems_report(self, ISA_kernel):
+    def write_xml_problems_report(self, ISA_kernel, result):
         # write_problems_report_xml
-        num_tests = len(self.hardening_kco) + len(self.keys_kco) + \
-            len(self.security_kco) + len(self.integrity_kco)
+        num_tests = sum(len(result.verdicts[group]) for group in GROUPS)
         root = etree.Element(
             'testsuite', name='KCA_Plugin', tests=str(num_tests))
-        for key in sorted(self.hardening_kco):
-            tcase1 = etree.SubElement(
-                root, 'testcase', classname='Hardening options', name=key)
-            if (self.hardening_kco[key] != self.hardening_kco_ref[key]):
-                valid = False
-                if (key == "CONFIG_CMDLINE"):
-                    if (len(self.hardening_kco['CONFIG_CMDLINE']) > 0):
-                        valid = True
-                if (key == "CONFIG_DEBUG_STRICT_USER_COPY_CHECKS"):
-                    if (self.hardening_kco['CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS'] == 'y'):
-                        valid = True
-                if (key == "CONFIG_RANDOMIZE_BASE_MAX_OFFSET"):
-                    options = self.hardening_kco_ref[key].split(',')
-                    for option in options:
-                        if (option == self.hardening_kco[key]):
-                            valid = True
-                            break
-                if not valid:
-                    msg1 = 'current=' + key + ' is ' + \
-                        str(self.hardening_kco[
-                            key]) + ', recommended=' + key + ' is ' + str(self.hardening_kco_ref[key])
-                    etree.SubElement(
-                        tcase1, 'failure', message=msg1, type='violation')
-        for key in sorted(self.keys_kco):
-            tcase2 = etree.SubElement(
-                root, 'testcase', classname='Key-related options', name=key)
-            if (self.keys_kco[key] != self.keys_kco_ref[key]):
-                msg2 = 'current=' + key + ' is ' + \
-                    str(self.keys_kco[key] + ', recommended=' +
-                        key + ' is ' + str(self.keys_kco_ref[key]))
-                etree.SubElement(
-                    tcase2, 'failure', message=msg2, type='violation')
-        for key in sorted(self.security_kco):
-            tcase3 = etree.SubElement(
-                root, 'testcase', classname='Security options', name=key)
-            if (self.security_kco[key] != self.security_kco_ref[key]):
-                valid = False
-                if (key == "CONFIG_DEFAULT_SECURITY"):
-                    options = self.security_kco_ref[key].split(',')
-                    for option in options:
-                        if (option == self.security_kco[key]):
-                            valid = True
-                            break
-                if ((key == "CONFIG_SECURITY_SELINUX") or
-                        (key == "CONFIG_SECURITY_SMACK") or
-                        (key == "CONFIG_SECURITY_APPARMOR") or
-                        (key == "CONFIG_SECURITY_TOMOYO")):
-                    if ((self.security_kco['CONFIG_SECURITY_SELINUX'] == 'y') or
-                            (self.security_kco['CONFIG_SECURITY_SMACK'] == 'y') or
-                            (self.security_kco['CONFIG_SECURITY_APPARMOR'] == 'y') or
-                            (self.security_kco['CONFIG_SECURITY_TOMOYO'] == 'y')):
-                        valid = True
-                if not valid:
-                    msg3 = 'current=' + key + ' is ' + \
-                        str(self.security_kco[key]) + ', recommended=' + \
-                        key + ' is ' + str(self.security_kco_ref[key])
+        for group in GROUPS:
+            for verdict in result.verdicts[group]:
+                tcase = etree.SubElement(
+                    root, 'testcase', classname=GROUP_TITLES[group], name=verdict.option)
+                if not verdict.valid:
+                    msg = 'current=' + verdict.option + ' is ' + _kconfig.format_value(verdict.value) + \
+                        ', recommended=' + verdict.option + ' is ' + str(verdict.recommended)
                     etree.SubElement(
-                        tcase3, 'failure', message=msg3, type='violation')
-        for key in sorted(self.integrity_kco):
-            tcase4 = etree.SubElement(
-                root, 'testcase', classname='Integrity options', name=key)
-            if (self.integrity_kco[key] != self.integrity_kco_ref[key]):
-                valid = False
-                if ((key == "CONFIG_IMA_DEFAULT_HASH_SHA1") or
-                        (key == "CONFIG_IMA_DEFAULT_HASH_SHA256") or
-                        (key == "CONFIG_IMA_DEFAULT_HASH_SHA512") or
-                        (key == "CONFIG_IMA_DEFAULT_HASH_WP512")):
-                    if ((self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA256'] == 'y') or
-                            (self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA512'] == 'y')):
-                        valid = True
-                if not valid:
-                    msg4 = 'current=' + key + ' is ' + \
-                        str(self.integrity_kco[
-                            key]) + ', recommended=' + key + ' is ' + str(self.integrity_kco_ref[key])
-                    etree.SubElement(
-                        tcase4, 'failure', message=msg4, type='violation')
+                        tcase, 'failure', message=msg, type='violation')
         tree = etree.ElementTree(root)
         output = self.problems_report_name + "_" + ISA_kernel.img_name + '.xml'
         try:
@@ -303,6 +533,24 @@ class ISA_KernelChecker():
             tree.write(output, encoding='UTF-8', xml_declaration=True)
 
 
+def parse_kernel_config(task):
+    # worker of process_kernels(), returns the options of a config that
+    # are in names. Errors are returned so that a config that cannot be
+    # read does not fail the others.
+    path, names = task
+    try:
+        options = _kconfig.read_config(path)
+    except (IOError, OSError) as e:
+        return None, str(e)
+    return dict((name, options[name]) for name in names if name in options), None
+
+
+def open_csv(path):
+    if str is bytes:
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
 def merge_config(arch_kco, common_kco):
     merged = arch_kco.copy()
     merged.update(common_kco)
@@ -321,4 +569,9 @@ def getPluginName():
 def process_kernel(ISA_kernel):
     global KCAnalyzer
     return KCAnalyzer.process_kernel(ISA_kernel)
+
+
+def process_kernels(ISA_kernels, per_image_reports=False):
+    global KCAnalyzer
+    return KCAnalyzer.process_kernels(ISA_kernels, per_image_reports)
 # ==================================================== #
@@ -29,6 +29,13 @@
 
 import subprocess
 import os, sys
+import stat
+try:
+    from . import _walk
+    from . import _writers
+except (ImportError, ValueError):
+    import _walk
+    import _writers
 
 LicenseChecker = None
 
@@ -44,6 +51,8 @@ class ISA_LicenseChecker():
     def __init__(self, ISA_config):
         self.proxy = ISA_config.proxy
         self.logfile = ISA_config.logdir + "/isafw_lalog"
+        self.writers = _writers.get_writers(ISA_config)
+        self.walk_workers = ISA_config.walk_workers
         self.unwanted = []
         self.report_name = ISA_config.reportdir + "/la_problems_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
@@ -57,10 +66,10 @@ class ISA_LicenseChecker():
         DEVNULL.close()
         if rc == 0:
             self.initialized = True
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("\nPlugin ISA_LA initialized!\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("rpm tool is missing!\n")
 
     def process_package(self, ISA_pkg):
@@ -68,19 +77,20 @@ class ISA_LicenseChecker():
             if ISA_pkg.name:
                 if (not ISA_pkg.licenses):
                     # need to determine licenses first
-                    if (not ISA_pkg.source_files):
+                    source_files = ISA_pkg.source_files
+                    if (not source_files):
                         if (not ISA_pkg.path_to_sources):
                             self.initialized = False
-                            with open(self.logfile, 'a') as flog:
+                            with self.writers.open(self.logfile, 'a') as flog:
                                 flog.write(
                                     "No path to sources or source file list is provided!")
                                 flog.write(
                                     "\nNot able to determine licenses for package: " + ISA_pkg.name)
                             return
-                        # need to build list of source files
-                        ISA_pkg.source_files = self.find_files(
+                        # source files are found while the tree is walked
+                        source_files = self.find_files(
                             ISA_pkg.path_to_sources)
-                    for i in ISA_pkg.source_files:
+                    for i in source_files:
                         if (i.endswith(".spec")):# supporting rpm only for now
                             args = ("rpm", "-q", "--queryformat",
                                     "%{LICENSE} ", "--specfile", i)
@@ -91,7 +101,7 @@ class ISA_LicenseChecker():
                                 ISA_pkg.licenses = popen.stdout.read().split()
                             except:
                                 self.initialized = False
-                                with open(self.logfile, 'a') as flog:
+                                with self.writers.open(self.logfile, 'a') as flog:
                                     flog.write(
                                         "Error in executing rpm query: " + str(sys.exc_info()))
                                     flog.write(
@@ -102,31 +112,34 @@ class ISA_LicenseChecker():
                             not self.check_license(l, fapproved_non_osi) and
                             not self.check_exceptions(ISA_pkg.name, l, fexceptions)):
                         # log the package as not following correct license
-                        with open(self.report_name, 'a') as freport:
+                        with self.writers.open(self.report_name, 'a') as freport:
                             freport.write(l + "\n")
                     if (self.check_license(l, funwanted)):
                         # log the package as having license that should not be
                         # used
-                        with open(self.report_name + "_unwanted", 'a') as freport:
+                        with self.writers.open(self.report_name + "_unwanted", 'a') as freport:
                             freport.write(l + "\n")
             else:
                 self.initialized = False
-                with open(self.logfile, 'a') as flog:
+                with self.writers.open(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory argument package name is not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call.")
 
     def process_report(self):
+        # the reports are read back and extended below
+        self.writers.close(self.report_name)
+        self.writers.close(self.report_name + "_unwanted")
         if (self.initialized):
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Creating report with violating licenses.\n")
             self.process_pkg_list()
             self.write_report_unwanted()
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("Creating report in XML format.\n")
             self.write_report_xml()
 
@@ -140,7 +153,7 @@ class ISA_LicenseChecker():
                         continue
                     if line.startswith("Packages "):
                         img_name = line.split()[3]
-                        with open(self.logfile, 'a') as flog:
+                        with self.writers.open(self.logfile, 'a') as flog:
                             flog.write("img_name: " + img_name + "\n")
                         continue
                     package_info = line.split()
@@ -189,7 +202,7 @@ class ISA_LicenseChecker():
 
     def write_report_unwanted(self):
         if os.path.isfile(self.report_name + "_unwanted"):
-            with open(self.logfile, 'a') as flog:
+            with self.writers.open(self.logfile, 'a') as flog:
                 flog.write("image_pkgs: " + str(self.image_pkgs) + "\n")
                 flog.write("self.la_plugin_image_whitelist: " + str(self.la_plugin_image_whitelist) + "\n")
                 flog.write("self.la_plugin_image_blacklist: " + str(self.la_plugin_image_blacklist) + "\n")
@@ -220,11 +233,11 @@ class ISA_LicenseChecker():
             os.remove(self.report_name + "_unwanted")
 
     def find_files(self, init_path):
-        list_of_files = []
-        for (dirpath, dirnames, filenames) in os.walk(init_path):
-            for f in filenames:
-                list_of_files.append(str(dirpath + "/" + f)[:])
-        return list_of_files
+        # paths of everything but directories, yielded while the
+        # directories are still being read
+        for entry in _walk.walk(init_path, self.walk_workers):
+            if not stat.S_ISDIR(entry.mode):
+                yield entry.path
 
     def check_license(self, license, file_path):
         with open(os.path.dirname(__file__) + file_path, 'r') as f:
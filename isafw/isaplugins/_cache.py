@@ -0,0 +1,109 @@
+#
+# _cache.py - Persistent per-file result cache for ISA FW plugins
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import sqlite3
+import time
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_name):
+    """Returns the SHA-256 hex digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_digest(data):
+    """Returns the SHA-256 hex digest of file content read into memory."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache(object):
+    """SQLite backed store of per-file results keyed by content digest
+    and by a version string identifying the producer of the results."""
+
+    def __init__(self, path, version, readonly=False):
+        self.version = version
+        self.connection = sqlite3.connect(path, timeout=60)
+        if not readonly:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "digest TEXT NOT NULL, version TEXT NOT NULL, "
+                "result TEXT NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (digest, version))")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.connection.commit()
+
+    def get(self, digest):
+        row = self.connection.execute(
+            "SELECT result FROM results WHERE digest = ? AND version = ?",
+            (digest, self.version)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, entries):
+        """Stores a list of (digest, result) pairs."""
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO results (digest, version, result, last_used) "
+            "VALUES (?, ?, ?, ?)",
+            [(digest, self.version, json.dumps(result), now) for digest, result in entries])
+        self.connection.commit()
+
+    def touch(self, digests):
+        """Marks the entries for the given digests as recently used."""
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE results SET last_used = ? WHERE digest = ? AND version = ?",
+            [(now, digest, self.version) for digest in digests])
+        self.connection.commit()
+
+    def evict(self, max_age=0, max_entries=0):
+        """Removes entries unused for more than max_age days and the least
+        recently used entries above max_entries. Zero disables a limit."""
+        if max_age:
+            self.connection.execute("DELETE FROM results WHERE last_used < ?",
+                                    (time.time() - max_age * 24 * 3600,))
+        if max_entries:
+            self.connection.execute(
+                "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (max_entries,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
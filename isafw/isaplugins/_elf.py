@@ -0,0 +1,421 @@
+#
+# _elf.py - ELF file parsing helpers for the CFA plugin, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import re
+import struct
+
+# e_ident values
+ELFMAG = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# e_type values
+ET_NONE = 0
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+ET_CORE = 4
+
+# e_machine values
+EM_386 = 3
+EM_X86_64 = 62
+
+# program header types and flags
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_GNU_STACK = 0x6474e551
+PT_GNU_RELRO = 0x6474e552
+PF_X = 0x1
+PF_W = 0x2
+PF_R = 0x4
+
+# section header types
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_verneed = 0x6ffffffe
+SHT_GNU_versym = 0x6fffffff
+SHF_EXECINSTR = 0x4
+
+# dynamic section tags and flags
+DT_NULL = 0
+DT_DEBUG = 21
+DT_RPATH = 15
+DT_BIND_NOW = 24
+DT_RUNPATH = 29
+DT_FLAGS = 30
+DT_FLAGS_1 = 0x6ffffffb
+DF_BIND_NOW = 0x8
+DF_1_NOW = 0x1
+DF_1_PIE = 0x08000000
+
+SHN_UNDEF = 0
+
+ET_NAMES = {
+    ET_NONE: "none",
+    ET_REL: "relocatable",
+    ET_EXEC: "executable",
+    ET_DYN: "shared object",
+    ET_CORE: "core",
+}
+
+# e_ident (16 bytes) followed by e_type (2 bytes)
+IDENT_SIZE = 18
+
+
+def read_elf_type(file_name):
+    """Returns the e_type of an ELF file or None if the file is not ELF."""
+    try:
+        with open(file_name, 'rb') as f:
+            ident = f.read(IDENT_SIZE)
+    except (IOError, OSError):
+        return None
+    return parse_elf_type(ident)
+
+
+def parse_elf_type(ident):
+    if len(ident) < IDENT_SIZE or ident[:4] != ELFMAG:
+        return None
+    ei_class = struct.unpack('B', ident[4:5])[0]
+    ei_data = struct.unpack('B', ident[5:6])[0]
+    if ei_class not in (ELFCLASS32, ELFCLASS64):
+        return None
+    if ei_data == ELFDATA2LSB:
+        return struct.unpack('<H', ident[16:18])[0]
+    elif ei_data == ELFDATA2MSB:
+        return struct.unpack('>H', ident[16:18])[0]
+    return None
+
+
+# Escape and opcode bytes shared by the MPX bound check and move instructions
+_MPX_OPCODE = re.compile(br'\x0f[\x1a\x1b]')
+_MPX_MAX_LENGTH = 5
+_SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+class ELFError(Exception):
+    pass
+
+
+class ELFFile(object):
+    """Minimal reader for the ELF structures used by the CFA checks."""
+
+    def __init__(self, f):
+        self.f = f
+        ident = self._read(0, 16)
+        if len(ident) < 16 or ident[:4] != ELFMAG:
+            raise ELFError("Not an ELF file")
+        self.elfclass = struct.unpack('B', ident[4:5])[0]
+        ei_data = struct.unpack('B', ident[5:6])[0]
+        if ei_data == ELFDATA2LSB:
+            self.endian = '<'
+        elif ei_data == ELFDATA2MSB:
+            self.endian = '>'
+        else:
+            raise ELFError("Unknown ELF data encoding")
+        if self.elfclass == ELFCLASS32:
+            (self.e_type, self.e_machine, self.e_phoff, self.e_shoff,
+             self.e_phentsize, self.e_phnum, self.e_shentsize, self.e_shnum,
+             self.e_shstrndx) = self._unpack('HHxxxxxxxxIIxxxxxxHHHHH', 16)
+        elif self.elfclass == ELFCLASS64:
+            (self.e_type, self.e_machine, self.e_phoff, self.e_shoff,
+             self.e_phentsize, self.e_phnum, self.e_shentsize, self.e_shnum,
+             self.e_shstrndx) = self._unpack('HHxxxxxxxxxxxxQQxxxxxxHHHHH', 16)
+        else:
+            raise ELFError("Unknown ELF class")
+        self._segments = None
+        self._sections = None
+        self._dynamic = None
+        self._symbols = None
+        self._imports = None
+
+    def _read(self, offset, size):
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def _unpack(self, fmt, offset):
+        fmt = self.endian + fmt
+        size = struct.calcsize(fmt)
+        data = self._read(offset, size)
+        if len(data) < size:
+            raise ELFError("Truncated ELF file")
+        return struct.unpack(fmt, data)
+
+    @property
+    def segments(self):
+        """List of (p_type, p_flags, p_offset, p_vaddr, p_filesz) tuples."""
+        if self._segments is None:
+            self._segments = []
+            for i in range(self.e_phnum):
+                offset = self.e_phoff + i * self.e_phentsize
+                if self.elfclass == ELFCLASS32:
+                    (p_type, p_offset, p_vaddr, p_filesz, p_flags) = \
+                        self._unpack('IIIxxxxIxxxxI', offset)
+                else:
+                    (p_type, p_flags, p_offset, p_vaddr, p_filesz) = \
+                        self._unpack('IIQQxxxxxxxxQ', offset)
+                self._segments.append((p_type, p_flags, p_offset, p_vaddr, p_filesz))
+        return self._segments
+
+    @property
+    def sections(self):
+        """List of (sh_name, sh_type, sh_flags, sh_offset, sh_size, sh_link, sh_entsize) tuples."""
+        if self._sections is None:
+            self._sections = []
+            if self.e_shoff:
+                for i in range(self.e_shnum):
+                    offset = self.e_shoff + i * self.e_shentsize
+                    if self.elfclass == ELFCLASS32:
+                        (sh_name, sh_type, sh_flags, sh_offset, sh_size, sh_link, sh_entsize) = \
+                            self._unpack('IIIxxxxIIIxxxxxxxxI', offset)
+                    else:
+                        (sh_name, sh_type, sh_flags, sh_offset, sh_size, sh_link, sh_entsize) = \
+                            self._unpack('IIQxxxxxxxxQQIxxxxxxxxxxxxQ', offset)
+                    self._sections.append((sh_name, sh_type, sh_flags, sh_offset,
+                                           sh_size, sh_link, sh_entsize))
+        return self._sections
+
+    def get_segment(self, p_type):
+        for segment in self.segments:
+            if segment[0] == p_type:
+                return segment
+        return None
+
+    @property
+    def dynamic(self):
+        """Dictionary of dynamic section tags to their (last) values."""
+        if self._dynamic is None:
+            self._dynamic = {}
+            segment = self.get_segment(PT_DYNAMIC)
+            if segment:
+                fmt = 'iI' if self.elfclass == ELFCLASS32 else 'qQ'
+                entsize = struct.calcsize(fmt)
+                data = self._read(segment[2], segment[4])
+                for offset in range(0, len(data) - entsize + 1, entsize):
+                    d_tag, d_val = struct.unpack_from(self.endian + fmt, data, offset)
+                    if d_tag == DT_NULL:
+                        break
+                    self._dynamic[d_tag] = d_val
+        return self._dynamic
+
+    def _read_string(self, strings, start):
+        end = strings.find(b'\0', start)
+        if end < 0:
+            end = len(strings)
+        return strings[start:end].decode('ascii', 'replace')
+
+    def _read_section(self, index):
+        section = self.sections[index]
+        if section[1] == SHT_NOBITS:
+            return b''
+        return self._read(section[3], section[4])
+
+    def _read_version_names(self):
+        # maps version indexes used in .gnu.version to the names of the
+        # versions required from other objects (.gnu.version_r)
+        names = {}
+        for section in self.sections:
+            if section[1] != SHT_GNU_verneed or section[5] >= len(self.sections):
+                continue
+            strings = self._read_section(section[5])
+            data = self._read(section[3], section[4])
+            offset = 0
+            while offset + 16 <= len(data):
+                (vn_cnt, vn_aux, vn_next) = struct.unpack_from(
+                    self.endian + 'xxHxxxxII', data, offset)
+                aux = offset + vn_aux
+                for i in range(vn_cnt):
+                    if aux + 16 > len(data):
+                        break
+                    (vna_other, vna_name, vna_next) = struct.unpack_from(
+                        self.endian + 'xxxxxxHII', data, aux)
+                    names[vna_other] = self._read_string(strings, vna_name)
+                    if not vna_next:
+                        break
+                    aux += vna_next
+                if not vn_next:
+                    break
+                offset += vn_next
+        return names
+
+    def _load_symbols(self):
+        self._symbols = set()
+        self._imports = {}
+        sections = self.sections
+        if self.elfclass == ELFCLASS32:
+            fmt, info_idx, shndx_idx = 'IIIBBH', 3, 5
+        else:
+            fmt, info_idx, shndx_idx = 'IBBHQQ', 1, 3
+        fmt = self.endian + fmt
+        entsize = struct.calcsize(fmt)
+        versym = None
+        version_names = {}
+        for section in sections:
+            if section[1] == SHT_GNU_versym:
+                versym = self._read(section[3], section[4])
+                version_names = self._read_version_names()
+                break
+        for section in sections:
+            if section[1] not in (SHT_DYNSYM, SHT_SYMTAB) or section[5] >= len(sections):
+                continue
+            dynsym = section[1] == SHT_DYNSYM
+            strings = self._read_section(section[5])
+            data = self._read(section[3], section[4])
+            for index, offset in enumerate(range(0, len(data) - entsize + 1, entsize)):
+                sym = struct.unpack_from(fmt, data, offset)
+                name = self._read_string(strings, sym[0])
+                if not name:
+                    continue
+                self._symbols.add(name)
+                if dynsym and sym[shndx_idx] == SHN_UNDEF:
+                    version = None
+                    if versym and 2 * index + 2 <= len(versym):
+                        version = version_names.get(
+                            struct.unpack_from(self.endian + 'H', versym, 2 * index)[0] & 0x7fff)
+                    self._imports[name] = version
+
+    @property
+    def symbols(self):
+        """Set of the names of all symbols in .dynsym and .symtab."""
+        if self._symbols is None:
+            self._load_symbols()
+        return self._symbols
+
+    @property
+    def imports(self):
+        """Dictionary of undefined .dynsym symbol names to the name of the
+        version they are required with, or None for unversioned symbols."""
+        if self._imports is None:
+            self._load_symbols()
+        return self._imports
+
+    def is_bind_now(self):
+        dynamic = self.dynamic
+        return (DT_BIND_NOW in dynamic or
+                (dynamic.get(DT_FLAGS, 0) & DF_BIND_NOW) != 0 or
+                (dynamic.get(DT_FLAGS_1, 0) & DF_1_NOW) != 0)
+
+
+def checksec(elf):
+    """Returns the same fields as a "checksec.sh --file" table row,
+    except the trailing file name."""
+    if elf.get_segment(PT_GNU_RELRO):
+        if elf.is_bind_now():
+            relro = "Full RELRO"
+        else:
+            relro = "Partial RELRO"
+    else:
+        relro = "No RELRO"
+    if "__stack_chk_fail" in elf.symbols:
+        canary = "Canary found"
+    else:
+        canary = "No canary found"
+    stack = elf.get_segment(PT_GNU_STACK)
+    # same as the "RWE" match of checksec.sh 1.x on the readelf output, so
+    # that the built-in and external modes agree: a missing PT_GNU_STACK
+    # is reported as NX enabled, execstack() reports it as not_defined
+    if stack and (stack[1] & (PF_R | PF_W | PF_X)) == PF_R | PF_W | PF_X:
+        nx = "NX disabled"
+    else:
+        nx = "NX enabled"
+    if elf.e_type == ET_EXEC:
+        pie = "No PIE"
+    elif elf.e_type == ET_DYN:
+        if (elf.get_segment(PT_INTERP) or
+                (elf.dynamic.get(DT_FLAGS_1, 0) & DF_1_PIE)):
+            pie = "PIE enabled"
+        else:
+            pie = "DSO"
+    elif elf.e_type == ET_REL:
+        pie = "REL"
+    else:
+        pie = "Not an ELF file"
+    rpath = "RPATH" if DT_RPATH in elf.dynamic else "No RPATH"
+    runpath = "RUNPATH" if DT_RUNPATH in elf.dynamic else "No RUNPATH"
+    return [relro, canary, nx, pie, rpath, runpath]
+
+
+def execstack(elf):
+    """Returns the stack status as reported by "execstack -q":
+    "execstack", "not_defined" or an empty string."""
+    stack = elf.get_segment(PT_GNU_STACK)
+    if not stack:
+        return "not_defined"
+    if stack[1] & PF_X:
+        return "execstack"
+    return ""
+
+
+def _is_mpx_instruction(data, pos):
+    # data[pos] is the 0x0f escape byte; bndcl (f3), bndcu (f2) and
+    # bndmov (66) need a mandatory prefix, optionally followed by REX,
+    # and a ModRM byte referring to one of the bnd0-bnd3 registers
+    if pos + 2 >= len(data) or (data[pos + 2] & 0x20):
+        return False
+    opcode = data[pos + 1]
+    pos -= 1
+    if pos >= 0 and 0x40 <= data[pos] <= 0x4f:
+        pos -= 1
+    if pos < 0:
+        return False
+    if opcode == 0x1a:
+        return data[pos] in (0xf2, 0xf3, 0x66)
+    return data[pos] == 0x66
+
+
+def may_have_mpx_instructions(elf):
+    """Scans the executable sections of an x86 ELF file for byte sequences
+    encoding the MPX bndcl, bndcu and bndmov instructions. A match can be
+    a false positive caused by data in the code, but no match means the
+    file does not use MPX."""
+    if elf.e_machine not in (EM_386, EM_X86_64):
+        return False
+    for section in elf.sections:
+        if section[1] == SHT_NOBITS or not (section[2] & SHF_EXECINSTR):
+            continue
+        offset = section[3]
+        remaining = section[4]
+        tail = bytearray()
+        while remaining > 0:
+            chunk = elf._read(offset, min(_SCAN_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            # keep the end of the previous chunk to catch split instructions
+            data = tail + bytearray(chunk)
+            for match in _MPX_OPCODE.finditer(data):
+                if _is_mpx_instruction(data, match.start()):
+                    return True
+            tail = data[-(_MPX_MAX_LENGTH - 1):]
+            offset += len(chunk)
+            remaining -= len(chunk)
+    return False
@@ -0,0 +1,154 @@
+#
+# _findings.py - Compact storage of plugin findings, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import zlib
+from array import array
+
+PARTIAL_VERSION = 1
+
+
+def in_shard(path, shard_index, shard_count):
+    """Assigns relative paths to shards by a hash that does not change
+    between runs, hosts or Python versions."""
+    if shard_count <= 1:
+        return True
+    if not isinstance(path, bytes):
+        # the bytes of the name on disk: Python 3 decodes undecodable bytes
+        # of file names to surrogates, Python 2 has no such error handler
+        path = path.encode('utf-8', 'strict' if str is bytes else 'surrogateescape')
+    return (zlib.crc32(path) & 0xffffffff) % shard_count == shard_index
+
+
+def _native(value):
+    # JSON gives unicode strings on Python 2
+    if str is bytes and not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+class Findings(object):
+    """Relative paths of files with findings, grouped by category.
+
+    Every path is stored once and categories only hold indexes into the
+    path list, so memory grows with the number of findings instead of
+    with the number of analyzed files."""
+
+    def __init__(self, categories):
+        self.paths = []
+        self.details = {}
+        self.indexes = dict((category, array('L')) for category in categories)
+        # position of each path in the results of an unsharded run,
+        # only recorded when scanning a shard
+        self.sequence = array('L')
+
+    def add_path(self, path, details=None, sequence=None):
+        """Stores a path and returns its index for add()."""
+        self.paths.append(path)
+        index = len(self.paths) - 1
+        if details:
+            self.details[index] = details
+        if sequence is not None:
+            self.sequence.append(sequence)
+        return index
+
+    def add(self, category, index):
+        self.indexes[category].append(index)
+
+    def get(self, category):
+        """Returns the paths in a category in the order they were added."""
+        paths = self.paths
+        return [paths[index] for index in self.indexes[category]]
+
+    def get_details(self, category):
+        """Returns (path, details) pairs for a category."""
+        return [(self.paths[index], self.details.get(index))
+                for index in self.indexes[category]]
+
+    def count(self, category):
+        return len(self.indexes[category])
+
+    def __len__(self):
+        return sum(len(indexes) for indexes in self.indexes.values())
+
+    def save_partial(self, path, info):
+        """Writes the findings of a shard together with a dictionary of
+        information identifying the plugin, image and shard."""
+        data = dict(info)
+        data["version"] = PARTIAL_VERSION
+        data["paths"] = self.paths
+        data["sequence"] = list(self.sequence)
+        data["details"] = sorted(self.details.items())
+        data["indexes"] = dict((category, list(indexes))
+                               for category, indexes in self.indexes.items())
+        with open(path, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+
+    @classmethod
+    def merge(cls, categories, partials):
+        """Combines the findings of all shards of a scan in the order of
+        an unsharded run."""
+        entries = []
+        for partial in partials:
+            details = dict(partial["details"])
+            path_categories = [[] for path in partial["paths"]]
+            for category in categories:
+                for index in partial["indexes"].get(category, []):
+                    path_categories[index].append(category)
+            for index, path in enumerate(partial["paths"]):
+                entries.append((partial["sequence"][index], _native(path),
+                                _native(details.get(index, "")), path_categories[index]))
+        entries.sort(key=lambda entry: entry[0])
+        findings = cls(categories)
+        for sequence, path, details, path_categories in entries:
+            index = findings.add_path(path, details)
+            for category in path_categories:
+                findings.add(category, index)
+        return findings
+
+
+def load_partials(partial_reports, plugin, img_name):
+    """Returns the partial results of a plugin for an image, or raises
+    ValueError if the shards of the scan are not all present."""
+    partials = []
+    for partial_report in partial_reports:
+        with open(partial_report, 'r') as f:
+            data = json.load(f)
+        if data.get("plugin") == plugin and data.get("img_name") == img_name:
+            if data.get("version") != PARTIAL_VERSION:
+                raise ValueError("Unsupported version of partial results in " + partial_report)
+            partials.append(data)
+    if not partials:
+        raise ValueError("No partial results found")
+    shard_count = partials[0]["shard_count"]
+    shards = sorted(partial["shard_index"] for partial in partials)
+    if (shards != list(range(shard_count)) or
+            any(partial["shard_count"] != shard_count for partial in partials)):
+        raise ValueError("Expected results of shards 0 to " + str(shard_count - 1) +
+                         ", found " + str(shards))
+    return partials
@@ -0,0 +1,176 @@
+#
+# _fssource.py - Filesystem archives as sources of ISA FW plugins
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import posixpath
+import stat
+import tarfile
+import threading
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz")
+
+# number of links followed when resolving a path inside an archive
+_MAX_LINK_DEPTH = 40
+
+
+def is_archive(path):
+    return path.endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+
+def normalize(name):
+    """Returns the path of an archive member relative to the rootfs,
+    e.g. "/bin/ls" for "./bin/ls", or "" for the root directory."""
+    # normpath() keeps two leading slashes
+    name = posixpath.normpath("/" + name.lstrip("/"))
+    return "" if name == "/" else name
+
+
+class Entry(object):
+    """Metadata of an archive member, like an lstat() result."""
+    __slots__ = ("path", "mode", "uid", "gid", "size", "mtime", "linkname", "hardlink")
+
+    def __init__(self, info):
+        self.path = normalize(info.name)
+        self.mode = info.mode & 0o7777
+        if info.isdir():
+            self.mode |= stat.S_IFDIR
+        elif info.issym():
+            self.mode |= stat.S_IFLNK
+        elif info.ischr():
+            self.mode |= stat.S_IFCHR
+        elif info.isblk():
+            self.mode |= stat.S_IFBLK
+        elif info.isfifo():
+            self.mode |= stat.S_IFIFO
+        else:
+            # hardlinks are regular files sharing the data of another member
+            self.mode |= stat.S_IFREG
+        self.uid = info.uid
+        self.gid = info.gid
+        self.size = info.size
+        self.mtime = info.mtime
+        self.linkname = info.linkname
+        self.hardlink = info.islnk()
+
+
+class TarSource(object):
+    """Sequential reader of a rootfs archive.
+
+    The archive is read as a stream, so compressed archives are read only
+    once per pass. The metadata of all members is kept after the first
+    complete pass, so that plugins which only need metadata do not read
+    the archive again. ISA calls the plugins in the order of their names,
+    so CFA reads the members with their content before FSA takes the
+    metadata, and the archive is read once per scan."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.links = None
+        self.paths = None
+        # only one thread makes the metadata pass
+        self.lock = threading.Lock()
+
+    def get_entries(self):
+        with self.lock:
+            if self.entries is None:
+                for entry, f in self.iter_members():
+                    pass
+        return self.entries
+
+    def iter_members(self):
+        """Yields (Entry, file object) for every member in archive order.
+        The file object of regular members must be read before the next
+        member is requested, it is None for other members."""
+        entries = []
+        links = {}
+        with tarfile.open(self.path, "r|*") as tar:
+            for info in tar:
+                entry = Entry(info)
+                if not entry.path:
+                    continue
+                entries.append(entry)
+                if info.issym() or info.islnk():
+                    links[entry.path] = entry
+                yield entry, tar.extractfile(info) if info.isreg() else None
+        # links are set first, entries tell that the pass is complete
+        self.links = links
+        self.entries = entries
+
+    def get_entry(self, path):
+        if self.paths is None:
+            self.paths = dict((entry.path, entry) for entry in self.get_entries())
+        return self.paths.get(path)
+
+    def is_directory_link(self, entry):
+        """Tells whether a member is a symbolic link to a directory, which
+        is not listed as a file, like os.walk() does for directories."""
+        if not stat.S_ISLNK(entry.mode):
+            return False
+        target = self.get_entry(self.resolve(entry.path))
+        return target is not None and stat.S_ISDIR(target.mode)
+
+    def resolve(self, path):
+        """Returns the member a path refers to after following symbolic
+        links and hardlinks inside the archive, or None for a loop."""
+        if self.links is None:
+            self.get_entries()
+        for i in range(_MAX_LINK_DEPTH):
+            parts = path.split("/")[1:]
+            for j in range(len(parts)):
+                prefix = "/" + "/".join(parts[:j + 1])
+                link = self.links.get(prefix)
+                if link is None:
+                    continue
+                if link.hardlink:
+                    target = normalize(link.linkname)
+                else:
+                    # absolute links point into the rootfs, not to the host
+                    target = normalize(posixpath.join(posixpath.dirname(prefix), link.linkname))
+                path = target + "/" + "/".join(parts[j + 1:]) if parts[j + 1:] else target
+                break
+            else:
+                return path
+        return None
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def open_source(path):
+    """Returns the TarSource of an archive, shared by all plugins and by
+    the images analyzed at the same time as long as the archive does not
+    change."""
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime)
+    with _sources_lock:
+        source = _sources.get(path)
+        if source is None or source[0] != key:
+            source = _sources[path] = (key, TarSource(path))
+    return source[1]
@@ -0,0 +1,215 @@
+#
+# _kconfig.py - Parser of kernel configs, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import bz2
+import itertools
+import re
+import zlib
+try:
+    import lzma
+except ImportError:
+    # not available on Python 2, xz compressed kernels cannot be read
+    lzma = None
+
+# value of the options that are disabled or not in the config at all
+NOT_SET = "not set"
+
+# "NAME=value" and "# NAME is not set" lines, the value is the rest of the
+# line, so quoted strings may contain "=" or "#"
+_LINE = re.compile(r'^(?:([A-Za-z0-9_]+)=([^\r\n]*)|# ([A-Za-z0-9_]+) is not set)', re.MULTILINE)
+# a string value as kconfig writes it, with "\" and '"' escaped by "\"
+_QUOTED = re.compile(r'^"((?:[^"\\]|\\.)*)"$', re.DOTALL)
+_ESCAPED = re.compile(r'\\(.)', re.DOTALL)
+_TO_ESCAPE = re.compile(r'(["\\])')
+
+
+class String(str):
+    """Value of a string option, without the quotes of the config."""
+    __slots__ = ()
+
+
+def unquote(value):
+    """Returns a quoted string value of a config as String, other values
+    as they are."""
+    match = _QUOTED.match(value)
+    if match is None:
+        return value
+    return String(_ESCAPED.sub(r'\1', match.group(1)))
+
+
+def format_value(value):
+    """Returns a value as it is written in a config, i.e. String values quoted."""
+    if isinstance(value, String):
+        return '"' + _TO_ESCAPE.sub(r'\\\1', value) + '"'
+    return value
+
+
+def parse_config(text):
+    """Returns the options of a kernel config as a dict of name -> value.
+
+    The text is tokenized in a single pass, options that are not set get
+    NOT_SET and the last assignment of an option wins, like in kconfig.
+    String values are unquoted, see unquote(). Comments and other lines
+    are ignored."""
+    options = {}
+    for name, value, unset_name in _LINE.findall(text):
+        if name:
+            options[name] = unquote(value)
+        else:
+            options[unset_name] = NOT_SET
+    return options
+
+
+_CHUNK_SIZE = 1024 * 1024
+# bytes looked at to tell text configs from binaries
+_SNIFF_SIZE = 4096
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+# start of the gzip compressed config in kernels built with CONFIG_IKCONFIG
+IKCONFIG_START = b"IKCFG_ST"
+
+# compressions of kernel images like bzImage or zImage that can be read,
+# by their magic bytes
+_COMPRESSIONS = [(_GZIP_MAGIC, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+                 (b"BZh", bz2.BZ2Decompressor)]
+_DECOMPRESS_ERRORS = (zlib.error, EOFError, IOError, OSError, ValueError)
+if lzma is not None:
+    _COMPRESSIONS.append((b"\xfd7zXZ\x00", lzma.LZMADecompressor))
+    _DECOMPRESS_ERRORS += (lzma.LZMAError,)
+
+
+def read_config(path):
+    """Returns the options of the kernel config at path, see parse_config().
+
+    Besides plain text configs, gzip compressed ones like /proc/config.gz
+    and kernels built with CONFIG_IKCONFIG are read: vmlinux, compressed
+    images like bzImage, zImage or Image.gz. The config is decompressed
+    as a stream from the file, without temporary files."""
+    with open(path, 'rb') as f:
+        if f.read(len(_GZIP_MAGIC)) == _GZIP_MAGIC:
+            try:
+                data = _config_from_chunks(_decompress(_read_chunks(f), _COMPRESSIONS[0][1]()))
+            except _DECOMPRESS_ERRORS as e:
+                raise IOError("Not able to decompress the kernel config in " + path + ": " + str(e))
+        else:
+            try:
+                data = _config_from_chunks(_read_chunks(f))
+            except _DECOMPRESS_ERRORS:
+                # IKCONFIG_START can also show up in the stored blocks of
+                # a compressed kernel
+                data = None
+            if data is None:
+                # the config is in the compressed kernel of the image
+                data = _config_from_compressed_kernel(f)
+    if data is None:
+        raise IOError("No kernel config found in " + path +
+                      ", kernel images need to be built with CONFIG_IKCONFIG")
+    if str is not bytes:
+        data = data.decode('utf-8', 'replace')
+    return parse_config(data)
+
+
+def _read_chunks(f, offset=0):
+    f.seek(offset)
+    while True:
+        chunk = f.read(_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _decompress(chunks, decompressor):
+    # yields the decompressed data of a stream, data after its end is ignored
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+        if getattr(decompressor, "eof", False) or decompressor.unused_data:
+            return
+    if hasattr(decompressor, "flush"):
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def _config_from_chunks(chunks):
+    # a config as text, or the embedded config of a kernel, None if the
+    # data is binary without an embedded config
+    chunks = iter(chunks)
+    head = []
+    head_length = 0
+    for chunk in chunks:
+        head.append(chunk)
+        head_length += len(chunk)
+        if head_length >= _SNIFF_SIZE:
+            break
+    chunks = itertools.chain(head, chunks)
+    if b"\0" not in b"".join(head)[:_SNIFF_SIZE]:
+        return b"".join(chunks)
+    return _extract_ikconfig(chunks)
+
+
+def _extract_ikconfig(chunks):
+    # the config follows IKCONFIG_START as a gzip stream
+    tail = b""
+    for chunk in chunks:
+        data = tail + chunk
+        index = data.find(IKCONFIG_START)
+        if index >= 0:
+            start = data[index + len(IKCONFIG_START):]
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            return b"".join(_decompress(itertools.chain([start], chunks), decompressor))
+        tail = data[-(len(IKCONFIG_START) - 1):]
+    return None
+
+
+def _config_from_compressed_kernel(f):
+    # the compressed kernel starts after the setup code of the image, so
+    # each compressed stream found in the image is tried in turn
+    offsets = set()
+    magic_length = max(len(magic) for magic, decompressor in _COMPRESSIONS)
+    tail = b""
+    position = 0
+    for chunk in _read_chunks(f):
+        data = tail + chunk
+        base = position - len(tail)
+        for magic, decompressor in _COMPRESSIONS:
+            index = data.find(magic)
+            while index >= 0:
+                offsets.add((base + index, magic))
+                index = data.find(magic, index + 1)
+        position += len(chunk)
+        tail = data[-(magic_length - 1):]
+    decompressors = dict(_COMPRESSIONS)
+    for offset, magic in sorted(offsets):
+        try:
+            data = _extract_ikconfig(_decompress(_read_chunks(f, offset), decompressors[magic]()))
+        except _DECOMPRESS_ERRORS:
+            continue
+        if data is not None:
+            return data
+    return None
@@ -0,0 +1,85 @@
+#
+# _pseudo.py - File metadata recorded by pseudo, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sqlite3
+import stat
+
+
+class PseudoDB(object):
+    """Ownership and modes of the files below a rootfs as recorded in the
+    files.db database of pseudo, which fakes root privileges for builds.
+
+    Outside of pseudo, os.lstat() only sees the build user as owner and
+    misses modes that need root, like setuid bits of root owned files.
+    All rows below the rootfs are read with a single query, and entries
+    of a walk are then looked up by path or by device and inode."""
+
+    def __init__(self, db_path, path_to_fs):
+        root = os.path.normpath(os.path.abspath(path_to_fs))
+        # path -> (dev, ino, uid, gid, mode)
+        self.paths = {}
+        # (dev, ino) -> (uid, gid, mode)
+        self.inodes = {}
+        self.found = 0
+        self.missing = 0
+        # sqlite would create an empty database for a wrong path
+        if not os.path.isfile(db_path):
+            raise IOError("No such file: " + db_path)
+        connection = sqlite3.connect(db_path, timeout=60)
+        try:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(files)")]
+            query = ("SELECT path, dev, ino, uid, gid, mode FROM files "
+                     "WHERE (path = ? OR (path >= ? AND path < ?))")
+            if "deleting" in columns:
+                # files that are being removed are still in the database
+                query += " AND deleting = 0"
+            # the range selects the paths below the rootfs, as "0" follows "/"
+            for path, dev, ino, uid, gid, mode in connection.execute(
+                    query, (root, root + "/", root + "0")):
+                self.paths[path] = (dev, ino, uid, gid, mode)
+                self.inodes[(dev, ino)] = (uid, gid, mode)
+        finally:
+            connection.close()
+
+    def get_metadata(self, entry):
+        """Returns (mode, uid, gid) of a walk entry, as recorded by pseudo
+        if it knows the file, or from the lstat data of the entry."""
+        row = self.paths.get(os.path.normpath(os.path.abspath(entry.path)))
+        if row is not None and (row[0], row[1]) == (entry.dev, entry.ino):
+            metadata = row[2:]
+        else:
+            # pseudo follows renames by inode, its path may be outdated
+            metadata = self.inodes.get((entry.dev, entry.ino))
+        # a row for another type of file belongs to an inode that was reused
+        if metadata is None or stat.S_IFMT(metadata[2]) != stat.S_IFMT(entry.mode):
+            self.missing += 1
+            return entry.mode, entry.uid, entry.gid
+        self.found += 1
+        uid, gid, mode = metadata
+        return mode, uid, gid
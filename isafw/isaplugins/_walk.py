@@ -0,0 +1,245 @@
+#
+# _walk.py - Parallel walk of filesystem trees, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import os
+import stat
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # backport for Python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# entry of a walked tree, with the lstat data of the path
+Entry = collections.namedtuple(
+    "Entry", ("path", "mode", "uid", "gid", "size", "mtime", "dev", "ino"))
+
+# directories read ahead of the consumer of a walk at most
+MAX_PENDING_READS = 256
+
+
+def make_entry(path, st):
+    return Entry(path, st.st_mode, st.st_uid, st.st_gid, st.st_size,
+                 st.st_mtime, st.st_dev, st.st_ino)
+
+
+def list_dir(path):
+    """Returns (name, lstat data, is_dir) for the entries of a directory,
+    where is_dir is true for directories and links to them, like in
+    os.walk(). The stat data of scandir() entries is used where the
+    platform provides it."""
+    listing = []
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            listing.append((entry.name, st, is_dir))
+        return listing
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        try:
+            st = os.lstat(entry_path)
+        except OSError:
+            continue
+        is_dir = stat.S_ISDIR(st.st_mode) or (stat.S_ISLNK(st.st_mode) and os.path.isdir(entry_path))
+        listing.append((name, st, is_dir))
+    return listing
+
+
+class _Walker(object):
+    """Reads the directories of a walk, with a pool of threads if more
+    than one worker is wanted. Directories found by the walk are read
+    ahead of its consumer, but at most max_pending of them are read and
+    not yet consumed, so that memory does not grow with the size of the
+    tree when the consumer is slower than the reads."""
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self.pool = None
+        if workers > 1:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(workers)
+        # ordered walks: key of a directory -> result of its read
+        self.results = {}
+        # unordered walks: reads that are done, the directories still to
+        # be read and the number of reads not yet taken from done
+        self.done = queue.Queue()
+        self.todo = collections.deque()
+        self.outstanding = 0
+
+    def prefetch(self, stack):
+        # starts the reads of the directories on top of the stack of an
+        # ordered walk, which are the next ones it needs
+        if self.pool is None:
+            return
+        for dir_entry, key in reversed(stack):
+            if key in self.results or len(self.results) >= self.max_pending:
+                break
+            self.results[key] = self.pool.apply_async(self.read, (dir_entry.path,))
+
+    def get(self, path, key):
+        # listing of a directory of an ordered walk, read now if it was
+        # not prefetched
+        result = self.results.pop(key, None)
+        if result is None:
+            return self.read(path)
+        return result.get()
+
+    def add(self, path, dir_entry, key):
+        # directory to be read by an unordered walk
+        self.todo.append((path, dir_entry, key))
+
+    def get_done(self):
+        # (directory entry, key, listing) of the next finished read of an
+        # unordered walk, or None once all reads are done
+        if self.pool is None:
+            if not self.todo:
+                return None
+            path, dir_entry, key = self.todo.popleft()
+            return dir_entry, key, self.read(path)
+        while self.todo and self.outstanding < self.max_pending:
+            self.outstanding += 1
+            self.pool.apply_async(self.read_done, self.todo.popleft())
+        if not self.outstanding:
+            return None
+        self.outstanding -= 1
+        dir_entry, key, listing = self.done.get()
+        if isinstance(listing, Exception):
+            raise listing
+        return dir_entry, key, listing
+
+    def read_done(self, path, dir_entry, key):
+        try:
+            listing = self.read(path)
+        except Exception as e:
+            listing = e
+        self.done.put((dir_entry, key, listing))
+
+    def read(self, path):
+        # returns the (files, subdirectories) entries of a directory, or
+        # None if it is not readable
+        try:
+            listing = list_dir(path)
+        except OSError:
+            # like os.walk(), unreadable directories are skipped
+            return None
+        files = []
+        subdirs = []
+        for name, st, is_dir in listing:
+            if not is_dir:
+                files.append(make_entry(path + "/" + name, st))
+            elif not stat.S_ISLNK(st.st_mode):
+                # links to directories are neither listed nor followed
+                subdirs.append(make_entry(os.path.join(path, name), st))
+        return files, subdirs
+
+    def close(self, terminate=False):
+        if self.pool is None:
+            return
+        if terminate:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+
+
+def walk(top, workers=0, ordered=True):
+    """Yields the entries of the tree below top as they are found.
+
+    Directories below top and everything else in them are yielded, links
+    to directories are left out. Paths are built as in os.walk(), with
+    files as dirpath + "/" + name. With workers > 1 the directories are
+    read by that many threads at the same time.
+
+    If ordered, the entries come in the order of os.walk(): a directory,
+    then its files, then its subdirectories. Otherwise (key, entry) pairs
+    are yielded as soon as the directories are read, and sorting them by
+    key gives the os.walk() order again."""
+    walker = _Walker(workers, MAX_PENDING_READS)
+    try:
+        if ordered:
+            for entry in _walk_ordered(walker, top):
+                yield entry
+        else:
+            for item in _walk_unordered(walker, top):
+                yield item
+    except:
+        walker.close(terminate=True)
+        raise
+    walker.close()
+
+
+def _walk_ordered(walker, top):
+    # stack of (directory entry, its key), None for the top directory
+    stack = [(None, ())]
+    while stack:
+        dir_entry, key = stack.pop()
+        listing = walker.get(dir_entry.path if dir_entry else top, key)
+        if listing is None:
+            continue
+        files, subdirs = listing
+        for index in reversed(range(len(subdirs))):
+            stack.append((subdirs[index], key + (1, index)))
+        walker.prefetch(stack)
+        if dir_entry is not None:
+            yield dir_entry
+        for entry in files:
+            yield entry
+
+
+def _walk_unordered(walker, top):
+    # a directory is followed by its files (0, index) and comes before
+    # its subdirectories (1, index), so keys sort in the order of the walk
+    walker.add(top, None, ())
+    while True:
+        done = walker.get_done()
+        if done is None:
+            return
+        dir_entry, key, listing = done
+        if listing is None:
+            continue
+        files, subdirs = listing
+        for index, entry in enumerate(subdirs):
+            walker.add(entry.path, entry, key + (1, index))
+        if dir_entry is not None:
+            yield key, dir_entry
+        for index, entry in enumerate(files):
+            yield key + (0, index), entry
@@ -0,0 +1,151 @@
+#
+# _writers.py - Buffered log and report files shared by ISA FW plugins
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import atexit
+import threading
+import time
+
+# buffered log and report files shared by the plugins
+# plugins use ISA_config.writers.open(path, mode) in place of open(path, mode)
+# the returned writer stays open after the with block, so that the file
+# is not reopened for every line written to it
+
+
+def get_writers(ISA_config):
+    """Returns the ISA_writers of the configuration, creating them if a
+    plugin is used without ISA having set them up."""
+    if ISA_config.writers is None:
+        ISA_config.writers = ISA_writers(ISA_config.writer_buffer_size,
+                                         ISA_config.writer_flush_interval)
+    return ISA_config.writers
+
+
+class ISA_writer:
+    def __init__(self, path, mode, buffer_size, flush_interval):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.time()
+        self.file = open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write(self, data):
+        with self.lock:
+            self.buffer.append(data)
+            self.buffered += len(data)
+            if (self.buffered >= self.buffer_size or
+                    time.time() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def flush_if_due(self):
+        # data that waited for flush_interval is written out even if
+        # nothing else is written to the file
+        with self.lock:
+            if self.buffer and time.time() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.buffer and self.file:
+                self.file.write("".join(self.buffer))
+                self.file.flush()
+            self.buffer = []
+            self.buffered = 0
+            self.last_flush = time.time()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class ISA_writers:
+    def __init__(self, buffer_size=65536, flush_interval=5):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.writers = {}
+        self.flusher = None
+        self.stopped = threading.Event()
+        atexit.register(self.close)
+
+    def open(self, path, mode='a'):
+        # mode 'w' truncates the file even if it is already open
+        with self.lock:
+            writer = self.writers.get(path)
+            if writer and mode.startswith('w'):
+                writer.close()
+                writer = None
+            if not writer:
+                writer = ISA_writer(path, mode, self.buffer_size, self.flush_interval)
+                self.writers[path] = writer
+            self._start_flusher()
+            return writer
+
+    def _start_flusher(self):
+        # a daemon thread checks the flush interval of the open writers
+        if self.flush_interval and (self.flusher is None or not self.flusher.is_alive()):
+            self.stopped.clear()
+            self.flusher = threading.Thread(target=self._flush_periodically)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def _flush_periodically(self):
+        while not self.stopped.wait(min(self.flush_interval, 1)):
+            with self.lock:
+                writers = list(self.writers.values())
+            for writer in writers:
+                writer.flush_if_due()
+
+    def flush(self, path=None):
+        with self.lock:
+            writers = list(self.writers.values())
+        for writer in writers:
+            if path is None or writer.path == path:
+                writer.flush()
+
+    def close(self, path=None):
+        with self.lock:
+            if path is None:
+                writers = list(self.writers.values())
+                self.writers = {}
+                self.stopped.set()
+            else:
+                writers = [self.writers.pop(path)] if path in self.writers else []
+        for writer in writers:
+            writer.close()
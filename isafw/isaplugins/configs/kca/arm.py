@@ -22,3 +22,7 @@ integrity_kco_ref = {}
 # Comments
 ############################################################################################
 comments = {'CONFIG_DEFAULT_MMAP_MIN_ADDR': 'Defines the portion of low virtual memory that should be protected from userspace allocation. Keeping a user from writing to low pages can help reduce the impact of kernel NULL pointer bugs.'}
+############################################################################################
+# Rules
+############################################################################################
+rules = {}
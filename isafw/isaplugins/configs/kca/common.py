@@ -240,3 +240,33 @@ comments = {  # Kernel Hardening Configurations
     'CONFIG_DEBUG_FS': 'Enables the kernel debug filesystem. The kernel debug filesystem presents a lot of useful information and means of manipulation of the kernel to an attacker.',
     'CONFIG_MODULE_SIG_FORCE': 'Enables validation of module signature. Disabling this option enables an attacker to load unsigned modules.',
 }
+############################################################################################
+# Rules
+############################################################################################
+# Options without a rule must have their recommended value. A rule gives another "check":
+#   'one_of'    one of the comma separated recommended values
+#   'non_empty' any value that is not empty
+#   'any_of'    the recommended value, or any of the 'options' has the given value
+# and with 'unless' the option is not checked while all of those options have the given value.
+lsm_options = {'CONFIG_SECURITY_SELINUX': 'y',
+               'CONFIG_SECURITY_SMACK': 'y',
+               'CONFIG_SECURITY_APPARMOR': 'y',
+               'CONFIG_SECURITY_TOMOYO': 'y'}
+ima_hash_options = {'CONFIG_IMA_DEFAULT_HASH_SHA256': 'y',
+                    'CONFIG_IMA_DEFAULT_HASH_SHA512': 'y'}
+rules = {  # Kernel Hardening Configurations
+    'CONFIG_CMDLINE': {'check': 'non_empty'},
+    'CONFIG_DEBUG_STRICT_USER_COPY_CHECKS': {'check': 'exact',
+                                             'unless': {'CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS': 'y'}},
+    # Security Kernel Configuration
+    'CONFIG_DEFAULT_SECURITY': {'check': 'one_of'},
+    'CONFIG_SECURITY_SELINUX': {'check': 'any_of', 'options': lsm_options},
+    'CONFIG_SECURITY_SMACK': {'check': 'any_of', 'options': lsm_options},
+    'CONFIG_SECURITY_APPARMOR': {'check': 'any_of', 'options': lsm_options},
+    'CONFIG_SECURITY_TOMOYO': {'check': 'any_of', 'options': lsm_options},
+    # Integrity Kernel Configuration
+    'CONFIG_IMA_DEFAULT_HASH_SHA1': {'check': 'any_of', 'options': ima_hash_options},
+    'CONFIG_IMA_DEFAULT_HASH_SHA256': {'check': 'any_of', 'options': ima_hash_options},
+    'CONFIG_IMA_DEFAULT_HASH_SHA512': {'check': 'any_of', 'options': ima_hash_options},
+    'CONFIG_IMA_DEFAULT_HASH_WP512': {'check': 'any_of', 'options': ima_hash_options},
+}
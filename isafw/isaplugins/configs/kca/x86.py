@@ -36,3 +36,7 @@ comments = {'CONFIG_DEFAULT_MMAP_MIN_ADDR': 'Defines the portion of low virtual
             'CONFIG_X86_INTEL_MPX': 'Enables MPX hardware features that can be used with compiler-instrumented code to check memory references. It is designed to detect buffer overflow or underflow bugs.',
             'CONFIG_X86_MSR': 'Enables privileged processes access to the x86 Model-Specific Registers (MSRs). MSR accesses are directed to a specific CPU on multi-processor systems. This alone does not provide security.'
             }
+############################################################################################
+# Rules
+############################################################################################
+rules = {'CONFIG_RANDOMIZE_BASE_MAX_OFFSET': {'check': 'one_of'}}
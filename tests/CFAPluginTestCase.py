@@ -34,7 +34,13 @@ import shutil
 import os
 import filecmp
 import tarfile
+import io
+import struct
+import time
 from datetime import datetime
+from isaplugins import ISA_cfa_plugin
+from isaplugins import _cache
+from isaplugins import _elf
 
 fsroot_tar = "./cfa_plugin/data/rootfs.tar.gz"
 fsroot_path = "./cfa_plugin/data/rootfs"
@@ -42,6 +48,89 @@ ref_cfa_full_output = "./cfa_plugin/data/ref_cfa_full_report_TestImage"
 ref_cfa_problems_output = "./cfa_plugin/data/ref_cfa_problems_report_TestImage"
 isafw_conf = isafw.ISA_config()
 isafw_conf.reportdir = "./cfa_plugin/output"
+helpers_path = "./cfa_plugin/helpers"
+
+PF_RW = 0x6
+PF_RWX = 0x7
+
+
+def make_elf(e_type=_elf.ET_DYN, machine=_elf.EM_X86_64, stack=PF_RW, relro=False,
+             interp=False, dynamic=None, imports=(), symbols=(), code=b"\xc3"):
+    # Builds a small 64-bit little endian ELF file with the structures read
+    # by the CFA checks. stack is the flags of PT_GNU_STACK, None to leave
+    # the segment out, imports are (name, version) pairs of undefined
+    # symbols and symbols are names of symbols defined in .text.
+    dynstr = [b"\0"]
+
+    def add_string(name):
+        dynstr.append(name.encode("ascii") + b"\0")
+        return len(b"".join(dynstr[:-1]))
+    versions = []
+    for name, version in imports:
+        if version and version not in versions:
+            versions.append(version)
+    verneed = b""
+    if versions:
+        verneed = struct.pack("<HHIII", 1, len(versions), add_string("libc.so.6"), 16, 0)
+        for i, version in enumerate(versions):
+            verneed += struct.pack("<IHHII", 0, 0, i + 2, add_string(version),
+                                   16 if i + 1 < len(versions) else 0)
+    dynsym = b"\0" * 24
+    versym = struct.pack("<H", 0)
+    for name, version in imports:
+        dynsym += struct.pack("<IBBHQQ", add_string(name), 0x12, 0, 0, 0, 0)
+        versym += struct.pack("<H", versions.index(version) + 2 if version else 1)
+    for name in symbols:
+        dynsym += struct.pack("<IBBHQQ", add_string(name), 0x12, 0, 1, 0, 0)
+        versym += struct.pack("<H", 1)
+    dynamic_data = b"".join(struct.pack("<qQ", tag, value) for tag, value in
+                            sorted((dynamic or {}).items())) + struct.pack("<qQ", 0, 0)
+    interp_data = b"/lib64/ld-linux-x86-64.so.2\0"
+    # (type, flags, link, data) of the sections after the null section
+    sections = [(1, 0x6, 0, code),
+                (_elf.SHT_STRTAB, 0x2, 0, b"".join(dynstr)),
+                (_elf.SHT_DYNSYM, 0x2, 2, dynsym),
+                (_elf.SHT_GNU_versym, 0x2, 3, versym),
+                (_elf.SHT_GNU_verneed, 0x2, 2, verneed),
+                (_elf.SHT_DYNAMIC, 0x3, 2, dynamic_data),
+                (1, 0x2, 0, interp_data)]
+    num_segments = 2 + bool(interp) + bool(relro) + (stack is not None)
+    offset = 64 + 56 * num_segments
+    body = b""
+    offsets = []
+    for sh_type, sh_flags, sh_link, data in sections:
+        offsets.append(offset + len(body))
+        body += data + b"\0" * (-len(data) % 8)
+    shoff = offset + len(body)
+    dynamic_segment = (offsets[5], len(dynamic_data))
+    segments = [(_elf.PT_LOAD, 0x5, 0, shoff + 64 * (len(sections) + 1)),
+                (_elf.PT_DYNAMIC, PF_RW) + dynamic_segment]
+    if interp:
+        segments.append((_elf.PT_INTERP, 0x4, offsets[6], len(interp_data)))
+    if relro:
+        segments.append((_elf.PT_GNU_RELRO, 0x4) + dynamic_segment)
+    if stack is not None:
+        segments.append((_elf.PT_GNU_STACK, stack, 0, 0))
+    header = _elf.ELFMAG + struct.pack("<BBBxxxxxxxxx", 2, 1, 1)
+    header += struct.pack("<HHIQQQIHHHHHH", e_type, machine, 1, 0, 64, shoff, 0,
+                          64, 56, len(segments), 64, len(sections) + 1, 0)
+    program_headers = b"".join(struct.pack("<IIQQQQQQ", p_type, p_flags, p_offset, p_offset,
+                                           p_offset, p_filesz, p_filesz, 8)
+                               for p_type, p_flags, p_offset, p_filesz in segments)
+    section_headers = b"\0" * 64
+    for (sh_type, sh_flags, sh_link, data), sh_offset in zip(sections, offsets):
+        entsize = 24 if sh_type == _elf.SHT_DYNSYM else 0
+        section_headers += struct.pack("<IIQQQQIIQQ", 0, sh_type, sh_flags, sh_offset,
+                                       sh_offset, len(data), sh_link, 0, 8, entsize)
+    return header + program_headers + body + section_headers
+
+
+def write_file(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(data)
+
 
 class TestCFAPlugin(unittest.TestCase):
 
@@ -97,5 +186,342 @@ class TestCFAPlugin(unittest.TestCase):
         self.assertTrue(filecmp.cmp(isafw_conf.reportdir + '/sortedCFAPbms',isafw_conf.reportdir + '/sortedRefCFAPbms'),
                         'Output does not match')
 
+    def test_cfa_problems_report_without_mpx(self):
+        # disabled checks are not run and their sections are left out
+        report = isafw_conf.reportdir + "/cfa_problems_report_" + isafw_conf.machine + "_" + isafw_conf.timestamp
+        checks = isafw_conf.cfa_checks
+        isafw_conf.cfa_checks = ["checksec", "execstack", "nodrop_groups"]
+        try:
+            imageSecurityAnalyser = isafw.ISA(isafw_conf)
+            fs = isafw.ISA_filesystem()
+            fs.img_name = "TestImageNoMPX"
+            fs.path_to_fs = fsroot_path
+            imageSecurityAnalyser.process_filesystem(fs)
+        finally:
+            isafw_conf.cfa_checks = checks
+        with open(report + "_TestImage", "r") as f:
+            content = f.read()
+        with open(report + "_TestImageNoMPX", "r") as f:
+            self.assertEqual(content[:content.index("\n\nMemory Protection Extensions")],
+                             f.read().replace("TestImageNoMPX", "TestImage"),
+                             'Output does not match')
+
+
+class TestCFAHelpers(unittest.TestCase):
+    # tests of the CFA building blocks on small generated ELF files,
+    # which do not need the rootfs of TestCFAPlugin
+
+    def setUp(self):
+        if os.path.exists(helpers_path):
+            shutil.rmtree(helpers_path)
+        self.rootfs = helpers_path + "/rootfs"
+        self.timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        write_file(self.rootfs + "/bin/tool",
+                   make_elf(_elf.ET_EXEC, relro=True,
+                            imports=[("setuid", "GLIBC_2.2.5"), ("setgid", "GLIBC_2.2.5")]))
+        os.link(self.rootfs + "/bin/tool", self.rootfs + "/bin/tool2")
+        os.symlink("tool", self.rootfs + "/bin/tool3")
+        write_file(self.rootfs + "/lib/libx.so.1",
+                   make_elf(_elf.ET_DYN, relro=True, dynamic={_elf.DT_BIND_NOW: 0},
+                            imports=[("__stack_chk_fail", "GLIBC_2.4")], symbols=["x_init"]))
+        write_file(self.rootfs + "/lib/mod.o", make_elf(_elf.ET_REL, stack=PF_RWX))
+        write_file(self.rootfs + "/etc/conf", b"\x7fELF is not enough\n")
+
+    def tearDown(self):
+        shutil.rmtree(helpers_path)
+
+    def getConfig(self, **settings):
+        conf = isafw.ISA_config()
+        conf.reportdir = helpers_path
+        conf.logdir = helpers_path
+        conf.timestamp = self.timestamp
+        conf.machine = "TestCaseMachine"
+        conf.full_reports = True
+        conf.plugin_whitelist = "ISA_CFChecker"
+        conf.cfa_checks = ["checksec", "execstack", "nodrop_groups"]
+        conf.cfa_workers = 2
+        for name, value in settings.items():
+            setattr(conf, name, value)
+        return conf
+
+    def analyze(self, img_name, path=None, baseline=None, shard=None, **settings):
+        conf = self.getConfig(**settings)
+        fs = isafw.ISA_filesystem()
+        fs.img_name = img_name
+        fs.path_to_fs = path or self.rootfs
+        imageSecurityAnalyser = isafw.ISA(conf)
+        imageSecurityAnalyser.process_filesystem(fs, baseline, shard)
+        return fs
+
+    def readReport(self, report, img_name):
+        name = "/" + report + "_TestCaseMachine_" + self.timestamp
+        if img_name:
+            name += "_" + img_name
+        with open(helpers_path + name, "r") as f:
+            return f.read()
+
+    def readEntries(self, img_name):
+        # full report entries by file
+        entries = {}
+        for entry in self.readReport("cfa_full_report", img_name).split("\nFile: ")[1:]:
+            path, sep, details = entry.partition("\n")
+            entries[path] = details
+        return entries
+
+    def test_cfa_elf_type_detection(self):
+        self.assertEqual(_elf.read_elf_type(self.rootfs + "/bin/tool"), _elf.ET_EXEC)
+        self.assertEqual(_elf.read_elf_type(self.rootfs + "/lib/libx.so.1"), _elf.ET_DYN)
+        self.assertEqual(_elf.read_elf_type(self.rootfs + "/lib/mod.o"), _elf.ET_REL)
+        self.assertEqual(_elf.read_elf_type(self.rootfs + "/etc/conf"), None)
+        self.assertEqual(_elf.read_elf_type(self.rootfs + "/missing"), None)
+        self.assertEqual(_elf.parse_elf_type(_elf.ELFMAG + b"\x02\x01"), None)
+        # only executables and shared objects are analyzed
+        results = ISA_cfa_plugin.process_files(
+            [self.rootfs + name for name in ("/bin/tool", "/bin/tool3", "/lib/libx.so.1",
+                                             "/lib/mod.o", "/etc/conf")])
+        self.assertEqual([result.has_flag(ISA_cfa_plugin.ANALYZED) for result in results],
+                         [True, True, True, False, False])
+        self.assertEqual(results[3].security_flags, ())
+
+    def test_cfa_elf_checksec(self):
+        def checksec(data):
+            return _elf.checksec(_elf.ELFFile(io.BytesIO(data)))
+        self.assertEqual(checksec(make_elf(_elf.ET_EXEC)),
+                         ["No RELRO", "No canary found", "NX enabled", "No PIE", "No RPATH", "No RUNPATH"])
+        self.assertEqual(checksec(make_elf(_elf.ET_DYN, relro=True, interp=True,
+                                           imports=[("__stack_chk_fail", "GLIBC_2.4")])),
+                         ["Partial RELRO", "Canary found", "NX enabled", "PIE enabled", "No RPATH", "No RUNPATH"])
+        self.assertEqual(checksec(make_elf(_elf.ET_DYN, relro=True, stack=PF_RWX,
+                                           dynamic={_elf.DT_FLAGS_1: _elf.DF_1_NOW,
+                                                    _elf.DT_RPATH: 1, _elf.DT_RUNPATH: 1})),
+                         ["Full RELRO", "No canary found", "NX disabled", "DSO", "RPATH", "RUNPATH"])
+        self.assertEqual(checksec(make_elf(_elf.ET_DYN, dynamic={_elf.DT_FLAGS: _elf.DF_BIND_NOW,
+                                                                 _elf.DT_FLAGS_1: _elf.DF_1_PIE}))[:4],
+                         ["No RELRO", "No canary found", "NX enabled", "PIE enabled"])
+        # like checksec.sh 1.x, only a RWE stack segment is NX disabled; a
+        # missing one is left to the execstack check
+        self.assertEqual(checksec(make_elf(_elf.ET_EXEC, stack=None))[2], "NX enabled")
+        self.assertEqual(checksec(make_elf(_elf.ET_EXEC, stack=0x5))[2], "NX enabled")
+        with self.assertRaises(_elf.ELFError):
+            checksec(make_elf()[:100])
+        with self.assertRaises(_elf.ELFError):
+            checksec(b"#!/bin/sh\n")
+
+    def test_cfa_elf_execstack(self):
+        def execstack(data):
+            return _elf.execstack(_elf.ELFFile(io.BytesIO(data)))
+        self.assertEqual(execstack(make_elf(stack=PF_RW)), "")
+        self.assertEqual(execstack(make_elf(stack=PF_RWX)), "execstack")
+        self.assertEqual(execstack(make_elf(stack=None)), "not_defined")
+
+    def test_cfa_elf_imports(self):
+        elf = _elf.ELFFile(io.BytesIO(make_elf(
+            imports=[("setuid", "GLIBC_2.2.5"), ("setgid", "GLIBC_2.2.5"),
+                     ("initgroups", "GLIBC_2.2.5"), ("__stack_chk_fail", "GLIBC_2.4"),
+                     ("plain", None)],
+            symbols=["setgroups"])))
+        self.assertEqual(elf.imports, {"setuid": "GLIBC_2.2.5", "setgid": "GLIBC_2.2.5",
+                                       "initgroups": "GLIBC_2.2.5", "__stack_chk_fail": "GLIBC_2.4",
+                                       "plain": None})
+        self.assertTrue("setgroups" in elf.symbols)
+        self.assertFalse(ISA_cfa_plugin.is_nodrop_groups(elf.imports))
+        self.assertTrue(ISA_cfa_plugin.is_nodrop_groups(
+            {"setresuid": "GLIBC_2.2.5", "setegid": "GLIBC_2.2.5"}))
+        # a definition of the program or an unversioned import is not glibc's
+        self.assertFalse(ISA_cfa_plugin.is_nodrop_groups({"setuid": "GLIBC_2.2.5", "setgid": None}))
+        self.assertFalse(ISA_cfa_plugin.is_nodrop_groups({"setuid": "GLIBC_2.2.5"}))
+
+    def test_cfa_mpx_scan(self):
+        def may_have_mpx(code, machine=_elf.EM_X86_64):
+            elf = _elf.ELFFile(io.BytesIO(make_elf(machine=machine, code=code)))
+            return _elf.may_have_mpx_instructions(elf)
+        nops = b"\x90" * 64
+        # bndmov [rsp], bnd0 / bndcl bnd1, [rax] / bndcu bnd0, [rax]
+        self.assertTrue(may_have_mpx(nops + b"\x66\x0f\x1b\x04\x24" + nops))
+        self.assertTrue(may_have_mpx(b"\xf3\x0f\x1a\x08\xc3"))
+        self.assertTrue(may_have_mpx(b"\xf2\x0f\x1a\x00\xc3"))
+        # same opcode without the mandatory prefix, or not a bnd register
+        self.assertFalse(may_have_mpx(nops + b"\x0f\x1a\x00\xc3"))
+        self.assertFalse(may_have_mpx(b"\x66\x0f\x1b\x24\x24"))
+        self.assertFalse(may_have_mpx(nops))
+        self.assertFalse(may_have_mpx(b"\x66\x0f\x1b\x04\x24", machine=40))
+
+    def test_cfa_result_cache(self):
+        cache = _cache.ResultCache(helpers_path + "/cache.sqlite", "1")
+        cache.put([("a", [["No RELRO"], "", False, True]), ("b", "Not able to fetch flags")])
+        self.assertEqual(cache.get("a"), [["No RELRO"], "", False, True])
+        self.assertEqual(_cache.ResultCache(helpers_path + "/cache.sqlite", "2").get("a"), None)
+        time.sleep(0.01)
+        cache.touch(["a"])
+        cache.evict(max_entries=1)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), [["No RELRO"], "", False, True])
+        cache.close()
+        self.assertEqual(_cache.file_digest(self.rootfs + "/etc/conf"),
+                         _cache.data_digest(b"\x7fELF is not enough\n"))
+        # a second scan takes the results from the cache
+        for img_name, log_line in (("Cold", "Result cache: 0 hits, 2 new entries"),
+                                   ("Warm", "Result cache: 2 hits, 0 new entries")):
+            self.analyze(img_name, cfa_cache_dir=helpers_path + "/cache")
+            with open(helpers_path + "/isafw_cfalog", "r") as f:
+                self.assertTrue(log_line in f.read())
+        self.assertEqual(self.readEntries("Cold"), self.readEntries("Warm"))
+
+    def test_cfa_cache_version_follows_tools(self):
+        # results of other versions of the tools are not reused
+        tool = helpers_path + "/tools/objdump"
+        write_file(tool, b"#!/bin/sh\necho 'GNU objdump 2.26'\n")
+        os.chmod(tool, 0o755)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = os.path.dirname(tool) + os.pathsep + path
+        try:
+            self.assertEqual(ISA_cfa_plugin.get_tool_versions({"objdump": ""}),
+                             ["objdump: GNU objdump 2.26"])
+            conf = self.getConfig(cfa_checks=["checksec", "mpx"])
+            checker = ISA_cfa_plugin.ISA_CFChecker(conf)
+            checker.update_cache_version()
+            old_version = checker.cache_version
+            write_file(tool, b"#!/bin/sh\necho 'GNU objdump 2.30'\n")
+            checker.update_cache_version()
+            self.assertNotEqual(checker.cache_version, old_version)
+            self.assertEqual(checker.process_options["cache_version"], checker.cache_version)
+            self.assertTrue(checker.cache_version.startswith(checker.base_cache_version + "-tools-"))
+            conf.writers.close()
+        finally:
+            os.environ["PATH"] = path
+        # the built-in checks without mpx run no tools
+        self.assertEqual(ISA_cfa_plugin.get_tools(checks=("checksec", "execstack")), {})
+
+    def test_cfa_same_file_analyzed_once(self):
+        self.analyze("TestImage")
+        entries = self.readEntries("TestImage")
+        self.assertEqual(sorted(entries), ["/bin/tool", "/bin/tool2", "/bin/tool3", "/etc/conf",
+                                           "/lib/libx.so.1", "/lib/mod.o"])
+        self.assertEqual(entries["/bin/tool"],
+                         "security flags: ['Partial RELRO', 'No canary found', 'NX enabled', "
+                         "'No PIE', 'No RPATH', 'No RUNPATH']\nexecstack: \nnodrop_groups: True\n")
+        self.assertEqual(entries["/bin/tool2"], entries["/bin/tool"])
+        self.assertEqual(entries["/bin/tool3"], entries["/bin/tool"])
+        self.assertEqual(entries["/lib/mod.o"], "security flags: []\nexecstack: \nnodrop_groups: False\n")
+        with open(helpers_path + "/isafw_cfalog", "r") as f:
+            log = f.read()
+        self.assertTrue("6 files found, 4 unique files to analyze" in log)
+        self.assertEqual(log.count("Same file as "), 2)
+        problems = self.readReport("cfa_problems_report", "TestImage")
+        self.assertEqual(sorted(problems.split("setuid/setgid:\n")[1].split()),
+                         ["/bin/tool", "/bin/tool2", "/bin/tool3"])
+
+    def test_cfa_archive_source(self):
+        # a tarball of the rootfs gives the same reports as the directory
+        self.analyze("TestImage")
+        expected = self.readReport("cfa_problems_report", "TestImage")
+        tar = tarfile.open(helpers_path + "/rootfs.tar.gz", "w:gz")
+        tar.add(self.rootfs, "")
+        tar.close()
+        self.analyze("TestImage", helpers_path + "/rootfs.tar.gz")
+        # members are in archive order
+        self.assertEqual(sorted(self.readReport("cfa_problems_report", "TestImage").replace(
+            helpers_path + "/rootfs.tar.gz", self.rootfs).splitlines()), sorted(expected.splitlines()))
+
+    def test_cfa_sharded_scan(self):
+        # paths are assigned to the same shard as bytes and as text
+        from isaplugins import _findings
+        for path in (u"/bin/tool", u"/lib/caf\xe9.so"):
+            self.assertEqual([_findings.in_shard(path, index, 3) for index in range(3)],
+                             [_findings.in_shard(path.encode("utf-8"), index, 3) for index in range(3)])
+            self.assertEqual([_findings.in_shard(path, index, 3) for index in range(3)].count(True), 1)
+        # a scan split into shards gives the same reports as one scan
+        self.analyze("TestImage")
+        expected = self.readReport("cfa_problems_report", "TestImage")
+        for index in range(3):
+            self.analyze("TestImage", shard=(index, 3))
+        partial_reports = [helpers_path + "/cfa_partial_report_TestCaseMachine_" + self.timestamp +
+                           "_TestImage_shard_%d_of_3.json" % index for index in range(3)]
+        conf = self.getConfig()
+        fs = isafw.ISA_filesystem()
+        fs.img_name = "TestImage"
+        fs.path_to_fs = self.rootfs
+        isafw.ISA(conf).merge_filesystem_shards(fs, partial_reports)
+        self.assertEqual(self.readReport("cfa_problems_report", "TestImage"), expected)
+
+    def test_cfa_differential_scan_with_other_checks(self):
+        # results of a baseline with other checks are not carried forward
+        self.analyze("Baseline", manifests=True, cfa_checks=["checksec", "execstack"])
+        baseline = helpers_path + "/isafw_manifest_TestCaseMachine_" + self.timestamp + "_Baseline"
+        for img_name, checks in (("Rescan", ["checksec", "execstack", "nodrop_groups"]),
+                                 ("Unchanged", ["checksec", "execstack"])):
+            self.analyze(img_name, baseline=baseline, cfa_checks=checks)
+            with open(helpers_path + "/isafw_cfalog", "r") as f:
+                log = f.read()
+            self.assertEqual("Baseline has no results of the same checks" in log, img_name == "Rescan")
+        problems = self.readReport("cfa_problems_report", "Rescan")
+        self.assertEqual(sorted(problems.split("setuid/setgid:\n")[1].split()),
+                         ["/bin/tool", "/bin/tool2", "/bin/tool3"])
+        self.assertEqual(self.readEntries("Unchanged"), self.readEntries("Baseline"))
+
+    def test_cfa_run_tool_limits(self):
+        failures = []
+        start = time.time()
+        # the tool and the programs it started are stopped at the timeout
+        self.assertEqual(ISA_cfa_plugin.run_tool(["sh", "-c", "sleep 30 & sleep 30"],
+                                                 {"timeout": 1}, failures), None)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(ISA_cfa_plugin.run_tool(["sh", "-c", "yes"],
+                                                 {"timeouts": {"sh": 10}, "max_output": 4096},
+                                                 failures), None)
+        self.assertEqual(failures, ["sh: timeout", "sh: output limit"])
+        self.assertEqual(ISA_cfa_plugin.run_tool(["sh", "-c", "echo a; echo bndcu; sleep 30"],
+                                                 {"timeout": 20}, stop_at=ISA_cfa_plugin.is_mpx_line),
+                         b"bndcu\n")
+        self.assertTrue(time.time() - start < 15)
+        self.assertEqual(ISA_cfa_plugin.run_tool(["sh", "-c", "echo a; exit 1"]), None)
+        self.assertEqual(ISA_cfa_plugin.run_tool(["sh", "-c", "echo a; exit 1"], check=False), b"a\n")
+        self.assertEqual(ISA_cfa_plugin.run_tool(["/nonexistent/tool"]), None)
+
+    def test_cfa_tool_batches(self):
+        conf = self.getConfig(cfa_use_file_tool=True, cfa_tool_batch_size=2)
+        checker = ISA_cfa_plugin.ISA_CFChecker(conf)
+        self.assertEqual(checker.make_batches(["a", "b", "c", "d", "e"]), [["a", "b"], ["c", "d"], ["e"]])
+        long_name = "x" * (ISA_cfa_plugin.MAX_BATCH_ARGS_LENGTH - 1)
+        self.assertEqual(checker.make_batches(["a", long_name]), [["a"], [long_name]])
+        conf.writers.close()
+        self.assertEqual(ISA_cfa_plugin.split_file_output("/a\0: application/x-executable\n/b c\0: text/plain\n"),
+                         {"/a": "/a\0: application/x-executable", "/b c": "/b c\0: text/plain"})
+        self.assertEqual(ISA_cfa_plugin.split_execstack_output("X /a\n- /b c\n? /d\n"),
+                         {"/a": "X /a", "/b c": "- /b c", "/d": "? /d"})
+        self.assertEqual(ISA_cfa_plugin.split_readelf_output("\nFile: /a\nsetuid@GLIBC\nFile: /b\nputs\n"),
+                         {"/a": "setuid@GLIBC\n", "/b": "puts\n"})
+        # the batch output is split per file, with the same results as one run per file
+        files = [self.rootfs + name for name in ("/bin/tool", "/lib/libx.so.1", "/lib/mod.o", "/etc/conf")]
+        batch = ISA_cfa_plugin.process_files(files, use_file_tool=True, checks=("checksec",))
+        single = [ISA_cfa_plugin.process_file(f, use_file_tool=True, checks=("checksec",)) for f in files]
+        self.assertEqual([result.log for result in batch], [result.log for result in single])
+
+    def test_cfa_tool_batch_limits(self):
+        # the per file limits of a batch add up to the absolute batch limits
+        self.assertEqual(ISA_cfa_plugin.scale_tool_limits(
+            {"timeout": 600, "timeouts": {"file": 10}, "max_output": 100,
+             "batch_timeout": 60, "batch_max_output": 1000}, 64),
+            {"timeout": 60, "timeouts": {"file": 60}, "max_output": 1000})
+        self.assertEqual(ISA_cfa_plugin.scale_tool_limits({"timeout": 2, "max_output": 0,
+                                                           "batch_timeout": 60}, 4),
+                         {"timeout": 8, "timeouts": {}, "max_output": 0})
+        # a batch that timed out is split until the hanging file runs alone
+        # with the per file limits, after which it is not run again
+        runs = helpers_path + "/runs"
+        script = ('echo "$@" >> %s; for f; do if [ "$f" = hang ]; then sleep 30; fi; '
+                  'echo "- $f"; done' % runs)
+        names = ["a", "b", "hang", "c"]
+        targets = [(ISA_cfa_plugin.FileResult(name), name) for name in names]
+        start = time.time()
+        outputs = ISA_cfa_plugin.run_tool_batch(["sh", "-c", script, "sh"], targets,
+                                                {"timeout": 2, "batch_timeout": 1},
+                                                ISA_cfa_plugin.split_execstack_output)
+        self.assertTrue(time.time() - start < 15)
+        self.assertEqual(outputs, ["- a", "- b", "", "- c\n"])
+        self.assertEqual([result.failures for result, name in targets], [[], [], ["sh: timeout"], []])
+        with open(runs, "r") as f:
+            self.assertEqual(f.read().splitlines(), ["a b hang c", "a b", "hang c", "hang", "c"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -35,6 +35,7 @@ import os
 import filecmp
 import tarfile
 import stat
+import time
 from datetime import datetime
 
 fsroot_path = "./fsa_plugin/data/rootfs"
@@ -96,6 +97,220 @@ class TestFSAPlugin(unittest.TestCase):
         self.assertTrue(filecmp.cmp(isafw_conf.reportdir + '/sortedFSAPbms',isafw_conf.reportdir + '/sortedRefFSAPbms'),
                         'Output does not match')
 
+    def test_fsa_archive_problems_report(self):
+        # the prepared rootfs is analyzed again as an archive, without extracting it
+        archive_path = isafw_conf.reportdir + "/rootfs.tar.gz"
+        ar = tarfile.open(archive_path, "w:gz")
+        ar.add(fsroot_path, arcname=".")
+        ar.close()
+        imageSecurityAnalyser = isafw.ISA(isafw_conf)
+        fs = isafw.ISA_filesystem()
+        fs.img_name = "TestArchiveImage"
+        fs.path_to_fs = archive_path
+        imageSecurityAnalyser.process_filesystem(fs)
+        report = isafw_conf.reportdir + "/fsa_problems_report_" + isafw_conf.machine + "_" + isafw_conf.timestamp
+        with open(report + "_TestArchiveImage", "r") as f:
+            content = f.read()
+        with open(report + "_TestArchiveImageDir", "w") as f:
+            f.write(content.replace("TestArchiveImage", "TestImage").replace(archive_path, fsroot_path))
+        self.sortFile(report + "_TestArchiveImageDir",'sortedFSAArchivePbms')
+        self.sortFile(ref_fsa_problems_output,'sortedRefFSAPbms')
+        self.assertTrue(filecmp.cmp(isafw_conf.reportdir + '/sortedFSAArchivePbms',isafw_conf.reportdir + '/sortedRefFSAPbms'),
+                        'Output does not match')
+
+    def test_fsa_archive_source_shared(self):
+        # threads opening the same archive share one source, which reads
+        # the metadata of the members in a single pass
+        from isaplugins import _fssource
+        import threading
+        archive_path = isafw_conf.reportdir + "/rootfs.tar"
+        ar = tarfile.open(archive_path, "w")
+        ar.add(fsroot_path, arcname=".")
+        ar.close()
+        sources = []
+        passes = []
+        iter_members = _fssource.TarSource.iter_members
+
+        def counted_iter_members(source):
+            passes.append(source)
+            time.sleep(0.1)
+            return iter_members(source)
+
+        def read_entries():
+            source = _fssource.open_source(archive_path)
+            sources.append(source)
+            source.get_entries()
+        _fssource.TarSource.iter_members = counted_iter_members
+        try:
+            threads = [threading.Thread(target=read_entries) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            _fssource.TarSource.iter_members = iter_members
+        self.assertEqual(len(sources), 4)
+        self.assertTrue(all(source is sources[0] for source in sources))
+        self.assertEqual(len(passes), 1)
+        self.assertTrue(sources[0].get_entry("/file5") is not None)
+
+    def test_fsa_sharded_problems_report(self):
+        # merging the results of the shards gives the report of the unsharded scan
+        report = isafw_conf.reportdir + "/fsa_problems_report_" + isafw_conf.machine + "_" + isafw_conf.timestamp + "_TestImage"
+        shutil.copy(report, isafw_conf.reportdir + "/unshardedFSAPbms")
+        partial_reports = []
+        for shard_index in range(3):
+            imageSecurityAnalyser = isafw.ISA(isafw_conf)
+            fs = isafw.ISA_filesystem()
+            fs.img_name = "TestImage"
+            fs.path_to_fs = fsroot_path
+            imageSecurityAnalyser.process_filesystem(fs, shard=(shard_index, 3))
+            partial_reports.append(isafw_conf.reportdir + "/fsa_partial_report_" + isafw_conf.machine + "_" +
+                                   isafw_conf.timestamp + "_TestImage_shard_" + str(shard_index) + "_of_3.json")
+        imageSecurityAnalyser = isafw.ISA(isafw_conf)
+        fs = isafw.ISA_filesystem()
+        fs.img_name = "TestImage"
+        fs.path_to_fs = fsroot_path
+        imageSecurityAnalyser.merge_filesystem_shards(fs, partial_reports)
+        self.assertTrue(filecmp.cmp(report, isafw_conf.reportdir + "/unshardedFSAPbms", shallow=False),
+                        'Output does not match')
+
+    def test_fsa_multiple_images_problems_report(self):
+        # images analyzed together get the same reports as when analyzed alone
+        report = isafw_conf.reportdir + "/fsa_problems_report_" + isafw_conf.machine + "_" + isafw_conf.timestamp
+        imageSecurityAnalyser = isafw.ISA(isafw_conf)
+        filesystems = []
+        for img_name in ("TestImage1", "TestImage2"):
+            fs = isafw.ISA_filesystem()
+            fs.img_name = img_name
+            fs.path_to_fs = fsroot_path
+            filesystems.append(fs)
+        imageSecurityAnalyser.process_filesystems(filesystems)
+        for img_name in ("TestImage1", "TestImage2"):
+            with open(report + "_" + img_name, "r") as f:
+                content = f.read()
+            with open(report + "_TestImage", "r") as f:
+                self.assertEqual(content.replace(img_name, "TestImage"), f.read(),
+                                 'Output does not match')
+
+    def test_fsa_differential_problems_report(self):
+        # a scan against the manifest of an earlier scan only classifies
+        # the changed file and writes the same report as a full scan
+        report = isafw_conf.reportdir + "/fsa_problems_report_" + isafw_conf.machine + "_" + isafw_conf.timestamp
+        manifest = isafw_conf.reportdir + "/isafw_manifest_" + isafw_conf.machine + "_" + isafw_conf.timestamp
+        isafw_conf.manifests = True
+        try:
+            for img_name, baseline in (("TestBaseImage", None),
+                                       ("TestDiffImage", manifest + "_TestBaseImage")):
+                if baseline:
+                    os.chmod(fsroot_path + "/file5", stat.S_ISUID | 0755)
+                imageSecurityAnalyser = isafw.ISA(isafw_conf)
+                fs = isafw.ISA_filesystem()
+                fs.img_name = img_name
+                fs.path_to_fs = fsroot_path
+                imageSecurityAnalyser.process_filesystem(fs, baseline)
+        finally:
+            isafw_conf.manifests = False
+        with open(isafw_conf.logdir + "/isafw_fsalog", "r") as f:
+            self.assertTrue("Classified the modes of 1 files," in f.read())
+        imageSecurityAnalyser = isafw.ISA(isafw_conf)
+        fs = isafw.ISA_filesystem()
+        fs.img_name = "TestFullImage"
+        fs.path_to_fs = fsroot_path
+        imageSecurityAnalyser.process_filesystem(fs)
+        with open(report + "_TestDiffImage", "r") as f:
+            content = f.read()
+        with open(report + "_TestFullImage", "r") as f:
+            self.assertEqual(content.replace("TestDiffImage", "TestFullImage"), f.read(),
+                             'Output does not match')
+        setuid_files = content.split("Files with SETUID bit set:\n")[1].split("\n\n")[0].split("\n")
+        self.assertTrue("/file5" in setuid_files, 'Output does not match')
+
+    def test_fsa_pseudo_db_problems_report(self):
+        # modes recorded by pseudo are used instead of the ones on disk
+        import sqlite3
+        db_path = isafw_conf.reportdir + "/files.db"
+        connection = sqlite3.connect(db_path)
+        connection.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, path VARCHAR, dev INTEGER, "
+                           "ino INTEGER, uid INTEGER, gid INTEGER, mode INTEGER, rdev INTEGER, "
+                           "deleting INTEGER)")
+        st = os.lstat(fsroot_path + "/file5")
+        connection.execute("INSERT INTO files (path, dev, ino, uid, gid, mode, rdev, deleting) "
+                           "VALUES (?, ?, ?, 0, 0, ?, 0, 0)",
+                           (os.path.abspath(fsroot_path + "/file5"), st.st_dev, st.st_ino,
+                            stat.S_IFREG | stat.S_ISUID | 0755))
+        connection.commit()
+        connection.close()
+        imageSecurityAnalyser = isafw.ISA(isafw_conf)
+        fs = isafw.ISA_filesystem()
+        fs.img_name = "TestPseudoImage"
+        fs.path_to_fs = fsroot_path
+        fs.pseudo_db = db_path
+        imageSecurityAnalyser.process_filesystem(fs)
+        report = isafw_conf.reportdir + "/fsa_problems_report_" + isafw_conf.machine + "_" + isafw_conf.timestamp
+        with open(report + "_TestPseudoImage", "r") as f:
+            content = f.read()
+        setuid_files = content.split("Files with SETUID bit set:\n")[1].split("\n\n")[0].split("\n")
+        self.assertTrue("/file5" in setuid_files, 'Output does not match')
+
+    def test_fsa_parallel_walk_order(self):
+        # the parallel walk gives the order of os.walk(), also when restored by key
+        from isaplugins import _walk
+        reference = []
+        for (dirpath, dirnames, filenames) in os.walk(fsroot_path):
+            if dirpath != fsroot_path:
+                reference.append(dirpath)
+            for f in filenames:
+                reference.append(dirpath + "/" + f)
+        self.assertEqual([entry.path for entry in _walk.walk(fsroot_path, 4)], reference)
+        entries = sorted(_walk.walk(fsroot_path, 4, ordered=False), key=lambda item: item[0])
+        self.assertEqual([entry.path for key, entry in entries], reference)
+
+    def test_fsa_walk_read_ahead_is_bounded(self):
+        # directories are not read further ahead of a slow consumer than
+        # MAX_PENDING_READS, in both orders
+        from isaplugins import _walk
+        tree = isafw_conf.reportdir + "/tree"
+        for i in range(8):
+            for j in range(8):
+                os.makedirs(tree + "/d%d/d%d" % (i, j))
+        reads = []
+        list_dir = _walk.list_dir
+        max_pending = _walk.MAX_PENDING_READS
+        _walk.list_dir = lambda path: reads.append(path) or list_dir(path)
+        _walk.MAX_PENDING_READS = 4
+        try:
+            for ordered in (True, False):
+                del reads[:]
+                consumed = 0
+                for item in _walk.walk(tree, 4, ordered):
+                    consumed += 1
+                    time.sleep(0.001)
+                    self.assertTrue(len(reads) <= consumed + 4 + 1)
+                self.assertEqual((consumed, len(reads)), (72, 73))
+        finally:
+            _walk.list_dir = list_dir
+            _walk.MAX_PENDING_READS = max_pending
+
+    def test_fsa_classify_modes(self):
+        # the bulk classification agrees with the rules applied mode by mode
+        from isaplugins import ISA_fsa_plugin
+        modes = range(0200000)
+        matches = ISA_fsa_plugin.classify_modes(modes)
+        for category, conditions in ISA_fsa_plugin.MODE_RULES:
+            self.assertEqual(matches[category],
+                             [index for index, mode in enumerate(modes)
+                              if ISA_fsa_plugin.match_mode_rule(conditions, mode)])
+
+    def test_fsa_classify_modes_numpy(self):
+        # the NumPy masks give the same matches as the loop over the modes
+        from isaplugins import ISA_fsa_plugin
+        if ISA_fsa_plugin.numpy is None:
+            self.skipTest("NumPy is not installed")
+        modes = range(0200000)
+        self.assertEqual(ISA_fsa_plugin._classify_modes_numpy(modes),
+                         ISA_fsa_plugin._classify_modes_python(modes))
+
     def perms_setup(self, fsroot_path):
         os.chmod(fsroot_path + "/file1", 0777)
         os.chown(fsroot_path + "/file2", 0, 0)
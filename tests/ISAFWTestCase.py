@@ -0,0 +1,118 @@
+#
+# ISAFWTestCase.py -  Test cases for the ISA FW core classes
+#
+# Copyright (c) 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+import unittest
+import sys
+from isafw import isafw
+import shutil
+import os
+import subprocess
+import time
+from isaplugins import ISA_fsa_plugin
+
+writers_path = "./isafw_core/output"
+
+
+class TestISAWriters(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(writers_path):
+            shutil.rmtree(writers_path)
+        os.makedirs(writers_path)
+        self.path = writers_path + "/log"
+
+    def tearDown(self):
+        shutil.rmtree(writers_path)
+
+    def read(self):
+        with open(self.path, "r") as f:
+            return f.read()
+
+    def test_writers_size_flush(self):
+        writers = isafw.ISA_writers(buffer_size=10, flush_interval=3600)
+        with writers.open(self.path, 'w') as f:
+            f.write("abc")
+        self.assertEqual(self.read(), "")
+        # the same writer is returned while the file is open
+        with writers.open(self.path, 'a') as f:
+            f.write("defghij")
+        self.assertEqual(self.read(), "abcdefghij")
+        writers.close()
+
+    def test_writers_time_flush(self):
+        # buffered data is written out after the flush interval, also if
+        # nothing more is written to the file
+        writers = isafw.ISA_writers(buffer_size=1024, flush_interval=1)
+        with writers.open(self.path, 'w') as f:
+            f.write("abc")
+        self.assertEqual(self.read(), "")
+        deadline = time.time() + 10
+        while not self.read() and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.read(), "abc")
+        writers.close()
+
+    def test_writers_reopen(self):
+        writers = isafw.ISA_writers(buffer_size=1024, flush_interval=3600)
+        with writers.open(self.path, 'w') as f:
+            f.write("old")
+        # mode 'w' truncates the file, also if it is still open
+        with writers.open(self.path, 'w') as f:
+            f.write("new")
+        writers.flush()
+        self.assertEqual(self.read(), "new")
+        with writers.open(self.path, 'a') as f:
+            f.write(" more")
+        writers.close(self.path)
+        self.assertEqual(self.read(), "new more")
+        writers.close()
+
+    def test_writers_closed_at_exit(self):
+        # the writers are closed by atexit if ISA did not close them
+        script = ("import sys; sys.path.insert(0, %r); from isaplugins import _writers; "
+                  "writers = _writers.ISA_writers(1024, 3600); "
+                  "writers.open(%r, 'w').write('buffered')" %
+                  (os.path.abspath(os.path.join("..", "isafw")), self.path))
+        subprocess.check_call([sys.executable, "-c", script])
+        self.assertEqual(self.read(), "buffered")
+
+    def test_writers_created_for_plugins(self):
+        # plugins can be used without ISA setting up the writers
+        conf = isafw.ISA_config()
+        conf.logdir = writers_path
+        conf.reportdir = writers_path
+        checker = ISA_fsa_plugin.ISA_FSChecker(conf)
+        self.assertTrue(conf.writers is not None)
+        self.assertTrue(checker.writers is conf.writers)
+        conf.writers.close()
+        with open(writers_path + "/isafw_fsalog", "r") as f:
+            self.assertTrue("initialized" in f.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -311,6 +311,169 @@ class TestKCAPlugin(unittest.TestCase):
                     'CONFIG_INTEGRITY_AUDIT': 'y'}
         self.validateReportOnAllArch("kca_problems_report", expected)
 
+    def test_kca_config_parser(self):
+        # options are matched by their whole name, string values are unquoted
+        # and only quoted again when they are written
+        from isaplugins import _kconfig
+        options = _kconfig.parse_config('#\n# Kernel Configuration\n#\n'
+                                        'CONFIG_KALLSYMS=y\n'
+                                        '# CONFIG_KALLSYMS_ALL is not set\n'
+                                        'CONFIG_DEBUG_BUG=y\n'
+                                        'CONFIG_CMDLINE="root=/dev/sda # quiet"\n'
+                                        'CONFIG_DEFAULT_SECURITY=""\n'
+                                        'CONFIG_EXTRA_FIRMWARE="a \\"b\\" \\\\c"\n')
+        self.assertEqual(options, {'CONFIG_KALLSYMS': 'y',
+                                   'CONFIG_KALLSYMS_ALL': 'not set',
+                                   'CONFIG_DEBUG_BUG': 'y',
+                                   'CONFIG_CMDLINE': 'root=/dev/sda # quiet',
+                                   'CONFIG_DEFAULT_SECURITY': '',
+                                   'CONFIG_EXTRA_FIRMWARE': 'a "b" \\c'})
+        self.assertTrue(isinstance(options['CONFIG_CMDLINE'], _kconfig.String))
+        self.assertFalse(isinstance(options['CONFIG_KALLSYMS'], _kconfig.String))
+        self.assertEqual(_kconfig.format_value(options['CONFIG_CMDLINE']), '"root=/dev/sda # quiet"')
+        self.assertEqual(_kconfig.format_value(options['CONFIG_DEFAULT_SECURITY']), '""')
+        self.assertEqual(_kconfig.format_value(options['CONFIG_EXTRA_FIRMWARE']), '"a \\"b\\" \\\\c"')
+        self.assertEqual(_kconfig.format_value(options['CONFIG_KALLSYMS_ALL']), 'not set')
+
+    def test_kca_rules_are_shared(self):
+        # the rules are compiled once and the values of a kernel do not leak into them
+        from isaplugins import ISA_kca_plugin
+        rules = ISA_kca_plugin.get_rules("x86")
+        self.assertTrue(rules is ISA_kca_plugin.get_rules("x86"))
+        result = ISA_kca_plugin.KernelResult(rules, {'CONFIG_KEYS': 'y'})
+        self.assertEqual(result.values["keys"]['CONFIG_KEYS'], 'y')
+        self.assertEqual(rules.defaults["keys"]['CONFIG_KEYS'], 'not set')
+        self.assertRaises(TypeError, rules.references["keys"].update, {'CONFIG_KEYS': 'n'})
+
+    def test_kca_rules_follow_config_changes(self):
+        # rules are compiled from the config sources they are versioned by,
+        # also when the modules were imported before the files changed
+        import shutil
+        from isaplugins import ISA_kca_plugin
+        import isaplugins.configs.kca.x86
+        config_dir = os.path.join(self.isafw_conf.reportdir, "configs")
+        shutil.copytree(ISA_kca_plugin.CONFIG_DIR, config_dir)
+        default_config_dir = ISA_kca_plugin.CONFIG_DIR
+        ISA_kca_plugin.CONFIG_DIR = config_dir
+        try:
+            rules = ISA_kca_plugin.get_rules("x86", self.isafw_conf.reportdir)
+            with open(os.path.join(config_dir, "x86.py"), "a") as f:
+                f.write("\nhardening_kco_ref['CONFIG_DEFAULT_MMAP_MIN_ADDR'] = '32768'\n")
+            changed_rules = ISA_kca_plugin.get_rules("x86", self.isafw_conf.reportdir)
+        finally:
+            ISA_kca_plugin.CONFIG_DIR = default_config_dir
+        self.assertEqual(rules.references["hardening"]['CONFIG_DEFAULT_MMAP_MIN_ADDR'], '65536')
+        self.assertEqual(changed_rules.references["hardening"]['CONFIG_DEFAULT_MMAP_MIN_ADDR'], '32768')
+        self.assertNotEqual(rules.version, changed_rules.version)
+        cached_rules = ISA_kca_plugin.RuleSet.load(os.path.join(
+            self.isafw_conf.reportdir, "kca_rules_x86_" + changed_rules.version + ".json"))
+        self.assertEqual(cached_rules.references, changed_rules.references)
+
+    def test_kca_rule_sources_read_on_change(self):
+        # the config modules are only read and hashed again when their size
+        # or modification time changes
+        import shutil
+        from isaplugins import ISA_kca_plugin
+        config_dir = os.path.join(self.isafw_conf.reportdir, "configs")
+        shutil.copytree(ISA_kca_plugin.CONFIG_DIR, config_dir)
+        path = os.path.join(config_dir, "x86.py")
+        default_config_dir = ISA_kca_plugin.CONFIG_DIR
+        ISA_kca_plugin.CONFIG_DIR = config_dir
+        try:
+            rules = ISA_kca_plugin.get_rules("x86")
+            source = ISA_kca_plugin._rule_sources[path]
+            self.assertTrue(ISA_kca_plugin.get_rules("x86") is rules)
+            self.assertTrue(ISA_kca_plugin._rule_sources[path] is source)
+            st = os.stat(path)
+            os.utime(path, (st.st_atime, st.st_mtime + 10))
+            self.assertTrue(ISA_kca_plugin.get_rules("x86") is rules)
+            self.assertFalse(ISA_kca_plugin._rule_sources[path] is source)
+            self.assertEqual(ISA_kca_plugin._rule_sources[path][1:], source[1:])
+        finally:
+            ISA_kca_plugin.CONFIG_DIR = default_config_dir
+
+    def test_kca_rule_verdicts(self):
+        # one-of, any-of, non-empty and conditional rules of the config modules
+        from isaplugins import ISA_kca_plugin
+        from isaplugins import _kconfig
+        rules = ISA_kca_plugin.get_rules("x86")
+        result = ISA_kca_plugin.KernelResult(rules, _kconfig.parse_config(
+            'CONFIG_RANDOMIZE_BASE_MAX_OFFSET=0x40000000\n'
+            'CONFIG_SECURITY_SMACK=y\n'
+            'CONFIG_DEFAULT_SECURITY="smack"\n'
+            'CONFIG_CMDLINE=""\n'
+            'CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS=y\n'
+            'CONFIG_KEYS=n\n'))
+        problems = set(verdict.option for group in ISA_kca_plugin.GROUPS
+                       for verdict in result.get_problems(group))
+        for option in ('CONFIG_RANDOMIZE_BASE_MAX_OFFSET', 'CONFIG_SECURITY_SELINUX',
+                       'CONFIG_DEFAULT_SECURITY', 'CONFIG_DEBUG_STRICT_USER_COPY_CHECKS'):
+            self.assertFalse(option in problems, option)
+        # an empty string is not a value, an option that is not set passes
+        # as before
+        for option in ('CONFIG_CMDLINE', 'CONFIG_KEYS', 'CONFIG_IMA_DEFAULT_HASH_SHA256',
+                       'CONFIG_X86_INTEL_MPX'):
+            self.assertTrue(option in problems, option)
+        for config in ('CONFIG_CMDLINE="quiet"\n', '# CONFIG_CMDLINE is not set\n'):
+            result = ISA_kca_plugin.KernelResult(rules, _kconfig.parse_config(config))
+            self.assertFalse('CONFIG_CMDLINE' in set(verdict.option for verdict in result.get_problems("hardening")))
+
+    def test_kca_compressed_configs(self):
+        # configs are also read from config.gz and from kernel images with IKCONFIG
+        import gzip
+        import io
+
+        def gzip_data(data):
+            output = io.BytesIO()
+            with gzip.GzipFile(fileobj=output, mode="wb") as f:
+                f.write(data)
+            return output.getvalue()
+
+        with open(KERNEL_CONFIGS["x86"], "rb") as f:
+            config = f.read()
+        vmlinux = b"\x7fELF\x02\x01\x01\x00" + os.urandom(100000) + \
+            b"IKCFG_ST" + gzip_data(config) + b"IKCFG_ED" + os.urandom(1000)
+        images = {"config.gz": gzip_data(config),
+                  "vmlinux": vmlinux,
+                  "bzImage": b"MZ\x00\x00" + os.urandom(20000) + gzip_data(vmlinux) + os.urandom(100)}
+        self.generateReport("x86")
+        with open(self.getReportFilePath("kca_full_report"), "r") as f:
+            expected = f.read().replace(KERNEL_CONFIGS["x86"], "")
+        for name, data in images.items():
+            path = os.path.join(self.isafw_conf.reportdir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            image_security_analyzer = isafw.ISA(self.isafw_conf)
+            kernel = isafw.ISA_kernel()
+            kernel.img_name = IMAGE_NAME
+            kernel.path_to_config = path
+            image_security_analyzer.process_kernel(kernel)
+            with open(self.getReportFilePath("kca_full_report"), "r") as f:
+                self.assertEqual(f.read().replace(path, ""), expected, name)
+
+    def test_kca_matrix_report(self):
+        # one row per option and one column per machine
+        import csv
+        self.isafw_conf.arch = "x86"
+        self.isafw_conf.machine = "matrix"
+        image_security_analyzer = isafw.ISA(self.isafw_conf)
+        kernels = []
+        for arch in ("x86", "arm"):
+            kernel = isafw.ISA_kernel()
+            kernel.img_name = IMAGE_NAME + arch
+            kernel.machine = "machine_" + arch
+            kernel.arch = arch
+            kernel.path_to_config = KERNEL_CONFIGS[arch]
+            kernels.append(kernel)
+        image_security_analyzer.process_kernels(kernels)
+        with open(os.path.join(self.isafw_conf.reportdir, "kca_matrix_report_matrix_" + TIMESTAMP + ".csv"), "r") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["Group", "Option", "Recommended", "machine_x86", "machine_arm", "Needs improvement"])
+        rows = dict((row[1], row[2:]) for row in rows[1:])
+        self.assertEqual(rows['CONFIG_KEYS'], ['y', 'y', 'y', '0'])
+        self.assertEqual(rows['CONFIG_X86_MSR'], ['not set', '! y', '', '1'])
+        self.assertEqual(rows['CONFIG_DEFAULT_MMAP_MIN_ADDR'], ['x86: 65536; arm: 32768', '! 4096', '! 4096', '2'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -33,6 +33,7 @@ import isaplugins
 
 import shutil
 import os
+import types
 from datetime import datetime
 
 isafw_conf = isafw.ISA_config()
@@ -82,5 +83,15 @@ class TestLACPlugin(unittest.TestCase):
                         "bash:BadLicense-1.1\n",
                         'Output does not match') 
 
+    def test_find_files_is_streamed(self):
+        # source files are yielded while the tree is walked
+        from isaplugins import ISA_la_plugin
+        checker = ISA_la_plugin.ISA_LicenseChecker(isafw_conf)
+        files = checker.find_files("./la_plugin")
+        self.assertTrue(isinstance(files, types.GeneratorType))
+        reference = [dirpath + "/" + f for dirpath, dirnames, filenames in os.walk("./la_plugin")
+                     for f in filenames]
+        self.assertEqual(sorted(files), sorted(reference))
+
 if __name__ == '__main__':
     unittest.main()
@@ -38,6 +38,7 @@ if __name__ == "__main__":
     from FSAPluginTestCase import *
     from KCAPluginTestCase import *
     from LACPluginTestCase import *
+    from ISAFWTestCase import *
 
     suite = unittest.TestLoader().loadTestsFromTestCase(TestCVEPlugin)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -48,8 +49,14 @@ if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestCFAPlugin)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCFAHelpers)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
     suite = unittest.TestLoader().loadTestsFromTestCase(TestFSAPlugin)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
     suite = unittest.TestLoader().loadTestsFromTestCase(TestLACPlugin)
     unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestISAWriters)
+    unittest.TextTestRunner(verbosity=2).run(suite)